@@ -4,6 +4,9 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
+from django.db import transaction
+from django.db.models import ProtectedError
+from apps.payments import ledger
 from .models import User
 from .serializers import UserSerializer, UserRegistrationSerializer
 from .otp_service import generate_otp, store_otp, verify_otp
@@ -55,6 +58,7 @@ def technician_signup(request):
     logger = logging.getLogger(__name__)
     
     from apps.technicians.models import TechnicianProfile, TechnicianLocation
+    from apps.technicians import uploads
     
     # Log incoming request data (without sensitive info)
     logger.info(f"Technician signup request - email: {request.data.get('email')}")
@@ -65,7 +69,8 @@ def technician_signup(request):
                        'phone_number', 'id_number', 'profile_photo', 'id_front_photo', 
                        'id_back_photo', 'selfie_with_id']
     
-    missing_fields = [f for f in required_fields if not request.data.get(f)]
+    # Images may be sent inline or as finalized chunked uploads (<field>_upload_id, see technicians/uploads.py)
+    missing_fields = [f for f in required_fields if not uploads.provided(request.data, f)]
     if missing_fields:
         logger.warning(f"Missing fields: {missing_fields}")
         return Response({'error': f'{missing_fields[0]} is required'}, status=status.HTTP_400_BAD_REQUEST)
@@ -97,8 +102,14 @@ def technician_signup(request):
             return Response({'error': 'A technician account with this email already exists. Please login instead.'}, status=status.HTTP_400_BAD_REQUEST)
         # User exists but no technician profile - delete and recreate
         # First delete any orphaned profiles just in case
-        TechnicianProfile.objects.filter(user=existing_user).delete()
-        existing_user.delete()
+        try:
+            with transaction.atomic():
+                TechnicianProfile.objects.filter(user=existing_user).delete()
+                ledger.close_empty_accounts([existing_user])
+                existing_user.delete()
+        except ProtectedError:
+            # The account has money history in the ledger and is never deleted
+            return Response({'error': 'An account with this email already exists. Please login instead.'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
         # Use transaction.atomic to ensure all-or-nothing database operations
@@ -116,6 +127,9 @@ def technician_signup(request):
             user.last_name = request.data.get('last_name')
             user.save()
             
+            images = {field: request.data.get(field) for field in TechnicianProfile.IMAGE_FIELDS}
+            images.update(uploads.claim(request.data, TechnicianProfile.IMAGE_FIELDS, user))
+            
             # Create technician profile with KYC data using get_or_create to avoid duplicates
             profile, created = TechnicianProfile.objects.get_or_create(
                 user=user,
@@ -125,10 +139,10 @@ def technician_signup(request):
                     'bio': request.data.get('bio', ''),
                     'experience_years': int(request.data.get('experience_years', 0)),
                     'id_number': request.data.get('id_number'),
-                    'profile_photo': request.data.get('profile_photo'),
-                    'id_front_photo': request.data.get('id_front_photo'),
-                    'id_back_photo': request.data.get('id_back_photo'),
-                    'selfie_with_id': request.data.get('selfie_with_id'),
+                    'profile_photo': images['profile_photo'],
+                    'id_front_photo': images['id_front_photo'],
+                    'id_back_photo': images['id_back_photo'],
+                    'selfie_with_id': images['selfie_with_id'],
                     'kyc_status': 'pending',
                     'verification_status': 'pending'
                 }
@@ -141,10 +155,10 @@ def technician_signup(request):
                 profile.bio = request.data.get('bio', '')
                 profile.experience_years = int(request.data.get('experience_years', 0))
                 profile.id_number = request.data.get('id_number')
-                profile.profile_photo = request.data.get('profile_photo')
-                profile.id_front_photo = request.data.get('id_front_photo')
-                profile.id_back_photo = request.data.get('id_back_photo')
-                profile.selfie_with_id = request.data.get('selfie_with_id')
+                profile.profile_photo = images['profile_photo']
+                profile.id_front_photo = images['id_front_photo']
+                profile.id_back_photo = images['id_back_photo']
+                profile.selfie_with_id = images['selfie_with_id']
                 profile.kyc_status = 'pending'
                 profile.verification_status = 'pending'
                 profile.save()
@@ -180,6 +194,8 @@ def technician_signup(request):
             'email': user.email
         }, status=status.HTTP_201_CREATED)
         
+    except uploads.UploadError as e:
+        return Response({'error': str(e)}, status=e.status)
     except Exception as e:
         import traceback
         logger.error(f"Technician signup error: {str(e)}")
@@ -359,9 +375,14 @@ def cleanup_user(request):
     
     try:
         user = User.objects.get(email=email)
-        # Delete profile first
-        TechnicianProfile.objects.filter(user=user).delete()
-        user.delete()
+        with transaction.atomic():
+            # Delete profile first
+            TechnicianProfile.objects.filter(user=user).delete()
+            ledger.close_empty_accounts([user])
+            user.delete()
         return Response({'message': f'User {email} deleted successfully'})
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    except ProtectedError:
+        return Response({'error': 'User has wallet history in the ledger and cannot be deleted; deactivate them instead'},
+                        status=status.HTTP_409_CONFLICT)
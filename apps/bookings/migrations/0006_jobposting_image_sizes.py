@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_alter_booking_payment_method_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobposting',
+            name='image_sizes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:21
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_completed_at(apps, schema_editor):
+    """
+    Jobs completed before the field existed: their last update is the best
+    record of completion left, and is what auto-release used until now.
+    """
+    JobPosting = apps.get_model('bookings', 'JobPosting')
+    JobPosting.objects.filter(status='completed', completed_at__isnull=True).update(completed_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_jobposting_image_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobposting',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_completed_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:29
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def flag_pending_images(apps, schema_editor):
+    """Flag jobs whose blob images have no recorded derivatives yet"""
+    JobPosting = apps.get_model('bookings', 'JobPosting')
+    rows = JobPosting.objects.exclude(images=[]).values_list('pk', 'images', 'image_sizes')
+    pending = [
+        pk for pk, images, recorded in rows.iterator(chunk_size=BATCH_SIZE)
+        if isinstance(images, list) and any(
+            isinstance(image, str) and image.startswith('blob:') and image not in (recorded or {}) for image in images
+        )
+    ]
+    for start in range(0, len(pending), BATCH_SIZE):
+        JobPosting.objects.filter(pk__in=pending[start:start + BATCH_SIZE]).update(image_sizes_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_jobposting_completed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobposting',
+            name='image_sizes_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='jobposting',
+            index=models.Index(condition=models.Q(('image_sizes_pending', True)), fields=['id'], name='job_image_sizes_pending'),
+        ),
+        migrations.RunPython(flag_pending_images, migrations.RunPython.noop),
+    ]
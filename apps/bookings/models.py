@@ -1,5 +1,4 @@
 from django.db import models
-from django.conf import settings
 from apps.accounts.models import User
 from django.utils import timezone
 
@@ -47,8 +46,10 @@ class JobPosting(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     urgency = models.CharField(max_length=20, choices=URGENCY_CHOICES, default='medium')
     
-    # Images of the problem
+    # Images of the problem: blob keys or URLs (base64 uploads are moved to blob storage on save)
     images = models.JSONField(default=list)
+    image_sizes = models.JSONField(default=dict, blank=True)  # Resized copies (see apps/core/images.py)
+    image_sizes_pending = models.BooleanField(default=False)  # Some images have no resized copies yet
     
     # Location
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
@@ -86,9 +87,13 @@ class JobPosting(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     expires_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)  # Technician marked it done; starts the auto-release grace period
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(image_sizes_pending=True), name='job_image_sizes_pending'),
+        ]
     
     def __str__(self):
         return f"Job #{self.id} - {self.title}"
@@ -96,12 +101,22 @@ class JobPosting(models.Model):
     def is_open(self):
         return self.status == 'open'
     
+    def save(self, *args, **kwargs):
+        from apps.core import blobs, images
+        update_fields = kwargs.get('update_fields')
+        saving = 'images' not in self.get_deferred_fields() and (update_fields is None or 'images' in update_fields)
+        if saving and isinstance(self.images, list):
+            self.images = [blobs.externalize(image) for image in self.images]
+        if saving:
+            kwargs['update_fields'] = images.mark(self, 'images', 'image_sizes', 'image_sizes_pending', update_fields)
+        super().save(*args, **kwargs)
+        if saving:
+            images.changed(self, 'images', 'image_sizes', 'image_sizes_pending')
+    
     def calculate_fees(self, amount):
-        """Calculate platform fee (15%) and technician earnings"""
-        from decimal import Decimal
-        commission_rate = Decimal('0.15')  # 15% platform fee
-        self.platform_fee = amount * commission_rate
-        self.technician_earnings = amount - self.platform_fee
+        """Calculate platform fee and technician earnings at the assigned technician's rate"""
+        from apps.payments import fees
+        self.platform_fee, self.technician_earnings = fees.calculate(amount, self.assigned_technician_id)
         return self.platform_fee, self.technician_earnings
     
     def accept_bid(self, bid):
@@ -221,9 +236,8 @@ class Booking(models.Model):
     def calculate_fees(self):
         """Calculate platform and technician fees based on cost"""
         if self.cost:
-            commission_rate = getattr(settings, 'PLATFORM_COMMISSION_RATE', 0.15)
-            self.platform_fee = self.cost * commission_rate
-            self.technician_fee = self.cost - self.platform_fee
+            from apps.payments import fees
+            self.platform_fee, self.technician_fee = fees.calculate(self.cost, self.technician_id)
     
     def save(self, *args, **kwargs):
         if self.cost and not self.platform_fee:
@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from .models import Booking, JobPosting, Bid
 from apps.accounts.serializers import UserSerializer
+from apps.core.blobs import BlobField
+from apps.core.images import ImageSizesField
+from apps.technicians.models import TechnicianProfile
+from apps.technicians.serializers import TechnicianCardSerializer
 
 
 class BookingSerializer(serializers.ModelSerializer):
@@ -25,10 +29,13 @@ class JobPostingSerializer(serializers.ModelSerializer):
     customer = UserSerializer(read_only=True)
     assigned_technician = UserSerializer(read_only=True)
     bids_count = serializers.SerializerMethodField()
+    images = serializers.ListField(child=BlobField(), required=False)
+    image_sizes = ImageSizesField('images', 'image_sizes')
     
     class Meta:
         model = JobPosting
         fields = '__all__'
+        read_only_fields = ['completed_at']
     
     def get_bids_count(self, obj):
         return obj.bids.count()
@@ -47,12 +54,13 @@ class JobPostingListSerializer(serializers.ModelSerializer):
     customer_name = serializers.SerializerMethodField()
     bids_count = serializers.SerializerMethodField()
     time_ago = serializers.SerializerMethodField()
+    image_sizes = ImageSizesField('images', 'image_sizes')
     
     class Meta:
         model = JobPosting
         fields = ['id', 'title', 'category', 'urgency', 'address',
                   'budget_min', 'budget_max', 'status', 'customer_name',
-                  'bids_count', 'time_ago', 'created_at', 'latitude', 'longitude']
+                  'bids_count', 'time_ago', 'created_at', 'latitude', 'longitude', 'image_sizes']
     
     def get_customer_name(self, obj):
         return obj.customer.full_name or obj.customer.email.split('@')[0]
@@ -89,16 +97,9 @@ class BidSerializer(serializers.ModelSerializer):
     def get_technician_profile(self, obj):
         try:
             profile = obj.technician.technician_profile
-            return {
-                'rating': float(profile.rating),
-                'total_ratings': profile.total_ratings,
-                'completed_jobs': profile.completed_jobs_count,
-                'trust_score': profile.trust_score,
-                'profile_photo': profile.profile_photo,
-                'kyc_verified': profile.kyc_status == 'approved'
-            }
-        except:
+        except TechnicianProfile.DoesNotExist:
             return None
+        return TechnicianCardSerializer(profile, context=self.context).data
     
     def get_job_details(self, obj):
         """Include job details for technician's my bids view"""
@@ -26,13 +26,13 @@ def match_technicians(booking_id):
             verification_status='approved',
             skills__contains=[booking.category],
             is_online=True
-        ).select_related('user')
+        ).only('user', 'rating')
         
         # Calculate distances and filter by service area
         matched_technicians = []
         for tech_profile in technicians:
             try:
-                tech_location = TechnicianLocation.objects.get(technician=tech_profile.user)
+                tech_location = TechnicianLocation.objects.get(technician_id=tech_profile.user_id)
                 distance = TechnicianLocation.calculate_distance(
                     tech_location.latitude,
                     tech_location.longitude,
@@ -42,7 +42,7 @@ def match_technicians(booking_id):
                 
                 if distance <= tech_location.service_radius_km:
                     matched_technicians.append({
-                        'technician_id': tech_profile.user.id,
+                        'technician_id': tech_profile.user_id,
                         'distance': distance,
                         'rating': float(tech_profile.rating)
                     })
@@ -2,13 +2,17 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from django.db.models import Q
+from django.db.models import Q, Count, Max, Prefetch
+from django.utils import timezone
 from .models import Booking, JobPosting, Bid
 from .serializers import (
     BookingSerializer, BookingCreateSerializer,
     JobPostingSerializer, JobPostingCreateSerializer, JobPostingListSerializer,
     BidSerializer, BidCreateSerializer, BidListSerializer
 )
+from apps.core.idempotency import idempotent
+from apps.core.conditional import conditional, make_etag
+from apps.technicians.models import TechnicianProfile
 
 
 class BookingViewSet(viewsets.ModelViewSet):
@@ -48,6 +52,23 @@ class BookingViewSet(viewsets.ModelViewSet):
         return Response(BookingSerializer(booking).data)
 
 
+def _with_cards(bids):
+    """Bids with their technicians and card-projected profiles loaded in bulk"""
+    return bids.select_related('technician').prefetch_related(
+        Prefetch('technician__technician_profile', queryset=TechnicianProfile.objects.projection('card'))
+    )
+
+
+def _job_etag(request, pk=None):
+    """Version of a job, its customer and technician, and its bids - one query"""
+    if not str(pk).isdigit():
+        return None
+    row = JobPosting.objects.filter(pk=pk).values_list(
+        'updated_at', 'customer__updated_at', 'assigned_technician__updated_at'
+    ).annotate(bids_total=Count('bids'), bids_changed=Max('bids__updated_at')).order_by('pk').first()
+    return make_etag(*row) if row else None
+
+
 class JobPostingViewSet(viewsets.ModelViewSet):
     """ViewSet for job postings - customers post, technicians bid"""
     queryset = JobPosting.objects.all()
@@ -84,6 +105,10 @@ class JobPostingViewSet(viewsets.ModelViewSet):
         
         return queryset.order_by('-created_at')
     
+    @conditional(etag=_job_etag, cache_control={'private': True, 'no_cache': True})
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
     def create(self, request):
         """Customer creates a job posting"""
         serializer = JobPostingCreateSerializer(data=request.data)
@@ -99,11 +124,12 @@ class JobPostingViewSet(viewsets.ModelViewSet):
         if job.customer != request.user:
             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
         
-        bids = job.bids.all().order_by('amount')
+        bids = _with_cards(job.bids.all()).order_by('amount')
         serializer = BidSerializer(bids, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
+    @idempotent
     def accept_bid(self, request, pk=None):
         """Customer accepts a bid"""
         job = self.get_object()
@@ -161,6 +187,7 @@ class JobPostingViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Job must be in progress to complete'}, status=status.HTTP_400_BAD_REQUEST)
         
         job.status = 'completed'
+        job.completed_at = timezone.now()
         job.save()
         
         return Response({
@@ -179,39 +206,19 @@ class JobPostingViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Job must be completed first'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Release payment if exists
-        from apps.payments.models import JobPayment, Wallet, PlatformEarnings
-        from django.utils import timezone
-        from django.db import transaction as db_transaction
+        from apps.payments.models import JobPayment
+        from apps.payments import escrow
         
         try:
             job_payment = job.job_payment
-            if job_payment.status == 'held':
-                with db_transaction.atomic():
-                    # Credit technician's wallet
-                    technician_wallet, _ = Wallet.objects.get_or_create(
-                        user=job_payment.technician
-                    )
-                    technician_wallet.credit(
-                        amount=job_payment.technician_amount,
-                        transaction_type='earning',
-                        reference=job_payment.payment_ref,
-                        metadata={
-                            'job_id': job.id,
-                            'job_title': job.title,
-                            'total_paid': str(job_payment.amount_paid),
-                            'platform_fee': str(job_payment.platform_fee)
-                        }
-                    )
-                    
-                    # Update payment status
-                    job_payment.status = 'released'
-                    job_payment.released_at = timezone.now()
-                    job_payment.save()
-                    
-                    # Update job payment status
-                    job.payment_status = 'released'
-                    job.save()
-                
+            released = escrow.release(job_payment, metadata={
+                'job_id': job.id,
+                'job_title': job.title,
+                'total_paid': str(job_payment.amount_paid),
+                'platform_fee': str(job_payment.platform_fee)
+            })
+            if released:
+                job.refresh_from_db()
                 return Response({
                     'message': f'Job approved! KES {job_payment.technician_amount} released to technician.',
                     'job': JobPostingSerializer(job).data,
@@ -245,6 +252,7 @@ class BidViewSet(viewsets.ModelViewSet):
         """Technicians see their own bids"""
         return Bid.objects.filter(technician=self.request.user)
     
+    @idempotent
     def create(self, request):
         """Technician places a bid"""
         # Check if technician is verified
@@ -290,6 +298,6 @@ class BidViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_bids(self, request):
         """Get all bids for the current technician with job details"""
-        bids = Bid.objects.filter(technician=request.user).select_related('job').order_by('-created_at')
+        bids = _with_cards(Bid.objects.filter(technician=request.user)).select_related('job__customer').order_by('-created_at')
         serializer = BidSerializer(bids, many=True)
         return Response(serializer.data)
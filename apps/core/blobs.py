@@ -0,0 +1,180 @@
+"""
+Content-addressed blob storage for uploaded images
+
+Clients send images as base64 strings (optionally as ``data:`` URIs). Keeping
+them inline made every row that holds one megabytes wide. ``externalize()``
+writes the decoded bytes to the storage configured in ``BLOB_STORAGE`` (any
+Django storage class; the local filesystem by default) under their SHA-256,
+and returns a short ``blob:`` key to keep on the row instead. Identical
+uploads share one file.
+
+Blobs are not served from a public directory. ``url()`` returns a signed
+link to the ``serve_blob`` view: public images (profile photos) get a stable
+link, private ones (KYC documents) a link that expires after
+``BLOB_PRIVATE_URL_MAX_AGE`` seconds. Values that are not keys (external
+URLs, or inline images not yet migrated) are passed through unchanged.
+"""
+import base64
+import binascii
+import hashlib
+import mimetypes
+import re
+import tempfile
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile, File
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+
+KEY_PREFIX = 'blob:'
+PUBLIC_SALT = 'apps.core.blobs.public'
+PRIVATE_SALT = 'apps.core.blobs.private'
+
+DATA_URI = re.compile(r'^data:(?P<type>[\w.+-]+/[\w.+-]+)?(;[\w-]+=[^;,]*)*;base64,', re.IGNORECASE)
+# Magic numbers of the formats clients upload, for raw base64 without a data: URI
+SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF8', '.gif'),
+    (b'%PDF', '.pdf'),
+)
+MIN_INLINE_LENGTH = 64
+# put_stream() keeps up to this much in memory before spilling to a temporary file
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+@lru_cache(maxsize=1)
+def storage():
+    config = settings.BLOB_STORAGE
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def is_key(value):
+    return isinstance(value, str) and value.startswith(KEY_PREFIX)
+
+
+def _extension(data, content_type=None):
+    if content_type:
+        extension = mimetypes.guess_extension(content_type)
+        if extension:
+            return '.jpg' if extension == '.jpe' else extension
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return '.bin'
+
+
+def decode_inline(value):
+    """(bytes, extension) for a base64 image or data: URI, or None if value is not one"""
+    if not isinstance(value, str) or len(value) < MIN_INLINE_LENGTH or is_key(value) or '://' in value[:16]:
+        return None
+    content_type = None
+    match = DATA_URI.match(value)
+    if match:
+        content_type = match.group('type')
+        value = value[match.end():]
+    try:
+        data = base64.b64decode(''.join(value.split()), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return data, _extension(data, content_type)
+
+
+def _save(digest, extension, content):
+    name = f'{digest[:2]}/{digest}{extension}'
+    if not storage().exists(name):
+        saved = storage().save(name, content)
+        if saved != name:
+            # Lost a race with an identical upload; keep the first copy
+            storage().delete(saved)
+    return KEY_PREFIX + name
+
+
+def put(data, extension=''):
+    """Store bytes under their SHA-256 and return the blob key"""
+    return _save(hashlib.sha256(data).hexdigest(), extension, ContentFile(data))
+
+
+def put_stream(chunks, content_type=None, sha256=None):
+    """Store an iterable of byte strings like put() without holding them all in memory.
+
+    Raises ValueError, storing nothing, if ``sha256`` (hex) is given and the
+    content does not match it.
+    """
+    digest = hashlib.sha256()
+    head = b''
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as spool:
+        for chunk in chunks:
+            if len(head) < 16:
+                head += chunk[:16 - len(head)]
+            digest.update(chunk)
+            spool.write(chunk)
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise ValueError(f"SHA-256 mismatch: expected {sha256}, got {digest.hexdigest()}")
+        spool.seek(0)
+        return _save(digest.hexdigest(), _extension(head, content_type), File(spool, name='upload'))
+
+
+def externalize(value):
+    """Move an inline base64 image to blob storage; anything else is returned unchanged"""
+    inline = decode_inline(value)
+    if inline is None:
+        return value
+    return put(*inline)
+
+
+def name_of(key):
+    return key[len(KEY_PREFIX):]
+
+
+def open_blob(key):
+    return storage().open(name_of(key), 'rb')
+
+
+def read(key):
+    with open_blob(key) as blob:
+        return blob.read()
+
+
+def url(value, private=False, request=None):
+    """Link to serve a stored value: a signed blob URL for keys, the value itself otherwise"""
+    if not is_key(value):
+        return value
+    if private:
+        token = signing.TimestampSigner(salt=PRIVATE_SALT).sign(name_of(value))
+    else:
+        token = signing.Signer(salt=PUBLIC_SALT).sign(name_of(value))
+    path = reverse('serve_blob', kwargs={'token': token})
+    if request is not None:
+        return request.build_absolute_uri(path)
+    return getattr(settings, 'BLOB_URL_BASE', '') + path
+
+
+def unsign(token):
+    """(storage name, private) for a URL token; raises signing.BadSignature"""
+    try:
+        return signing.Signer(salt=PUBLIC_SALT).unsign(token), False
+    except signing.BadSignature:
+        max_age = getattr(settings, 'BLOB_PRIVATE_URL_MAX_AGE', 3600)
+        return signing.TimestampSigner(salt=PRIVATE_SALT).unsign(token, max_age=max_age), True
+
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+class BlobField(serializers.CharField):
+    """Accepts base64 / URL strings like a CharField and renders stored blobs as signed URLs"""
+
+    def __init__(self, private=False, **kwargs):
+        self.private = private
+        kwargs.setdefault('allow_blank', True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return url(value, private=self.private, request=self.context.get('request'))
@@ -0,0 +1,95 @@
+"""
+Conditional GET support for read-heavy endpoints
+
+Mobile clients refetch the same profiles, lists and job details over and
+over. ``@conditional`` answers ``If-None-Match`` / ``If-Modified-Since`` with
+a 304 using a cheap version lookup (usually one aggregate over ``updated_at``
+columns, or a stamp kept in the cache), so the view body and its
+serializers only run when the client's copy is stale.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def _find_request(args):
+    """Locate the DRF request in a function view or viewset method call"""
+    for arg in args[:2]:
+        if isinstance(arg, Request):
+            return arg
+    raise TypeError("conditional() must wrap a DRF view or viewset method")
+
+
+def make_etag(*parts):
+    """Weak ETag from version parts such as timestamps, counts and ids"""
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/{quote_etag(digest)}'
+
+
+def _timestamp(last_modified):
+    return int(last_modified.timestamp()) if last_modified else None
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        if not etag:
+            return False
+        # Weak comparison (RFC 9110 13.1.2): ignore the W/ prefix on both sides
+        etags = {tag.removeprefix('W/') for tag in parse_etags(if_none_match)}
+        return '*' in etags or etag.removeprefix('W/') in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+    return bool(if_modified_since and last_modified and _timestamp(last_modified) <= if_modified_since)
+
+
+def _set_headers(response, etag, last_modified, cache_control):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(_timestamp(last_modified))
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+
+
+def conditional(etag=None, last_modified=None, cache_control=None):
+    """Serve 304 Not Modified when the client's copy is current.
+
+    ``etag`` and ``last_modified`` are called with the view's request and URL
+    kwargs and return an ETag string (see ``make_etag``) or a datetime, or
+    None when the resource is missing. Either may be omitted. Place the
+    decorator below ``@api_view``/``@permission_classes`` (or on a viewset
+    method) so authentication and permissions run first. ``cache_control``
+    is passed to ``patch_cache_control`` on 200 and 304 responses, e.g.
+    ``{'public': True, 'max_age': 60}``.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            request = _find_request(args)
+            if request.method not in SAFE_METHODS:
+                return view_func(*args, **kwargs)
+
+            current_etag = etag(request, **kwargs) if etag else None
+            current_modified = last_modified(request, **kwargs) if last_modified else None
+            if (current_etag or current_modified) and _not_modified(request, current_etag, current_modified):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                _set_headers(response, current_etag, current_modified, cache_control)
+                return response
+
+            response = view_func(*args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                if etag and current_etag is None:
+                    # The view may have created what the version is read from (e.g. a cache stamp)
+                    current_etag = etag(request, **kwargs)
+                _set_headers(response, current_etag, current_modified, cache_control)
+            return response
+        return wrapper
+    return decorator
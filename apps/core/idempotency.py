@@ -0,0 +1,121 @@
+"""
+Idempotency-Key support for mutating endpoints
+
+Mobile clients on flaky networks retry POSTs. When a request carries an
+``Idempotency-Key`` header, the first response is stored under that key and
+replayed for any retry. A retry that arrives while the first request is still
+running waits briefly for the result and otherwise gets a 409, so the view
+body never runs twice for the same key.
+"""
+import hashlib
+import json
+import time
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def _find_request(args):
+    """Locate the DRF request in a function view or viewset method call"""
+    for arg in args[:2]:
+        if isinstance(arg, Request):
+            return arg
+    raise TypeError("idempotent() must wrap a DRF view or viewset method")
+
+
+def _cache_keys(request, key):
+    user_id = request.user.pk if request.user and request.user.is_authenticated else 'anon'
+    digest = hashlib.sha256(f"{user_id}:{request.method}:{request.path}:{key}".encode()).hexdigest()
+    return f"idempotency:{digest}:response", f"idempotency:{digest}:lock"
+
+
+def _fingerprint(request):
+    """Hash of the request payload, used to reject a key reused with a different body"""
+    try:
+        payload = json.dumps(request.data, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        payload = repr(request.data)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'success': False, 'error': 'Idempotency-Key was already used with a different request body'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(stored['data'], status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_func):
+    """Replay the stored response for requests that repeat an Idempotency-Key.
+
+    Works on ``@api_view`` functions and on viewset methods; place it below
+    ``@api_view``/``@action`` so it receives the DRF request. Requests without
+    the header are passed straight through.
+    """
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        request = _find_request(args)
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_func(*args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'success': False, 'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400)
+        lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 120)
+        wait_seconds = getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 5)
+
+        result_key, lock_key = _cache_keys(request, key)
+        fingerprint = _fingerprint(request)
+
+        stored = cache.get(result_key)
+        if stored:
+            return _replay(stored, fingerprint)
+
+        # cache.add is atomic, so only one request per key gets to execute
+        if not cache.add(lock_key, fingerprint, lock_timeout):
+            deadline = time.monotonic() + wait_seconds
+            while time.monotonic() < deadline:
+                time.sleep(0.1)
+                stored = cache.get(result_key)
+                if stored:
+                    return _replay(stored, fingerprint)
+            logger.info(f"Idempotency-Key {key} still in progress, returning conflict")
+            return Response(
+                {'success': False, 'error': 'A request with this Idempotency-Key is still being processed'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        try:
+            # The first request may have stored its result and released the lock since the check above
+            stored = cache.get(result_key)
+            if stored:
+                return _replay(stored, fingerprint)
+            response = view_func(*args, **kwargs)
+            # Server errors are not stored so the client can retry them
+            if response.status_code < 500 and hasattr(response, 'data'):
+                cache.set(result_key, {
+                    'status': response.status_code,
+                    'data': response.data,
+                    'fingerprint': fingerprint,
+                }, ttl)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
@@ -0,0 +1,204 @@
+"""
+Image derivatives
+
+Mobile list screens only need a small picture. Every stored image (see
+blobs.py) gets resized copies: thumbnail, card and full, each bounded by
+``IMAGE_DERIVATIVE_SIZES`` on its longest edge. They are WebP, or JPEG when
+Pillow lacks WebP support, with the EXIF orientation applied and all
+metadata (GPS included) dropped. The copies are blobs too, and a row
+records them in a JSON field as ``{source key: {size: derivative key}}``.
+Serializers can therefore return a URL per size without another query,
+falling back to the original until the copies exist.
+
+A save that leaves sources without an entry sets the row's pending flag
+(``mark``), a partially indexed boolean, so the worker finds its work
+without reading any images column. ``manage.py process_image_derivatives``
+renders them in a process pool and clears the flags. With
+``IMAGE_DERIVATIVES_INLINE`` set, a save renders its own images after commit
+instead of waiting for the worker.
+"""
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction as db_transaction
+from rest_framework import serializers
+
+from . import blobs
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {'thumbnail': 160, 'card': 480, 'full': 1280}
+# (model, image field, derivatives field, pending flag); image fields hold one key or a list of keys
+TARGETS = (
+    ('technicians.TechnicianProfile', 'profile_photo', 'photo_sizes', 'photo_sizes_pending'),
+    ('bookings.JobPosting', 'images', 'image_sizes', 'image_sizes_pending'),
+)
+
+
+def sizes():
+    return getattr(settings, 'IMAGE_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+
+def _output_format():
+    from PIL import features
+    return ('WEBP', '.webp') if features.check('webp') else ('JPEG', '.jpg')
+
+
+def _encode(image, image_format):
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+    output = io.BytesIO()
+    # A fresh save writes no EXIF, ICC or XMP unless asked to
+    image.save(output, format=image_format, quality=82, optimize=image_format == 'JPEG')
+    return output.getvalue()
+
+
+def render(data, edges, image_format='WEBP'):
+    """{name: bytes} of the image scaled to fit each of `edges` ({name: pixels}), upright and without metadata"""
+    from PIL import Image, ImageOps
+
+    rendered = {}
+    with Image.open(io.BytesIO(data)) as image:
+        # Let the JPEG decoder downscale while decoding; the largest size still gets enough pixels
+        image.draft('RGB', (max(edges.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        # Largest first, each scaled from the previous one instead of from the original
+        for name, edge in sorted(edges.items(), key=lambda item: -item[1]):
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            rendered[name] = _encode(image, image_format)
+    return rendered
+
+
+def derive(key):
+    """(key, {size: derivative key}) for one stored image; the map is empty if it is not an image"""
+    from PIL import Image, UnidentifiedImageError
+
+    image_format, extension = _output_format()
+    try:
+        rendered = render(blobs.read(key), sizes(), image_format)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+        logger.warning(f"Could not derive images for {key}: {e}")
+        return key, {}
+    return key, {name: blobs.put(data, extension) for name, data in rendered.items()}
+
+
+def _sources(value):
+    values = value if isinstance(value, list) else [value]
+    return [item for item in values if blobs.is_key(item)]
+
+
+def missing(instance, image_field, sizes_field):
+    """Source keys on the row that have no recorded derivatives yet"""
+    recorded = getattr(instance, sizes_field) or {}
+    return [key for key in _sources(getattr(instance, image_field)) if key not in recorded]
+
+
+def mark(instance, image_field, sizes_field, pending_field, update_fields=None):
+    """Call from save() before writing the image field: set the pending flag.
+
+    Returns `update_fields` with the flag added, for saves that name their fields.
+    """
+    # A deferred derivatives field is not worth a query; the worker sorts it out
+    pending = sizes_field in instance.get_deferred_fields() or bool(missing(instance, image_field, sizes_field))
+    setattr(instance, pending_field, pending)
+    return None if update_fields is None else {*update_fields, pending_field}
+
+
+def pending(model, pending_field):
+    """Primary keys of rows with images that still need derivatives"""
+    return list(model.objects.filter(**{pending_field: True}).order_by('pk').values_list('pk', flat=True))
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # Never share the parent's database connections
+    connections.close_all()
+
+
+def derive_many(keys, workers=1):
+    """{key: {size: derivative key}} rendered across `workers` processes"""
+    keys = list(dict.fromkeys(keys))
+    if workers > 1 and len(keys) > 1:
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            return dict(pool.map(derive, keys))
+    return dict(derive(key) for key in keys)
+
+
+def process(model, image_field, sizes_field, pending_field, pks, workers=1):
+    """Render and record the missing derivatives of these rows. Returns the rows updated."""
+    instances = list(model.objects.filter(pk__in=pks).only('pk', image_field, sizes_field))
+    rendered = derive_many([key for instance in instances for key in missing(instance, image_field, sizes_field)], workers)
+
+    updated = 0
+    # Re-read under lock: images saved while rendering must stay pending, not be cleared with the rest
+    with db_transaction.atomic():
+        for instance in model.objects.select_for_update().filter(pk__in=pks):
+            sources = _sources(getattr(instance, image_field))
+            recorded = getattr(instance, sizes_field) or {}
+            # Unreadable images are recorded with no sizes so they are not retried forever
+            recorded = {
+                key: recorded[key] if key in recorded else rendered[key]
+                for key in sources if key in recorded or key in rendered
+            }
+            still_pending = len(recorded) < len(set(sources))
+            if recorded != getattr(instance, sizes_field) or still_pending != getattr(instance, pending_field):
+                setattr(instance, sizes_field, recorded)
+                setattr(instance, pending_field, still_pending)
+                # save() rather than update() so caches built from the row are refreshed by its signals
+                instance.save(update_fields=[sizes_field, pending_field, 'updated_at'])
+                updated += 1
+    return updated
+
+
+def run(batch_size=100, workers=1):
+    """Render every pending image of every registered field. Returns rows updated per model."""
+    totals = {}
+    for label, image_field, sizes_field, pending_field in TARGETS:
+        model = apps.get_model(label)
+        pks = pending(model, pending_field)
+        totals[label] = 0
+        for start in range(0, len(pks), batch_size):
+            totals[label] += process(model, image_field, sizes_field, pending_field, pks[start:start + batch_size], workers)
+    return totals
+
+
+def changed(instance, image_field, sizes_field, pending_field):
+    """Call from save(): render the row's new images after commit when running inline"""
+    if getattr(settings, 'IMAGE_DERIVATIVES_INLINE', False) and getattr(instance, pending_field):
+        model, pk = type(instance), instance.pk
+        db_transaction.on_commit(lambda: process(model, image_field, sizes_field, pending_field, [pk]))
+
+
+def urls(key, recorded, private=False, request=None):
+    """{size: URL} for one image, using the original for any size not rendered yet"""
+    if not key:
+        return None
+    original = blobs.url(key, private=private, request=request)
+    derived = (recorded or {}).get(key, {})
+    return {
+        name: blobs.url(derived[name], private=private, request=request) if name in derived else original
+        for name in sizes()
+    }
+
+
+class ImageSizesField(serializers.Field):
+    """Read-only URLs by size for an image field (or a list of them) and its derivatives field"""
+
+    def __init__(self, image_field, sizes_field, private=False, **kwargs):
+        self.image_field, self.sizes_field, self.private = image_field, sizes_field, private
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, instance):
+        value = getattr(instance, self.image_field)
+        recorded = getattr(instance, self.sizes_field)
+        request = self.context.get('request')
+        if isinstance(value, list):
+            return [urls(item, recorded, self.private, request) for item in value]
+        return urls(value, recorded, self.private, request)
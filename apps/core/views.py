@@ -2,6 +2,12 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.db import connection
+from django.core import signing
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
+
+from . import blobs
 
 
 @api_view(['GET'])
@@ -20,3 +26,28 @@ def health_check(request):
         'database': db_status,
         'service': 'fundigo-backend'
     })
+
+
+@require_GET
+def serve_blob(request, token):
+    """Serve a stored blob from a signed link (see apps/core/blobs.py)"""
+    try:
+        name, private = blobs.unsign(token)
+    except signing.BadSignature:
+        raise Http404('Blob not found')
+
+    # Content-addressed: the name never changes meaning, so it doubles as the ETag
+    etag = f'"{name.rsplit("/", 1)[-1]}"'
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        try:
+            response = FileResponse(blobs.storage().open(name, 'rb'), content_type=blobs.content_type(name))
+        except FileNotFoundError:
+            raise Http404('Blob not found')
+    response['ETag'] = etag
+    if private:
+        patch_cache_control(response, private=True, max_age=300)
+    else:
+        patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from .models import (
     Wallet, Transaction, Payment, PayoutRequest,
-    JobPayment, Payout, PlatformEarnings
+    JobPayment, Payout, PlatformEarnings,
+    LedgerAccount, LedgerEntry, LedgerCheckpoint, MpesaCallback,
+    EarningsSummary, MonthlyEarnings, PlatformEarningsRollup, DailySettlement, SettlementDiscrepancy
 )
 
 
@@ -61,47 +63,46 @@ class JobPaymentAdmin(admin.ModelAdmin):
         }),
     )
     
-    actions = ['release_payments']
+    actions = ['release_payments', 'refund_payments']
     
     def release_payments(self, request, queryset):
         """Admin action to release held payments"""
-        from django.utils import timezone
-        from django.db import transaction as db_transaction
+        from . import escrow
         
-        released = 0
-        for payment in queryset.filter(status='held'):
-            with db_transaction.atomic():
-                # Credit technician wallet
-                wallet, _ = Wallet.objects.get_or_create(user=payment.technician)
-                wallet.credit(
-                    amount=payment.technician_amount,
-                    transaction_type='earning',
-                    reference=payment.payment_ref,
-                    metadata={'admin_release': True}
-                )
-                
-                payment.status = 'released'
-                payment.released_at = timezone.now()
-                payment.save()
-                released += 1
+        released = escrow.release_bulk(
+            queryset.filter(status='held').values_list('pk', flat=True), metadata={'admin_release': True}
+        )
         
-        self.message_user(request, f'{released} payment(s) released successfully.')
+        self.message_user(request, f'{len(released)} payment(s) released successfully.')
     
     release_payments.short_description = "Release selected payments to technicians"
+    
+    def refund_payments(self, request, queryset):
+        """Admin action to refund held payments to clients"""
+        from . import escrow
+        
+        refunded = 0
+        for payment in queryset.filter(status='held'):
+            if escrow.refund(payment):
+                refunded += 1
+        
+        self.message_user(request, f'{refunded} payment(s) marked refunded.')
+    
+    refund_payments.short_description = "Refund selected payments to clients"
 
 
 @admin.register(Payout)
 class PayoutAdmin(admin.ModelAdmin):
     list_display = [
         'payout_ref', 'technician', 'amount', 'payout_method',
-        'status', 'created_at', 'completed_at'
+        'status', 'attempts', 'created_at', 'completed_at'
     ]
     list_filter = ['status', 'payout_method', 'created_at']
     search_fields = ['payout_ref', 'technician__email', 'phone_number']
     readonly_fields = [
         'payout_ref', 'mpesa_conversation_id',
         'mpesa_originator_conversation_id', 'mpesa_transaction_id',
-        'created_at', 'completed_at'
+        'attempts', 'next_attempt_at', 'created_at', 'completed_at'
     ]
 
 
@@ -119,6 +120,22 @@ class PlatformEarningsAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(PlatformEarningsRollup)
+class PlatformEarningsRollupAdmin(admin.ModelAdmin):
+    list_display = [
+        'period', 'period_start', 'category', 'account_type', 'payment_method',
+        'payments_count', 'payments_volume', 'fees_held', 'fees_released', 'refunded_count'
+    ]
+    list_filter = ['period', 'account_type', 'payment_method', 'category']
+    date_hierarchy = 'period_start'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # Legacy models
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
@@ -132,3 +149,98 @@ class PayoutRequestAdmin(admin.ModelAdmin):
     list_display = ['id', 'technician', 'amount', 'phone_number', 'status', 'created_at']
     list_filter = ['status', 'created_at']
     search_fields = ['technician__email', 'phone_number']
+
+
+@admin.register(LedgerAccount)
+class LedgerAccountAdmin(admin.ModelAdmin):
+    list_display = ['id', 'type', 'user', 'created_at']
+    list_filter = ['type']
+    search_fields = ['user__email']
+    readonly_fields = ['type', 'user', 'created_at']
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'journal', 'account', 'type', 'amount', 'reference', 'created_at']
+    list_filter = ['type', 'account__type', 'created_at']
+    search_fields = ['reference', 'account__user__email']
+    readonly_fields = ['journal', 'account', 'type', 'amount', 'reference', 'created_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LedgerCheckpoint)
+class LedgerCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['id', 'account', 'last_entry_id', 'balance', 'created_at']
+    list_filter = ['account__type']
+    readonly_fields = ['account', 'last_entry_id', 'balance', 'created_at']
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'dedup_key', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['kind', 'status', 'received_at']
+    search_fields = ['dedup_key']
+    readonly_fields = [
+        'kind', 'dedup_key', 'payload', 'remote_addr', 'status',
+        'attempts', 'last_error', 'received_at', 'processed_at'
+    ]
+    actions = ['reprocess_callbacks']
+    
+    def reprocess_callbacks(self, request, queryset):
+        """Queue failed callbacks for another attempt"""
+        count = queryset.exclude(status='pending').update(status='pending', attempts=0)
+        self.message_user(request, f'{count} callback(s) queued for reprocessing.')
+    
+    reprocess_callbacks.short_description = "Reprocess selected callbacks"
+
+
+@admin.register(EarningsSummary)
+class EarningsSummaryAdmin(admin.ModelAdmin):
+    list_display = ['technician', 'total_released', 'pending_release', 'released_count', 'updated_at']
+    search_fields = ['technician__email']
+    readonly_fields = ['technician', 'total_released', 'pending_release', 'released_count', 'updated_at']
+
+
+@admin.register(MonthlyEarnings)
+class MonthlyEarningsAdmin(admin.ModelAdmin):
+    list_display = ['technician', 'month', 'released', 'jobs']
+    list_filter = ['month']
+    search_fields = ['technician__email']
+    readonly_fields = ['technician', 'month', 'released', 'jobs']
+
+
+class SettlementDiscrepancyInline(admin.TabularInline):
+    model = SettlementDiscrepancy
+    extra = 0
+    can_delete = False
+    readonly_fields = ['kind', 'reference', 'expected', 'actual', 'detail']
+
+
+@admin.register(DailySettlement)
+class DailySettlementAdmin(admin.ModelAdmin):
+    list_display = [
+        'date', 'status', 'payments_count', 'payments_volume', 'released_volume',
+        'payouts_volume', 'discrepancy_count', 'finished_at'
+    ]
+    list_filter = ['status']
+    readonly_fields = [field.name for field in DailySettlement._meta.fields]
+    inlines = [SettlementDiscrepancyInline]
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SettlementDiscrepancy)
+class SettlementDiscrepancyAdmin(admin.ModelAdmin):
+    list_display = ['settlement', 'kind', 'reference', 'expected', 'actual']
+    list_filter = ['kind', 'settlement__date']
+    search_fields = ['reference']
+    readonly_fields = ['settlement', 'kind', 'reference', 'expected', 'actual', 'detail']
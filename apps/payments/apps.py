@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.payments'
+
+    def ready(self):
+        from . import fees  # noqa: F401 - connects the fee cache invalidation signals
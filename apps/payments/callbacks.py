@@ -0,0 +1,178 @@
+"""
+M-Pesa callback inbox
+
+The callback views only call enqueue(). They store the raw payload and
+acknowledge Safaricom right away. Workers (`manage.py process_mpesa_callbacks`)
+claim pending rows in batches and apply them with the handlers below. The
+handlers are idempotent, so reprocessing a callback is always safe. A callback
+whose handler fails is retried with exponential backoff and parked as failed
+after MPESA_CALLBACK_MAX_ATTEMPTS attempts.
+"""
+import hashlib
+import json
+import random
+import time
+import logging
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import escrow, payouts
+from .models import MpesaCallback, JobPayment, Payout
+from .mpesa import parse_stk_callback, parse_b2c_result
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def retry_delay(attempts):
+    """Exponential backoff with equal jitter, in seconds"""
+    base = _setting('MPESA_CALLBACK_RETRY_BASE_SECONDS', 5)
+    cap = _setting('MPESA_CALLBACK_RETRY_MAX_SECONDS', 600)
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _dedup_key(kind, payload):
+    if kind == 'stk':
+        key = payload.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
+    else:
+        key = payload.get('Result', {}).get('ConversationID')
+    if key:
+        return str(key)[:100]
+    # Malformed callbacks still get stored once for inspection
+    return 'sha256:' + hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:64]
+
+
+def enqueue(kind, payload, remote_addr=''):
+    """Store a callback; duplicates of an already stored callback are ignored"""
+    MpesaCallback.objects.bulk_create([
+        MpesaCallback(
+            kind=kind,
+            dedup_key=_dedup_key(kind, payload),
+            payload=payload,
+            remote_addr=remote_addr or ''
+        )
+    ], ignore_conflicts=True)
+
+    if getattr(settings, 'MPESA_CALLBACK_INLINE', False):
+        process_batch()
+
+
+def handle_stk(payload):
+    """Apply an STK Push result to its JobPayment"""
+    callback_data = parse_stk_callback(payload)
+    if not callback_data or not callback_data.get('checkout_request_id'):
+        logger.warning("Missing checkout_request_id in callback")
+        return
+
+    checkout_request_id = callback_data['checkout_request_id']
+    try:
+        job_payment = JobPayment.objects.get(mpesa_checkout_request_id=checkout_request_id)
+    except JobPayment.DoesNotExist:
+        logger.error(f"Payment not found: {checkout_request_id}")
+        return
+
+    if callback_data.get('result_code') == 0:
+        escrow.mark_paid(job_payment, receipt_number=callback_data.get('mpesa_receipt', ''))
+    else:
+        escrow.mark_failed(job_payment)
+
+
+def handle_b2c_result(payload):
+    """Apply a B2C result to its Payout, refunding the wallet on failure"""
+    result_data = parse_b2c_result(payload)
+    if not result_data:
+        return
+
+    conversation_id = result_data.get('conversation_id')
+    try:
+        payout = Payout.objects.get(mpesa_conversation_id=conversation_id)
+    except Payout.DoesNotExist:
+        # The payout worker may not have recorded the conversation id yet; raise so the inbox retries
+        raise Payout.DoesNotExist(f"Payout not found for conversation {conversation_id}")
+
+    open_payouts = Payout.objects.filter(pk=payout.pk, status__in=['pending', 'processing'])
+    if result_data.get('result_code') == 0:
+        open_payouts.update(
+            status='completed',
+            mpesa_transaction_id=result_data.get('transaction_id') or '',
+            completed_at=timezone.now()
+        )
+        return
+
+    # Only the first failure result moves the payout, so the refund happens once
+    payouts.fail(payout, result_data.get('result_desc'))
+
+
+HANDLERS = {
+    'stk': handle_stk,
+    'b2c_result': handle_b2c_result,
+}
+
+
+def process_batch(batch_size=100):
+    """
+    Claim and process up to batch_size pending callbacks.
+    Rows are locked with SKIP LOCKED, so several workers can drain the inbox in
+    parallel without taking the same callback twice. Returns the number handled.
+    """
+    max_attempts = _setting('MPESA_CALLBACK_MAX_ATTEMPTS', 8)
+    now = timezone.now()
+    with db_transaction.atomic():
+        callbacks = list(
+            MpesaCallback.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .order_by('received_at')[:batch_size]
+        )
+        for callback in callbacks:
+            try:
+                with db_transaction.atomic():
+                    HANDLERS[callback.kind](callback.payload)
+                callback.status = 'processed'
+                callback.processed_at = timezone.now()
+                callback.next_attempt_at = None
+            except Exception as e:
+                callback.attempts += 1
+                callback.last_error = str(e)
+                if callback.attempts >= max_attempts:
+                    logger.error(f"M-Pesa callback {callback.pk} failed {callback.attempts} times, parked: {e}")
+                    callback.status = 'failed'
+                    callback.next_attempt_at = None
+                else:
+                    logger.warning(f"M-Pesa callback {callback.pk} failed (attempt {callback.attempts}): {e}")
+                    callback.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(callback.attempts))
+        if callbacks:
+            MpesaCallback.objects.bulk_update(
+                callbacks, ['status', 'processed_at', 'attempts', 'next_attempt_at', 'last_error']
+            )
+
+    return len(callbacks)
+
+
+def run_workers(workers=4, batch_size=100, loop=False, idle_sleep=0.5):
+    """Drain the inbox with a pool of worker threads. Returns the number handled."""
+    def drain():
+        handled = 0
+        try:
+            while True:
+                count = process_batch(batch_size)
+                handled += count
+                if count:
+                    continue
+                if not loop:
+                    return handled
+                time.sleep(idle_sleep)
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(lambda _: drain(), range(workers)))
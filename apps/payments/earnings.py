@@ -0,0 +1,212 @@
+"""
+Technician earnings summary
+
+EarningsSummary, MonthlyEarnings and CompanyMonthlyEarnings are updated
+inside the escrow transitions, in the same transaction as the JobPayment
+status and the 'earning' wallet Transaction. Each update is a single
+relative UPDATE, which keeps concurrent releases from overwriting each
+other. The dashboards read the last few monthly buckets. rebuild()
+recomputes everything from JobPayment if it ever drifts.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Q, Sum, Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from apps.technicians.models import TechnicianProfile
+from .models import EarningsSummary, MonthlyEarnings, CompanyMonthlyEarnings, JobPayment
+
+logger = logging.getLogger(__name__)
+
+
+def _ensure(model, **lookup):
+    model.objects.bulk_create([model(**lookup)], ignore_conflicts=True)
+    return model.objects.filter(**lookup)
+
+
+def _bump(technician_id, released=Decimal('0'), pending=Decimal('0'), count=0):
+    _ensure(EarningsSummary, technician_id=technician_id).update(
+        total_released=F('total_released') + released,
+        pending_release=F('pending_release') + pending,
+        released_count=F('released_count') + count,
+        updated_at=timezone.now()
+    )
+
+
+def month_of(moment):
+    return timezone.localdate(moment).replace(day=1)
+
+
+def payment_held(job_payment):
+    """Client paid: the technician's share is pending release"""
+    _bump(job_payment.technician_id, pending=job_payment.technician_amount)
+
+
+def _companies(technician_ids):
+    """{technician id: company id} for company accounts"""
+    return dict(
+        TechnicianProfile.objects.filter(
+            user_id__in=technician_ids, account_type='company', company__isnull=False
+        ).values_list('user_id', 'company_id')
+    )
+
+
+def _add(buckets, key, amount):
+    released, count = buckets.get(key, (Decimal('0'), 0))
+    buckets[key] = (released + amount, count + 1)
+
+
+def payments_released(job_payments):
+    """
+    Escrow released: move each share from pending to released and add it to
+    the technician's and company's month buckets. One UPDATE per technician
+    and per bucket.
+    """
+    companies = _companies({job_payment.technician_id for job_payment in job_payments})
+    totals, months, company_months = {}, {}, {}
+    for job_payment in job_payments:
+        amount, month = job_payment.technician_amount, month_of(job_payment.released_at)
+        _add(totals, job_payment.technician_id, amount)
+        _add(months, (job_payment.technician_id, month), amount)
+        company_id = companies.get(job_payment.technician_id)
+        if company_id:
+            _add(company_months, (company_id, month), amount)
+
+    for technician_id, (amount, count) in totals.items():
+        _bump(technician_id, released=amount, pending=-amount, count=count)
+    for (technician_id, month), (amount, count) in months.items():
+        _ensure(MonthlyEarnings, technician_id=technician_id, month=month).update(
+            released=F('released') + amount, jobs=F('jobs') + count
+        )
+    for (company_id, month), (amount, count) in company_months.items():
+        _ensure(CompanyMonthlyEarnings, company_id=company_id, month=month).update(
+            released=F('released') + amount, jobs=F('jobs') + count
+        )
+
+
+def payment_refunded(job_payment):
+    """Held payment refunded to the client: it will never be released"""
+    _bump(job_payment.technician_id, pending=-job_payment.technician_amount)
+
+
+def summary(technician, months=12):
+    """Totals plus the last `months` monthly buckets - two indexed lookups"""
+    row = EarningsSummary.objects.filter(technician=technician).values(
+        'total_released', 'pending_release', 'released_count'
+    ).first() or {'total_released': Decimal('0.00'), 'pending_release': Decimal('0.00'), 'released_count': 0}
+    row['monthly'] = list(
+        MonthlyEarnings.objects.filter(technician=technician).order_by('-month').values('month', 'released', 'jobs')[:months]
+    )
+    return row
+
+
+def last_months(count):
+    """First days of the last `count` calendar months, oldest first"""
+    month = timezone.localdate().replace(day=1)
+    months = [month]
+    for _ in range(count - 1):
+        month = (month - timedelta(days=1)).replace(day=1)
+        months.append(month)
+    return months[::-1]
+
+
+def _series(model, months, **lookup):
+    starts = last_months(months)
+    rows = dict(model.objects.filter(month__gte=starts[0], **lookup).values_list('month', 'released'))
+    return [{'month': start.strftime('%b'), 'amount': float(rows.get(start, 0))} for start in starts]
+
+
+def technician_monthly(technician_id, months=6):
+    """[{'month': 'Jan', 'amount': 1234.0}, ...] for the last `months` months, oldest first"""
+    return _series(MonthlyEarnings, months, technician_id=technician_id)
+
+
+def company_monthly(company_id, months=6):
+    """technician_monthly() summed over a company's technicians"""
+    return _series(CompanyMonthlyEarnings, months, company_id=company_id)
+
+
+def rebuild(technician_ids=None):
+    """Recompute summaries and monthly buckets from JobPayment. Returns technicians rebuilt."""
+    payments = JobPayment.objects.filter(status__in=['held', 'released'])
+    if technician_ids is not None:
+        payments = payments.filter(technician_id__in=technician_ids)
+
+    totals = payments.values('technician_id').annotate(
+        released=Sum('technician_amount', filter=Q(status='released')),
+        pending=Sum('technician_amount', filter=Q(status='held')),
+        count=Count('id', filter=Q(status='released'))
+    )
+    monthly = payments.filter(status='released').annotate(
+        month=TruncMonth('released_at')
+    ).values('technician_id', 'month').annotate(released=Sum('technician_amount'), jobs=Count('id'))
+
+    summaries = [
+        EarningsSummary(
+            technician_id=row['technician_id'],
+            total_released=row['released'] or Decimal('0.00'),
+            pending_release=row['pending'] or Decimal('0.00'),
+            released_count=row['count']
+        )
+        for row in totals
+    ]
+    months = [
+        MonthlyEarnings(
+            technician_id=row['technician_id'],
+            month=row['month'].date() if hasattr(row['month'], 'date') else row['month'],
+            released=row['released'],
+            jobs=row['jobs']
+        )
+        for row in monthly if row['month']
+    ]
+
+    # Company totals need every member, so rebuild the affected companies in full
+    company_ids = None
+    if technician_ids is not None:
+        company_ids = set(_companies(technician_ids).values())
+    company_payments = JobPayment.objects.filter(
+        status='released',
+        technician__technician_profile__account_type='company',
+        technician__technician_profile__company__isnull=False
+    )
+    if company_ids is not None:
+        company_payments = company_payments.filter(technician__technician_profile__company_id__in=company_ids)
+    company_monthly_rows = company_payments.annotate(
+        month=TruncMonth('released_at'), company_id=F('technician__technician_profile__company_id')
+    ).values('company_id', 'month').annotate(released=Sum('technician_amount'), jobs=Count('id'))
+    company_months = [
+        CompanyMonthlyEarnings(
+            company_id=row['company_id'],
+            month=row['month'].date() if hasattr(row['month'], 'date') else row['month'],
+            released=row['released'],
+            jobs=row['jobs']
+        )
+        for row in company_monthly_rows if row['month']
+    ]
+
+    with db_transaction.atomic():
+        _replace(technician_ids, summaries, months)
+        rows = CompanyMonthlyEarnings.objects.all()
+        if company_ids is not None:
+            rows = rows.filter(company_id__in=company_ids)
+        rows.delete()
+        CompanyMonthlyEarnings.objects.bulk_create(company_months, batch_size=1000)
+
+    logger.info(f"Rebuilt earnings for {len(summaries)} technician(s)")
+    return len(summaries)
+
+
+def _replace(technician_ids, summaries, months):
+    summary_rows = EarningsSummary.objects.all()
+    month_rows = MonthlyEarnings.objects.all()
+    if technician_ids is not None:
+        summary_rows = summary_rows.filter(technician_id__in=technician_ids)
+        month_rows = month_rows.filter(technician_id__in=technician_ids)
+    summary_rows.delete()
+    month_rows.delete()
+    EarningsSummary.objects.bulk_create(summaries, batch_size=1000)
+    MonthlyEarnings.objects.bulk_create(months, batch_size=1000)
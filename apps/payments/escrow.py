@@ -0,0 +1,229 @@
+"""
+Escrow state transitions for JobPayments
+
+All code paths that move a payment into or out of escrow go through here, so
+the JobPayment status, the job's payment_status, the technician wallet and the
+ledger always change together.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F, Case, When, Value, DecimalField
+from django.utils import timezone
+
+from apps.bookings.models import JobPosting
+from apps.technicians import dashboard
+from apps.technicians.models import TechnicianProfile
+from . import ledger, earnings, revenue
+from .models import JobPayment, Wallet, Transaction, PlatformEarnings
+
+logger = logging.getLogger(__name__)
+
+
+def mark_paid(job_payment, receipt_number='', paid_at=None):
+    """
+    Client's M-Pesa payment confirmed - move the funds into escrow.
+    Returns False if the payment was already settled (e.g. duplicate callback).
+    """
+    with db_transaction.atomic():
+        job_payment = JobPayment.objects.select_for_update().select_related('job').get(pk=job_payment.pk)
+        if job_payment.status in ['paid', 'held', 'released', 'refunded']:
+            return False
+
+        job_payment.status = 'held'
+        job_payment.mpesa_receipt_number = receipt_number or job_payment.mpesa_receipt_number
+        job_payment.paid_at = paid_at or timezone.now()
+        job_payment.save()
+
+        job = job_payment.job
+        job.payment_status = 'paid'
+        job.save()
+
+        PlatformEarnings.objects.get_or_create(
+            job_payment=job_payment,
+            defaults={'amount': job_payment.platform_fee}
+        )
+        ledger.transfer(
+            ledger.get_account('mpesa'), ledger.get_account('escrow'),
+            job_payment.amount_paid, 'payment', job_payment.payment_ref
+        )
+        earnings.payment_held(job_payment)
+        revenue.payment_held(job_payment)
+
+    logger.info(f"Payment {job_payment.payment_ref} successful - HELD in escrow")
+    return True
+
+
+def mark_failed(job_payment):
+    """STK push failed or was cancelled by the client"""
+    updated = JobPayment.objects.filter(
+        pk=job_payment.pk, status__in=['pending', 'processing']
+    ).update(status='failed')
+    if updated:
+        logger.info(f"Payment {job_payment.payment_ref} failed")
+    return bool(updated)
+
+
+def refund(job_payment):
+    """
+    Held payment refunded to the client: return the funds from escrow and drop
+    the platform fee. The M-Pesa reversal itself is made from the Daraja portal.
+    Returns False if the payment is not held.
+    """
+    with db_transaction.atomic():
+        job_payment = JobPayment.objects.select_for_update().select_related('job').get(pk=job_payment.pk)
+        if job_payment.status != 'held':
+            return False
+
+        job_payment.status = 'refunded'
+        job_payment.save()
+
+        job = job_payment.job
+        job.payment_status = 'refunded'
+        job.save()
+
+        PlatformEarnings.objects.filter(job_payment=job_payment).delete()
+        ledger.transfer(
+            ledger.get_account('escrow'), ledger.get_account('mpesa'),
+            job_payment.amount_paid, 'refund', job_payment.payment_ref
+        )
+        earnings.payment_refunded(job_payment)
+        revenue.payment_refunded(job_payment)
+
+    logger.info(f"Payment {job_payment.payment_ref} refunded to client")
+    return True
+
+
+def release(job_payment, metadata=None):
+    """
+    Release a held payment: credit the technician's share to their wallet and
+    book the platform fee as commission.
+    Returns False if the payment is not held.
+    """
+    return bool(release_bulk([job_payment], metadata))
+
+
+def release_bulk(job_payments, metadata=None):
+    """
+    Release many held payments in one transaction.
+
+    The payments and the affected wallets are locked in pk order, each wallet
+    gets one grouped UPDATE however many payments it receives, and the wallet
+    Transactions, ledger journals and status changes are written in bulk.
+    `metadata` is added to each earning Transaction. Payments that are not
+    held are skipped. Returns the released JobPayments.
+    """
+    ids = [getattr(job_payment, 'pk', job_payment) for job_payment in job_payments]
+    if not ids:
+        return []
+
+    with db_transaction.atomic():
+        payments = list(
+            JobPayment.objects.select_for_update(of=('self',)).select_related('job', 'technician')
+            .filter(pk__in=ids, status='held').order_by('pk')
+        )
+        if not payments:
+            return []
+
+        now = timezone.now()
+        shares = defaultdict(Decimal)
+        for job_payment in payments:
+            shares[job_payment.technician_id] += job_payment.technician_amount
+        balances = _credit_wallets(shares, now)
+
+        transactions, journals, accounts = [], [], {}
+        escrow_account, commission_account = ledger.get_account('escrow'), ledger.get_account('commission')
+        for job_payment in payments:
+            wallet_id, running = balances[job_payment.technician_id]
+            running += job_payment.technician_amount
+            balances[job_payment.technician_id] = (wallet_id, running)
+
+            job = job_payment.job
+            transactions.append(Transaction(
+                wallet_id=wallet_id,
+                type='earning',
+                amount=job_payment.technician_amount,
+                balance_after=running,
+                reference=job_payment.payment_ref,
+                success=True,
+                metadata={'job_id': job.id, 'job_title': job.title, **(metadata or {})}
+            ))
+
+            account = accounts.get(job_payment.technician_id)
+            if account is None:
+                account = accounts[job_payment.technician_id] = ledger.user_account(job_payment.technician)
+            journals.append(('earning', job_payment.payment_ref, [
+                (escrow_account, -job_payment.technician_amount), (account, job_payment.technician_amount)
+            ]))
+            journals.append(('commission', job_payment.payment_ref, [
+                (escrow_account, -job_payment.platform_fee), (commission_account, job_payment.platform_fee)
+            ]))
+
+            job_payment.status = 'released'
+            job_payment.released_at = now
+
+        Transaction.objects.bulk_create(transactions, batch_size=1000)
+        ledger.post_many(journals)
+        TechnicianProfile.objects.filter(user_id__in=balances).update(wallet_balance=Case(
+            *[When(user_id=user_id, then=Value(balance)) for user_id, (_, balance) in balances.items()],
+            output_field=DecimalField(max_digits=10, decimal_places=2)
+        ))
+        dashboard.profiles_changed(balances)
+
+        JobPayment.objects.filter(pk__in=[job_payment.pk for job_payment in payments]).update(
+            status='released', released_at=now
+        )
+        JobPosting.objects.filter(pk__in=[job_payment.job_id for job_payment in payments]).update(
+            payment_status='released', updated_at=now
+        )
+        earnings.payments_released(payments)
+        revenue.payments_released(payments)
+
+    for job_payment in payments:
+        logger.info(f"Payment {job_payment.payment_ref} released to technician")
+    return payments
+
+
+def _credit_wallets(shares, now):
+    """
+    Add each technician's total share to their wallet with one UPDATE.
+    Returns {technician_id: (wallet_id, balance before the credit)}.
+    """
+    Wallet.objects.bulk_create([Wallet(user_id=user_id) for user_id in shares], ignore_conflicts=True)
+    wallets = list(
+        Wallet.objects.select_for_update().filter(user_id__in=shares).order_by('pk').values_list('pk', 'user_id', 'balance')
+    )
+    Wallet.objects.filter(pk__in=[wallet_id for wallet_id, _, _ in wallets]).update(
+        balance=F('balance') + Case(
+            *[When(user_id=user_id, then=Value(amount)) for user_id, amount in shares.items()],
+            output_field=DecimalField(max_digits=10, decimal_places=2)
+        ),
+        updated_at=now
+    )
+    return {user_id: (wallet_id, balance) for wallet_id, user_id, balance in wallets}
+
+
+def due_for_auto_release(hours=None):
+    """Held payments whose job has been completed, without approval, for longer than the grace period"""
+    hours = hours if hours is not None else settings.ESCROW_AUTO_RELEASE_HOURS
+    cutoff = timezone.now() - timedelta(hours=hours)
+    return JobPayment.objects.filter(status='held', job__status='completed', job__completed_at__lt=cutoff)
+
+
+def auto_release(hours=None, batch_size=500):
+    """Release every payment due for auto-release, batch_size at a time. Returns the number released."""
+    released = 0
+    while True:
+        ids = list(due_for_auto_release(hours).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        batch = release_bulk(ids, metadata={'auto_release': True})
+        if not batch:
+            break
+        released += len(batch)
+    logger.info(f"Auto-released {released} payment(s)")
+    return released
@@ -0,0 +1,147 @@
+"""
+Streaming CSV / NDJSON exports for finance
+
+Rows are read with QuerySet.iterator(), which uses a server-side cursor on
+PostgreSQL, and written to a StreamingHttpResponse as they arrive. Memory
+stays flat however long the date range is.
+
+    GET /api/payments/export/wallet/?output=csv&from=2024-01-01&to=2024-01-31
+    GET /api/payments/export/earnings/?output=ndjson
+    GET /api/payments/export/platform/?dataset=transactions     (admin)
+
+Admins may add user_id= to export another user's wallet or earnings.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.response import Response
+
+from .models import Transaction, JobPayment
+
+CHUNK_SIZE = 2000
+
+TRANSACTION_COLUMNS = ['id', 'created_at', 'type', 'amount', 'balance_after', 'reference', 'success']
+PAYMENT_COLUMNS = [
+    'id', 'created_at', 'payment_ref', 'job_id', 'status', 'amount_paid', 'platform_fee',
+    'technician_amount', 'mpesa_receipt_number', 'paid_at', 'released_at'
+]
+
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer streaming"""
+
+    def write(self, value):
+        return value
+
+
+def _date_range(request):
+    """Aware [start, end) datetimes from ?from= / ?to= (inclusive dates); raises ValueError"""
+    bounds = []
+    for name, shift in (('from', 0), ('to', 1)):
+        raw = request.query_params.get(name)
+        if not raw:
+            bounds.append(None)
+            continue
+        day = parse_date(raw)
+        if day is None:
+            raise ValueError(f"'{name}' must be a date (YYYY-MM-DD)")
+        bounds.append(timezone.make_aware(datetime.combine(day + timedelta(days=shift), time.min)))
+    return bounds
+
+
+def _in_range(queryset, start, end):
+    if start:
+        queryset = queryset.filter(created_at__gte=start)
+    if end:
+        queryset = queryset.filter(created_at__lt=end)
+    return queryset
+
+
+def _target_user_id(request):
+    """The caller, or ?user_id= for admins"""
+    user_id = request.query_params.get('user_id')
+    if user_id and request.user.is_staff:
+        return int(user_id)
+    return request.user.pk
+
+
+def _stream(queryset, columns, output, filename):
+    rows = queryset.order_by('created_at', 'id').values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+    headers = [column.replace('__', '_') for column in columns]
+
+    if output == 'ndjson':
+        def content():
+            for row in rows:
+                yield json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n'
+        content_type, extension = 'application/x-ndjson', 'ndjson'
+    else:
+        def content():
+            writer = csv.writer(Echo())
+            yield writer.writerow(headers)
+            for row in rows:
+                yield writer.writerow(row)
+        content_type, extension = 'text/csv', 'csv'
+
+    response = StreamingHttpResponse(content(), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _export(request, queryset, columns, filename):
+    output = request.query_params.get('output', 'csv')
+    if output not in ('csv', 'ndjson'):
+        return Response({'success': False, 'error': "output must be 'csv' or 'ndjson'"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start, end = _date_range(request)
+        queryset = _in_range(queryset, start, end)
+    except ValueError as e:
+        return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return _stream(queryset, columns, output, filename)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_wallet(request):
+    """Wallet transactions of the caller (or ?user_id= for admins)"""
+    try:
+        user_id = _target_user_id(request)
+    except ValueError:
+        return Response({'success': False, 'error': 'Invalid user_id'}, status=status.HTTP_400_BAD_REQUEST)
+    queryset = Transaction.objects.filter(wallet__user_id=user_id)
+    return _export(request, queryset, TRANSACTION_COLUMNS, f'wallet-{user_id}-transactions')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_earnings(request):
+    """Job payments where the caller (or ?user_id= for admins) is the technician"""
+    try:
+        user_id = _target_user_id(request)
+    except ValueError:
+        return Response({'success': False, 'error': 'Invalid user_id'}, status=status.HTTP_400_BAD_REQUEST)
+    queryset = JobPayment.objects.filter(technician_id=user_id)
+    return _export(request, queryset, PAYMENT_COLUMNS, f'technician-{user_id}-payments')
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_platform(request):
+    """All job payments (default) or all wallet transactions (?dataset=transactions)"""
+    if request.query_params.get('dataset') == 'transactions':
+        queryset = Transaction.objects.all()
+        columns = TRANSACTION_COLUMNS + ['wallet__user__email']
+        filename = 'platform-transactions'
+    else:
+        queryset = JobPayment.objects.all()
+        columns = PAYMENT_COLUMNS + ['client__email', 'technician__email']
+        filename = 'platform-payments'
+    return _export(request, queryset, columns, filename)
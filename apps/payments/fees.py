@@ -0,0 +1,120 @@
+"""
+Platform fee policy
+
+The single place that decides the commission on a job:
+- company technicians pay their company's commission_rate
+- everyone else pays PLATFORM_COMMISSION_RATE
+
+Rates are resolved per technician and kept in an in-process cache. Saving a
+TechnicianProfile or Company evicts the affected entries, and entries expire
+after FEE_POLICY_CACHE_SECONDS so other processes pick up changes too. Fees
+are exact Decimals rounded half-up to the cent. The technician keeps the
+remainder, so fee + share always equals the amount.
+"""
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.technicians.models import Company, TechnicianProfile
+
+CENT = Decimal('0.01')
+
+_technician_rates = {}  # technician user id -> (expires, rate, company id)
+
+
+def default_rate():
+    return Decimal(str(settings.PLATFORM_COMMISSION_RATE))
+
+
+def _ttl():
+    return getattr(settings, 'FEE_POLICY_CACHE_SECONDS', 300)
+
+
+def _resolve(account_type, company_id, company_rate):
+    if account_type == 'company' and company_id and company_rate is not None:
+        return Decimal(str(company_rate))
+    return default_rate()
+
+
+def rates_for(technician_ids):
+    """{technician user id: commission rate} with one query for all cache misses"""
+    now = time.monotonic()
+    rates, missing = {}, []
+    for technician_id in set(technician_ids):
+        if technician_id is None:
+            continue
+        cached = _technician_rates.get(technician_id)
+        if cached and cached[0] > now:
+            rates[technician_id] = cached[1]
+        else:
+            missing.append(technician_id)
+
+    if missing:
+        profiles = TechnicianProfile.objects.filter(user_id__in=missing).values_list(
+            'user_id', 'account_type', 'company_id', 'company__commission_rate'
+        )
+        expires = now + _ttl()
+        for technician_id, account_type, company_id, company_rate in profiles:
+            rate = _resolve(account_type, company_id, company_rate)
+            _technician_rates[technician_id] = (expires, rate, company_id)
+            rates[technician_id] = rate
+        for technician_id in missing:
+            if technician_id not in rates:
+                rates[technician_id] = default_rate()
+    return rates
+
+
+def rate_for(technician):
+    """Commission rate for a technician (User, user id or None for the platform default)"""
+    technician_id = getattr(technician, 'pk', technician)
+    if technician_id is None:
+        return default_rate()
+    return rates_for([technician_id])[technician_id]
+
+
+def split(amount, rate):
+    """(platform_fee, technician_amount) for amount at rate"""
+    amount = Decimal(str(amount))
+    fee = (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+    return fee, amount - fee
+
+
+def calculate(amount, technician=None):
+    """(platform_fee, technician_amount) for a job done by technician"""
+    return split(amount, rate_for(technician))
+
+
+def calculate_many(items):
+    """
+    Fees for many payments at once.
+    items: iterable of (amount, technician id); returns a list of
+    (platform_fee, technician_amount) in the same order.
+    """
+    items = list(items)
+    rates = rates_for(technician_id for _, technician_id in items)
+    return [split(amount, rates.get(technician_id) or default_rate()) for amount, technician_id in items]
+
+
+def invalidate(technician_ids=None):
+    """Evict cached rates (all of them by default)"""
+    if technician_ids is None:
+        _technician_rates.clear()
+        return
+    for technician_id in technician_ids:
+        _technician_rates.pop(technician_id, None)
+
+
+@receiver([post_save, post_delete], sender=TechnicianProfile)
+def _technician_profile_changed(sender, instance, **kwargs):
+    invalidate([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Company)
+def _company_changed(sender, instance, **kwargs):
+    invalidate([
+        technician_id for technician_id, (_, _, company_id) in list(_technician_rates.items())
+        if company_id == instance.pk
+    ])
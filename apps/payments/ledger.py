@@ -0,0 +1,298 @@
+"""
+Double-entry ledger
+
+Every money movement is a journal of two or more LedgerEntry legs that sum to
+zero. Balances come from the latest LedgerCheckpoint plus the short tail of
+entries written after it. Wallet.balance and TechnicianProfile.wallet_balance
+are cached projections of the user accounts, and rebuild_projections() can
+recompute them.
+"""
+import uuid
+import logging
+import itertools
+from collections import defaultdict
+from decimal import Decimal
+from functools import partial
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Sum, Max, Count
+
+from .models import LedgerAccount, LedgerEntry, LedgerCheckpoint
+
+logger = logging.getLogger(__name__)
+
+PLATFORM_ACCOUNTS = ('escrow', 'commission', 'mpesa', 'opening')
+
+# Counter-account for wallet postings, by Transaction.type
+COUNTER_ACCOUNTS = {
+    'earning': 'escrow',
+    'payment': 'escrow',
+    'commission': 'commission',
+    'refund': 'mpesa',
+    'topup': 'mpesa',
+    'payout': 'mpesa',
+}
+
+_account_ids = {}
+
+
+def _remember(key, account_id):
+    """
+    Cache an account id once the transaction that read or created it commits.
+    An account created inside a transaction that later rolls back must not
+    stay cached, or every later posting for that user fails on the foreign key.
+    """
+    db_transaction.on_commit(partial(_account_ids.__setitem__, key, account_id))
+
+
+def get_account(account_type, user=None):
+    """Get (or create) a ledger account; ids are cached per process"""
+    if account_type in PLATFORM_ACCOUNTS:
+        user = None
+    user_id = user.pk if user is not None else None
+    key = (account_type, user_id)
+
+    account_id = _account_ids.get(key)
+    if account_id is None:
+        try:
+            account, _ = LedgerAccount.objects.get_or_create(type=account_type, user_id=user_id)
+        except IntegrityError:
+            account = LedgerAccount.objects.get(type=account_type, user_id=user_id)
+        account_id = account.pk
+        _remember(key, account_id)
+    return account_id
+
+
+def user_account(user):
+    """
+    The ledger account behind a user's wallet. The type is fixed when the
+    account is opened, so a client who later registers as a technician keeps
+    one account.
+    """
+    for account_type in ('technician', 'client'):
+        account_id = _account_ids.get((account_type, user.pk))
+        if account_id is not None:
+            return account_id
+
+    existing = LedgerAccount.objects.filter(user=user, type__in=['technician', 'client']).values_list('id', 'type').first()
+    if existing:
+        _remember((existing[1], user.pk), existing[0])
+        return existing[0]
+    return get_account('technician' if user.is_technician else 'client', user)
+
+
+def close_empty_accounts(users):
+    """
+    Delete the ledger accounts of `users` that were never posted to.
+    LedgerAccount.user is PROTECT: a user with money history is never deleted
+    (deactivate them instead), but an account that was opened and never used
+    should not block deleting its user. Returns the number deleted.
+    """
+    empty = list(LedgerAccount.objects.filter(user__in=users, entries__isnull=True).values_list('pk', 'type', 'user_id'))
+    LedgerAccount.objects.filter(pk__in=[pk for pk, _, _ in empty]).delete()
+    for _, account_type, user_id in empty:
+        _account_ids.pop((account_type, user_id), None)
+    return len(empty)
+
+
+def post(entry_type, reference, legs):
+    """
+    Write one balanced journal.
+    legs: iterable of (account_id, amount); amounts must sum to zero.
+    """
+    legs = [(account_id, Decimal(str(amount))) for account_id, amount in legs if amount]
+    if sum(amount for _, amount in legs) != 0:
+        raise ValueError("Ledger journal does not balance")
+    if not legs:
+        return None
+
+    journal = uuid.uuid4()
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(journal=journal, account_id=account_id, type=entry_type, amount=amount, reference=reference)
+        for account_id, amount in legs
+    ])
+    return journal
+
+
+def post_many(journals):
+    """
+    Write many balanced journals with one bulk insert.
+    journals: iterable of (entry_type, reference, legs), as for post().
+    """
+    entries = []
+    for entry_type, reference, legs in journals:
+        legs = [(account_id, Decimal(str(amount))) for account_id, amount in legs if amount]
+        if sum(amount for _, amount in legs) != 0:
+            raise ValueError("Ledger journal does not balance")
+        journal = uuid.uuid4()
+        entries.extend(
+            LedgerEntry(journal=journal, account_id=account_id, type=entry_type, amount=amount, reference=reference)
+            for account_id, amount in legs
+        )
+    LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def transfer(from_account, to_account, amount, entry_type, reference):
+    """Move amount from one account to another as a two-leg journal"""
+    amount = Decimal(str(amount))
+    return post(entry_type, reference, [(from_account, -amount), (to_account, amount)])
+
+
+def balance(account_id, as_of=None):
+    """
+    Account balance from the latest checkpoint plus the entries after it.
+    With as_of (a datetime) returns the historical balance at that moment.
+    """
+    entries = LedgerEntry.objects.filter(account_id=account_id)
+    boundary = None
+    if as_of is not None:
+        boundary = entries.filter(created_at__lte=as_of).aggregate(last=Max('id'))['last']
+        if boundary is None:
+            return Decimal('0.00')
+
+    checkpoints = LedgerCheckpoint.objects.filter(account_id=account_id)
+    if boundary is not None:
+        checkpoints = checkpoints.filter(last_entry_id__lte=boundary)
+    checkpoint = checkpoints.order_by('-last_entry_id').values('last_entry_id', 'balance').first()
+
+    tail = entries
+    start = Decimal('0.00')
+    if checkpoint:
+        tail = tail.filter(id__gt=checkpoint['last_entry_id'])
+        start = checkpoint['balance']
+    if boundary is not None:
+        tail = tail.filter(id__lte=boundary)
+
+    return start + (tail.aggregate(total=Sum('amount'))['total'] or Decimal('0.00'))
+
+
+def create_checkpoints(min_tail=1):
+    """
+    Checkpoint every account with at least min_tail entries since its last checkpoint.
+    Returns the number of checkpoints written.
+    """
+    written = 0
+    for account_id in LedgerAccount.objects.values_list('id', flat=True).iterator():
+        checkpoint = LedgerCheckpoint.objects.filter(account_id=account_id).order_by(
+            '-last_entry_id'
+        ).values('last_entry_id', 'balance').first()
+        after = checkpoint['last_entry_id'] if checkpoint else 0
+
+        tail = LedgerEntry.objects.filter(account_id=account_id, id__gt=after).aggregate(
+            total=Sum('amount'), last=Max('id'), count=Count('id')
+        )
+        if tail['count'] < max(min_tail, 1):
+            continue
+
+        LedgerCheckpoint.objects.create(
+            account_id=account_id,
+            last_entry_id=tail['last'],
+            balance=(checkpoint['balance'] if checkpoint else Decimal('0.00')) + tail['total']
+        )
+        written += 1
+
+    logger.info(f"Ledger: wrote {written} checkpoints")
+    return written
+
+
+def open_balances():
+    """
+    Post opening entries for wallets that predate the ledger, so that the
+    ledger balance of every user account matches Wallet.balance.
+    Returns the number of wallets opened.
+    """
+    from .models import Wallet
+
+    opening = get_account('opening')
+    opened = 0
+    for wallet in Wallet.objects.select_related('user').iterator():
+        account_id = user_account(wallet.user)
+        difference = wallet.balance - balance(account_id)
+        if difference:
+            with db_transaction.atomic():
+                transfer(opening, account_id, difference, 'opening', f'Opening balance wallet {wallet.pk}')
+            opened += 1
+    return opened
+
+
+def payment_opening(status, amount_paid, platform_fee, booked):
+    """
+    (escrow, commission) amounts a payment is missing from the ledger.
+    booked: the entry types already posted for it on the escrow and commission accounts.
+    """
+    escrow = commission = Decimal('0.00')
+    if 'payment' not in booked:
+        escrow += amount_paid
+    if status == 'released' and not booked & {'earning', 'commission'}:
+        escrow -= amount_paid
+        commission += platform_fee
+    if status == 'refunded' and 'refund' not in booked:
+        escrow -= amount_paid
+    return escrow, commission
+
+
+def open_payments(batch_size=1000):
+    """
+    Post an opening journal for each job payment paid, released or refunded
+    before the ledger existed, so the escrow and commission balances match the
+    JobPayments the daily settlement compares them with. A payment is opened
+    once: its journal has type 'opening' and is found again on later runs.
+    The technician share of a released payment is covered by the wallet openings.
+    Returns the number of payments opened.
+    """
+    from .models import JobPayment
+
+    escrow, commission, opening = get_account('escrow'), get_account('commission'), get_account('opening')
+    payments = JobPayment.objects.filter(status__in=['held', 'released', 'refunded']).order_by('pk').values_list(
+        'payment_ref', 'status', 'amount_paid', 'platform_fee'
+    )
+    opened = 0
+    rows = payments.iterator(chunk_size=batch_size)
+    while True:
+        chunk = list(itertools.islice(rows, batch_size))
+        if not chunk:
+            return opened
+        booked = defaultdict(set)
+        entries = LedgerEntry.objects.filter(
+            account_id__in=[escrow, commission], reference__in=[row[0] for row in chunk]
+        ).values_list('reference', 'type')
+        for reference, entry_type in entries:
+            booked[reference].add(entry_type)
+
+        journals = []
+        for reference, status, amount_paid, platform_fee in chunk:
+            if 'opening' in booked[reference]:
+                continue
+            escrow_amount, commission_amount = payment_opening(status, amount_paid, platform_fee, booked[reference])
+            if escrow_amount or commission_amount:
+                journals.append(('opening', reference, [
+                    (opening, -(escrow_amount + commission_amount)),
+                    (escrow, escrow_amount),
+                    (commission, commission_amount),
+                ]))
+        with db_transaction.atomic():
+            post_many(journals)
+        opened += len(journals)
+
+
+def rebuild_projections():
+    """
+    Recompute Wallet.balance and TechnicianProfile.wallet_balance from the ledger.
+    Returns the number of wallets whose cached balance was corrected.
+    """
+    from .models import Wallet
+    from apps.technicians.models import TechnicianProfile
+
+    corrected = 0
+    accounts = LedgerAccount.objects.filter(type__in=['technician', 'client']).values_list('id', 'user_id')
+    for account_id, user_id in accounts.iterator():
+        ledger_balance = balance(account_id)
+        updated = Wallet.objects.filter(user_id=user_id).exclude(balance=ledger_balance).update(balance=ledger_balance)
+        TechnicianProfile.objects.filter(user_id=user_id).exclude(
+            wallet_balance=ledger_balance
+        ).update(wallet_balance=ledger_balance)
+        if updated:
+            logger.warning(f"Ledger: corrected wallet balance for user {user_id} to {ledger_balance}")
+            corrected += updated
+    return corrected
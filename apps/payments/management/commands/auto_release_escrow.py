@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.payments.escrow import auto_release
+
+
+class Command(BaseCommand):
+    help = 'Release escrow for completed jobs the customer has not approved within the grace period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None, help='Grace period in hours (ESCROW_AUTO_RELEASE_HOURS)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Payments released per transaction (ESCROW_AUTO_RELEASE_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        released = auto_release(
+            hours=options['hours'],
+            batch_size=options['batch_size'] or settings.ESCROW_AUTO_RELEASE_BATCH_SIZE
+        )
+        self.stdout.write(self.style.SUCCESS(f'Auto-released {released} payment(s)'))
@@ -0,0 +1,108 @@
+import time
+import threading
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, OperationalError
+from apps.accounts.models import User
+from apps.payments.models import Wallet, Transaction
+
+
+class Command(BaseCommand):
+    help = 'Measure concurrent credit/debit throughput against a single hot wallet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--postings', type=int, default=200, help='Postings per thread')
+        parser.add_argument('--amount', type=str, default='10.00')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark balance instead of reversing it')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        postings = options['postings']
+        amount = Decimal(options['amount'])
+
+        user = User.objects.create_user(
+            email=f"wallet-bench-{uuid.uuid4().hex[:8]}@fundigo.local",
+            password=None,
+            is_active=False
+        )
+        wallet = Wallet.objects.create(user=user)
+
+        errors = []
+        retries = [0]
+        lock = threading.Lock()
+
+        def worker(index):
+            close_old_connections()
+            local_wallet = Wallet.objects.get(pk=wallet.pk)
+            try:
+                for i in range(postings):
+                    # Every third posting is a debit so the balance guard is exercised
+                    while True:
+                        try:
+                            if i % 3 == 2:
+                                try:
+                                    local_wallet.debit(amount, 'payout', f'bench-{index}-{i}')
+                                except ValueError:
+                                    local_wallet.credit(amount, 'topup', f'bench-{index}-{i}')
+                            else:
+                                local_wallet.credit(amount, 'topup', f'bench-{index}-{i}')
+                            break
+                        except OperationalError:
+                            # SQLite reports lock contention instead of blocking
+                            with lock:
+                                retries[0] += 1
+                            time.sleep(0.005)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        wallet.refresh_from_db()
+        transactions = Transaction.objects.filter(wallet=wallet)
+        ledger_total = sum(transactions.values_list('amount', flat=True), Decimal('0'))
+        total = threads * postings
+
+        self.stdout.write(f"Postings:        {total} across {threads} threads")
+        self.stdout.write(f"Elapsed:         {elapsed:.2f}s")
+        self.stdout.write(f"Throughput:      {total / elapsed:.0f} postings/s")
+        self.stdout.write(f"Lock retries:    {retries[0]}")
+        self.stdout.write(f"Final balance:   {wallet.balance}")
+        self.stdout.write(f"Sum of postings: {ledger_total}")
+
+        consistent = (
+            not errors and
+            transactions.count() == total and
+            wallet.balance == ledger_total
+        )
+        if not options['keep']:
+            self._reverse(wallet)
+
+        if consistent:
+            self.stdout.write(self.style.SUCCESS('Wallet balance matches its transactions - no lost updates'))
+        else:
+            for error in errors[:5]:
+                self.stderr.write(str(error))
+            self.stderr.write(self.style.ERROR('Wallet balance does not match its transactions'))
+
+    def _reverse(self, wallet):
+        """
+        Take the benchmark balance back out with one reversing posting. The
+        ledger is append-only, so the synthetic journals stay; this leaves the
+        benchmark wallet, its ledger account and the platform M-Pesa account
+        with no net change. The inactive benchmark user is kept because its
+        ledger account protects it.
+        """
+        wallet.refresh_from_db()
+        if wallet.balance:
+            wallet.debit(wallet.balance, 'payout', 'bench-reversal', counter_account='mpesa')
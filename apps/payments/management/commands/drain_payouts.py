@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from apps.payments.payouts import run
+
+
+class Command(BaseCommand):
+    help = 'Submit queued M-Pesa B2C payouts within the Daraja rate limit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Payouts claimed per batch (PAYOUT_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int, default=None, help='B2C requests in flight (PAYOUT_CONCURRENCY)')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for due payouts')
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='Seconds to wait when nothing is due')
+
+    def handle(self, *args, **options):
+        totals = run(
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            loop=options['loop'],
+            idle_sleep=options['idle_sleep']
+        )
+        summary = ', '.join(f'{count} {outcome}' for outcome, count in sorted(totals.items())) or 'nothing due'
+        self.stdout.write(self.style.SUCCESS(f'Payouts: {summary}'))
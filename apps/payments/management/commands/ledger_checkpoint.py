@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from apps.payments import ledger
+
+
+class Command(BaseCommand):
+    help = 'Write ledger balance checkpoints (run periodically, e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-tail', type=int, default=50,
+            help='Only checkpoint accounts with at least this many entries since their last checkpoint'
+        )
+        parser.add_argument(
+            '--open-balances', action='store_true',
+            help='Post opening entries so pre-ledger wallet balances and job payments are represented in the ledger'
+        )
+        parser.add_argument(
+            '--rebuild-projections', action='store_true',
+            help='Recompute Wallet.balance and TechnicianProfile.wallet_balance from the ledger'
+        )
+
+    def handle(self, *args, **options):
+        if options['open_balances']:
+            opened = ledger.open_balances()
+            self.stdout.write(f"Opened balances for {opened} wallet(s)")
+            opened = ledger.open_payments()
+            self.stdout.write(f"Opened {opened} pre-ledger job payment(s) in escrow and commission")
+
+        written = ledger.create_checkpoints(min_tail=options['min_tail'])
+        self.stdout.write(f"Wrote {written} checkpoint(s)")
+
+        if options['rebuild_projections']:
+            corrected = ledger.rebuild_projections()
+            self.stdout.write(f"Corrected {corrected} wallet projection(s)")
+
+        self.stdout.write(self.style.SUCCESS('Ledger checkpoint complete'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from apps.payments.callbacks import run_workers
+
+
+class Command(BaseCommand):
+    help = 'Process stored M-Pesa callbacks (STK Push and B2C results)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Worker threads draining the inbox')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new callbacks')
+        parser.add_argument('--idle-sleep', type=float, default=0.5, help='Seconds to wait when the inbox is empty')
+
+    def handle(self, *args, **options):
+        handled = run_workers(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            loop=options['loop'],
+            idle_sleep=options['idle_sleep']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Processed {handled} callback(s)'))
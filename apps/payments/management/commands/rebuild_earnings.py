@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from apps.payments.earnings import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute technician earnings summaries and technician/company monthly buckets from job payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--technician', type=int, action='append', dest='technician_ids', help='Technician user id (repeatable)')
+
+    def handle(self, *args, **options):
+        count = rebuild(options['technician_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt earnings for {count} technician(s)'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from apps.payments.revenue import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the platform earnings rollups (day/week/month) from job payments'
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} platform earnings rollup row(s)'))
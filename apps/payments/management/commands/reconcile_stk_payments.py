@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from apps.payments.reconcile import run
+
+
+class Command(BaseCommand):
+    help = 'Query Daraja for STK payments stuck in processing and settle them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Payments queried per run (STK_RECONCILE_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int, default=None, help='Status queries in flight (STK_RECONCILE_CONCURRENCY)')
+        parser.add_argument('--loop', action='store_true', help='Keep reconciling every --interval seconds')
+        parser.add_argument('--interval', type=float, default=30)
+
+    def handle(self, *args, **options):
+        totals = run(
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            loop=options['loop'],
+            interval=options['interval']
+        )
+        summary = ', '.join(f'{count} {outcome}' for outcome, count in sorted(totals.items())) or 'nothing stale'
+        self.stdout.write(self.style.SUCCESS(f'STK payments: {summary}'))
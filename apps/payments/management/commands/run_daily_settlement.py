@@ -0,0 +1,41 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.payments.settlement import run
+
+
+class Command(BaseCommand):
+    help = 'Settle and reconcile one day of payments, transactions and payouts (default: yesterday)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to settle (YYYY-MM-DD)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes checking wallet shards')
+        parser.add_argument('--shards', type=int, default=None, help='Wallet shards (default: 4 per worker)')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            day = parse_date(options['date'])
+            if day is None:
+                raise CommandError('--date must be YYYY-MM-DD')
+        else:
+            day = timezone.localdate() - timedelta(days=1)
+
+        settlement = run(day, workers=options['workers'], shards=options['shards'])
+
+        self.stdout.write(
+            f"{day}: {settlement.payments_count} payments (KES {settlement.payments_volume}), "
+            f"{settlement.released_count} released (KES {settlement.released_volume}), "
+            f"{settlement.payouts_count} payouts (KES {settlement.payouts_volume}, {settlement.payouts_failed} failed), "
+            f"{settlement.transactions_count} transactions in {settlement.wallets_checked} wallets"
+        )
+        for discrepancy in settlement.discrepancies.all()[:20]:
+            self.stdout.write(self.style.WARNING(
+                f"  {discrepancy.kind} {discrepancy.reference}: expected {discrepancy.expected}, "
+                f"actual {discrepancy.actual} - {discrepancy.detail}"
+            ))
+        style = self.style.SUCCESS if settlement.status == 'balanced' else self.style.ERROR
+        self.stdout.write(style(f"Settlement {settlement.status}: {settlement.discrepancy_count} discrepancies"))
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payments', '0002_jobpayment_wallet_held_balance_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('escrow', 'Platform Escrow'), ('commission', 'Platform Commission'), ('mpesa', 'M-Pesa Clearing'), ('opening', 'Opening Balances'), ('technician', 'Technician'), ('client', 'Client')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_accounts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_entry_id', models.BigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='payments.ledgeraccount')),
+            ],
+            options={
+                'ordering': ['-last_entry_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journal', models.UUIDField(db_index=True)),
+                ('type', models.CharField(max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('reference', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='payments.ledgeraccount')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['account', 'id'], name='ledger_entry_account_id'), models.Index(fields=['account', 'created_at'], name='ledger_entry_account_time')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ledgercheckpoint',
+            constraint=models.UniqueConstraint(fields=('account', 'last_entry_id'), name='unique_ledger_checkpoint'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgeraccount',
+            constraint=models.UniqueConstraint(fields=('type', 'user'), name='unique_ledger_account_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgeraccount',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('type',), name='unique_platform_ledger_account'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_ledgeraccount_ledgercheckpoint_ledgerentry_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('stk', 'STK Push'), ('b2c_result', 'B2C Result')], max_length=20)),
+                ('dedup_key', models.CharField(max_length=100)),
+                ('payload', models.JSONField()),
+                ('remote_addr', models.CharField(blank=True, max_length=45)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['received_at'],
+                'indexes': [models.Index(fields=['status', 'received_at'], name='mpesa_callback_queue')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='mpesacallback',
+            constraint=models.UniqueConstraint(fields=('kind', 'dedup_key'), name='unique_mpesa_callback'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_mpesacallback_mpesacallback_unique_mpesa_callback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payout',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='payout',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='payments_pa_status_417d6c_idx'),
+        ),
+    ]
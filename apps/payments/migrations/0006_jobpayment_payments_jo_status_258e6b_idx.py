@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_payout_attempts_payout_next_attempt_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='jobpayment',
+            index=models.Index(fields=['status', 'created_at'], name='payments_jo_status_258e6b_idx'),
+        ),
+    ]
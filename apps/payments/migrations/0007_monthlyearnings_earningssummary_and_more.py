@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:34
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payments', '0006_jobpayment_payments_jo_status_258e6b_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyEarnings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('released', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('jobs', models.IntegerField(default=0)),
+                ('technician', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_earnings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Monthly Earnings',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EarningsSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_released', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('pending_release', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('released_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('technician', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='earnings_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Earnings Summaries',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyearnings',
+            constraint=models.UniqueConstraint(fields=('technician', 'month'), name='unique_monthly_earnings'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_monthlyearnings_earningssummary_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='jobpayment',
+            index=models.Index(fields=['technician', 'created_at'], name='payments_jo_technic_66ae57_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'created_at'], name='payments_tr_wallet__b4df40_idx'),
+        ),
+    ]
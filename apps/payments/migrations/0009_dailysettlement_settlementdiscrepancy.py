@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:37
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_jobpayment_payments_jo_technic_66ae57_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySettlement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('balanced', 'Balanced'), ('discrepancies', 'Discrepancies Found'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('payments_count', models.IntegerField(default=0)),
+                ('payments_volume', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('platform_fees', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('released_count', models.IntegerField(default=0)),
+                ('released_volume', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('payouts_count', models.IntegerField(default=0)),
+                ('payouts_volume', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('payouts_failed', models.IntegerField(default=0)),
+                ('transactions_count', models.IntegerField(default=0)),
+                ('wallets_checked', models.IntegerField(default=0)),
+                ('escrow_expected', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('escrow_ledger', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('discrepancy_count', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SettlementDiscrepancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('escrow', 'Escrow vs Held Payments'), ('commission', 'Commission vs Released Fees'), ('platform_earnings', 'Platform Earnings vs Fee'), ('wallet_chain', 'Wallet Transaction Chain'), ('wallet_balance', 'Wallet vs Ledger Balance'), ('payout_stuck', 'Payout Stuck')], max_length=30)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('expected', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('actual', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('detail', models.TextField(blank=True)),
+                ('settlement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discrepancies', to='payments.dailysettlement')),
+            ],
+            options={
+                'verbose_name_plural': 'Settlement Discrepancies',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:40
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_dailysettlement_settlementdiscrepancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlatformEarningsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('category', models.CharField(max_length=50)),
+                ('account_type', models.CharField(max_length=20)),
+                ('payment_method', models.CharField(max_length=20)),
+                ('payments_count', models.IntegerField(default=0)),
+                ('payments_volume', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('fees_held', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('released_count', models.IntegerField(default=0)),
+                ('fees_released', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('refunded_count', models.IntegerField(default=0)),
+                ('refunded_volume', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Platform Earnings Rollups',
+                'ordering': ['-period_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='platformearningsrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'category', 'account_type', 'payment_method'), name='unique_platform_earnings_rollup'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:44
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('technicians', '0005_alter_technicianprofile_id_back_photo_and_more'),
+        ('payments', '0010_platformearningsrollup_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyMonthlyEarnings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('released', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('jobs', models.IntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_earnings', to='technicians.company')),
+            ],
+            options={
+                'verbose_name_plural': 'Company Monthly Earnings',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='companymonthlyearnings',
+            constraint=models.UniqueConstraint(fields=('company', 'month'), name='unique_company_monthly_earnings'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_companymonthlyearnings_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesacallback',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mpesacallback',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='mpesa_callback_retry'),
+        ),
+    ]
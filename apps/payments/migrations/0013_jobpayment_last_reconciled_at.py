@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0012_mpesacallback_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobpayment',
+            name='last_reconciled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='jobpayment',
+            index=models.Index(fields=['status', 'last_reconciled_at'], name='payments_jo_status_0e0ea4_idx'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+import itertools
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def _account(LedgerAccount, account_type):
+    account, _ = LedgerAccount.objects.get_or_create(type=account_type, user=None)
+    return account.pk
+
+
+def _opening(status, amount_paid, platform_fee, booked):
+    """Same rules as ledger.payment_opening, frozen for this migration"""
+    escrow = commission = Decimal('0.00')
+    if 'payment' not in booked:
+        escrow += amount_paid
+    if status == 'released' and not booked & {'earning', 'commission'}:
+        escrow -= amount_paid
+        commission += platform_fee
+    if status == 'refunded' and 'refund' not in booked:
+        escrow -= amount_paid
+    return escrow, commission
+
+
+def open_pre_ledger_payments(apps, schema_editor):
+    """
+    Post opening journals for job payments settled before the ledger existed,
+    so the daily settlement's escrow and commission checks start balanced.
+    Idempotent, like ledger.open_payments().
+    """
+    JobPayment = apps.get_model('payments', 'JobPayment')
+    LedgerAccount = apps.get_model('payments', 'LedgerAccount')
+    LedgerEntry = apps.get_model('payments', 'LedgerEntry')
+
+    payments = JobPayment.objects.filter(status__in=['held', 'released', 'refunded']).order_by('pk').values_list(
+        'payment_ref', 'status', 'amount_paid', 'platform_fee'
+    )
+    if not payments.exists():
+        return
+    escrow = _account(LedgerAccount, 'escrow')
+    commission = _account(LedgerAccount, 'commission')
+    opening = _account(LedgerAccount, 'opening')
+
+    rows = payments.iterator(chunk_size=BATCH_SIZE)
+    while True:
+        chunk = list(itertools.islice(rows, BATCH_SIZE))
+        if not chunk:
+            return
+        booked = defaultdict(set)
+        entries = LedgerEntry.objects.filter(
+            account_id__in=[escrow, commission], reference__in=[row[0] for row in chunk]
+        ).values_list('reference', 'type')
+        for reference, entry_type in entries:
+            booked[reference].add(entry_type)
+
+        new_entries = []
+        for reference, status, amount_paid, platform_fee in chunk:
+            if 'opening' in booked[reference]:
+                continue
+            escrow_amount, commission_amount = _opening(status, amount_paid, platform_fee, booked[reference])
+            if not (escrow_amount or commission_amount):
+                continue
+            journal = uuid.uuid4()
+            legs = [(opening, -(escrow_amount + commission_amount)), (escrow, escrow_amount), (commission, commission_amount)]
+            new_entries.extend(
+                LedgerEntry(journal=journal, account_id=account_id, type='opening', amount=amount, reference=reference)
+                for account_id, amount in legs if amount
+            )
+        LedgerEntry.objects.bulk_create(new_entries, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0013_jobpayment_last_reconciled_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_pre_ledger_payments, migrations.RunPython.noop),
+    ]
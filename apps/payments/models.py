@@ -1,5 +1,7 @@
 from django.db import models
 from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
 from apps.accounts.models import User
 from apps.bookings.models import Booking, JobPosting
 from decimal import Decimal
@@ -17,11 +19,50 @@ class Wallet(models.Model):
     def __str__(self):
         return f"Wallet: {self.user.email} - Balance: {self.balance}, Held: {self.held_balance}"
     
-    def credit(self, amount, transaction_type, reference, metadata=None):
+    def _apply(self, balance_delta=0, held_delta=0, min_balance=None, min_held=None):
+        """
+        Apply a balance change as one conditional UPDATE.
+        
+        The guard (e.g. balance >= amount) is evaluated by the database inside
+        the same statement, so concurrent postings to one wallet never overwrite
+        each other. Returns False when the guard rejects the change.
+        """
+        queryset = Wallet.objects.filter(pk=self.pk)
+        if min_balance is not None:
+            queryset = queryset.filter(balance__gte=min_balance)
+        if min_held is not None:
+            queryset = queryset.filter(held_balance__gte=min_held)
+        
+        updated = queryset.update(
+            balance=F('balance') + balance_delta,
+            held_balance=F('held_balance') + held_delta,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            return False
+        
+        # The row is locked by the UPDATE until commit, so this reads our own write
+        self.balance, self.held_balance = Wallet.objects.filter(pk=self.pk).values_list(
+            'balance', 'held_balance'
+        ).get()
+        return True
+    
+    def _post_ledger(self, amount, transaction_type, reference, counter_account=None):
+        """Mirror a balance change into the double-entry ledger and the profile projection"""
+        from . import ledger
+        from apps.technicians import dashboard
+        from apps.technicians.models import TechnicianProfile
+        
+        counter = ledger.get_account(counter_account or ledger.COUNTER_ACCOUNTS.get(transaction_type, 'mpesa'))
+        ledger.transfer(counter, ledger.user_account(self.user), amount, transaction_type, reference)
+        if TechnicianProfile.objects.filter(user_id=self.user_id).update(wallet_balance=self.balance):
+            dashboard.profiles_changed([self.user_id])
+    
+    def credit(self, amount, transaction_type, reference, metadata=None, counter_account=None):
         """Add funds to wallet"""
+        amount = Decimal(str(amount))
         with db_transaction.atomic():
-            self.balance += Decimal(str(amount))
-            self.save()
+            self._apply(balance_delta=amount)
             Transaction.objects.create(
                 wallet=self,
                 type=transaction_type,
@@ -31,30 +72,30 @@ class Wallet(models.Model):
                 success=True,
                 metadata=metadata or {}
             )
+            self._post_ledger(amount, transaction_type, reference, counter_account)
     
-    def debit(self, amount, transaction_type, reference, metadata=None):
+    def debit(self, amount, transaction_type, reference, metadata=None, counter_account=None):
         """Remove funds from wallet"""
-        if self.balance < Decimal(str(amount)):
-            raise ValueError("Insufficient balance")
-        
+        amount = Decimal(str(amount))
         with db_transaction.atomic():
-            self.balance -= Decimal(str(amount))
-            self.save()
+            if not self._apply(balance_delta=-amount, min_balance=amount):
+                raise ValueError("Insufficient balance")
             Transaction.objects.create(
                 wallet=self,
                 type=transaction_type,
-                amount=-Decimal(str(amount)),
+                amount=-amount,
                 balance_after=self.balance,
                 reference=reference,
                 success=True,
                 metadata=metadata or {}
             )
+            self._post_ledger(-amount, transaction_type, reference, counter_account)
     
     def hold(self, amount, reference, metadata=None):
         """Hold funds in escrow"""
+        amount = Decimal(str(amount))
         with db_transaction.atomic():
-            self.held_balance += Decimal(str(amount))
-            self.save()
+            self._apply(held_delta=amount)
             Transaction.objects.create(
                 wallet=self,
                 type='escrow_hold',
@@ -67,12 +108,19 @@ class Wallet(models.Model):
     
     def release_hold(self, amount, reference, metadata=None):
         """Release held funds from escrow"""
-        if self.held_balance < Decimal(str(amount)):
-            raise ValueError("Insufficient held balance")
-        
+        amount = Decimal(str(amount))
         with db_transaction.atomic():
-            self.held_balance -= Decimal(str(amount))
-            self.save()
+            if not self._apply(held_delta=-amount, min_held=amount):
+                raise ValueError("Insufficient held balance")
+            Transaction.objects.create(
+                wallet=self,
+                type='escrow_release',
+                amount=amount,
+                balance_after=self.balance,
+                reference=reference,
+                success=True,
+                metadata=metadata or {}
+            )
 
 
 class Transaction(models.Model):
@@ -99,6 +147,9 @@ class Transaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['wallet', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.type} - {self.amount} - {self.wallet.user.email}"
@@ -156,9 +207,16 @@ class JobPayment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     paid_at = models.DateTimeField(null=True, blank=True)
     released_at = models.DateTimeField(null=True, blank=True)
+    last_reconciled_at = models.DateTimeField(null=True, blank=True)  # Last Daraja status query (reconcile.py)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Reconciler scan for stale processing payments
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'last_reconciled_at']),
+            models.Index(fields=['technician', 'created_at']),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.payment_ref:
@@ -171,10 +229,9 @@ class JobPayment(models.Model):
         super().save(*args, **kwargs)
     
     def calculate_fees(self):
-        """Calculate 15% platform fee and 85% technician amount"""
-        commission_rate = Decimal('0.15')
-        self.platform_fee = self.amount_paid * commission_rate
-        self.technician_amount = self.amount_paid - self.platform_fee
+        """Calculate the platform fee and technician amount at the technician's rate"""
+        from . import fees
+        self.platform_fee, self.technician_amount = fees.calculate(self.amount_paid, self.technician_id)
     
     def __str__(self):
         return f"Payment {self.payment_ref} - Job #{self.job_id} - KES {self.amount_paid}"
@@ -224,12 +281,19 @@ class Payout(models.Model):
     # Failure reason if any
     failure_reason = models.TextField(blank=True)
     
+    # Scheduler retry state (see payouts.py)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.payout_ref:
@@ -303,3 +367,296 @@ class PlatformEarnings(models.Model):
     
     def __str__(self):
         return f"Platform Earning - KES {self.amount} from {self.job_payment.payment_ref}"
+
+
+class LedgerAccount(models.Model):
+    """
+    Account in the double-entry ledger.
+    Platform accounts (escrow, commission, clearing) have no user;
+    technician and client accounts belong to one user each.
+    """
+    ACCOUNT_TYPES = (
+        ('escrow', 'Platform Escrow'),
+        ('commission', 'Platform Commission'),
+        ('mpesa', 'M-Pesa Clearing'),
+        ('opening', 'Opening Balances'),
+        ('technician', 'Technician'),
+        ('client', 'Client'),
+    )
+    
+    type = models.CharField(max_length=20, choices=ACCOUNT_TYPES)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_accounts')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['type', 'user'], name='unique_ledger_account_per_user'),
+            models.UniqueConstraint(
+                fields=['type'], condition=models.Q(user__isnull=True),
+                name='unique_platform_ledger_account'
+            ),
+        ]
+    
+    def __str__(self):
+        if self.user_id:
+            return f"{self.get_type_display()}: {self.user.email}"
+        return self.get_type_display()
+
+
+class LedgerEntry(models.Model):
+    """
+    One leg of a ledger journal - append-only.
+    Positive amounts increase the account balance; the legs of a journal sum to zero.
+    """
+    journal = models.UUIDField(db_index=True)
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name='entries')
+    type = models.CharField(max_length=20)  # Same vocabulary as Transaction.type
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    reference = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['account', 'id'], name='ledger_entry_account_id'),
+            models.Index(fields=['account', 'created_at'], name='ledger_entry_account_time'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("Ledger entries are append-only")
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are append-only")
+    
+    def __str__(self):
+        return f"{self.type} {self.amount} - {self.account}"
+
+
+class LedgerCheckpoint(models.Model):
+    """Account balance as of a ledger entry, so balances never need a full scan"""
+    account = models.ForeignKey(LedgerAccount, on_delete=models.CASCADE, related_name='checkpoints')
+    last_entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-last_entry_id']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'last_entry_id'], name='unique_ledger_checkpoint'),
+        ]
+    
+    def __str__(self):
+        return f"{self.account} = {self.balance} @ entry {self.last_entry_id}"
+
+
+class MpesaCallback(models.Model):
+    """
+    Inbox of raw M-Pesa callbacks.
+    Callbacks are stored and acknowledged immediately; a worker processes them.
+    The unique (kind, dedup_key) constraint drops Safaricom's duplicate deliveries.
+    """
+    KIND_CHOICES = (
+        ('stk', 'STK Push'),
+        ('b2c_result', 'B2C Result'),
+    )
+    
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    )
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    dedup_key = models.CharField(max_length=100)  # CheckoutRequestID or ConversationID
+    payload = models.JSONField()
+    remote_addr = models.CharField(max_length=45, blank=True)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)  # Backoff after a failed attempt
+    last_error = models.TextField(blank=True)
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['received_at']
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'dedup_key'], name='unique_mpesa_callback'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='mpesa_callback_queue'),
+            models.Index(fields=['status', 'next_attempt_at'], name='mpesa_callback_retry'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} callback {self.dedup_key} ({self.status})"
+
+
+class EarningsSummary(models.Model):
+    """
+    Running earnings totals for a technician, kept current by the escrow
+    transitions (see earnings.py) so the earnings screen never sums payments.
+    """
+    technician = models.OneToOneField(User, on_delete=models.CASCADE, related_name='earnings_summary')
+    total_released = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    pending_release = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Held in escrow
+    released_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Earnings Summaries"
+    
+    def __str__(self):
+        return f"Earnings {self.technician.email}: KES {self.total_released} released, KES {self.pending_release} pending"
+
+
+class MonthlyEarnings(models.Model):
+    """Released earnings per technician per calendar month"""
+    technician = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_earnings')
+    month = models.DateField()  # First day of the month
+    released = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    jobs = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-month']
+        verbose_name_plural = "Monthly Earnings"
+        constraints = [
+            models.UniqueConstraint(fields=['technician', 'month'], name='unique_monthly_earnings'),
+        ]
+    
+    def __str__(self):
+        return f"{self.technician.email} {self.month:%Y-%m}: KES {self.released}"
+
+
+class CompanyMonthlyEarnings(models.Model):
+    """Released earnings of a company's technicians per calendar month"""
+    company = models.ForeignKey('technicians.Company', on_delete=models.CASCADE, related_name='monthly_earnings')
+    month = models.DateField()  # First day of the month
+    released = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    jobs = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-month']
+        verbose_name_plural = "Company Monthly Earnings"
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'month'], name='unique_company_monthly_earnings'),
+        ]
+    
+    def __str__(self):
+        return f"{self.company.name} {self.month:%Y-%m}: KES {self.released}"
+
+
+class PlatformEarningsRollup(models.Model):
+    """
+    Platform revenue per day, week or month and per category, technician
+    account type and payment method, kept current by the escrow transitions
+    (see revenue.py). Payments and refunds are bucketed by paid_at, released
+    fees by released_at.
+    """
+    PERIOD_CHOICES = (
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+    )
+    
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()  # The day, the Monday of the week, or the 1st of the month
+    category = models.CharField(max_length=50)
+    account_type = models.CharField(max_length=20)
+    payment_method = models.CharField(max_length=20)
+    
+    payments_count = models.IntegerField(default=0)
+    payments_volume = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    fees_held = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Fees of payments still in escrow
+    released_count = models.IntegerField(default=0)
+    fees_released = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Commission earned
+    refunded_count = models.IntegerField(default=0)
+    refunded_volume = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-period_start']
+        verbose_name_plural = "Platform Earnings Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'period_start', 'category', 'account_type', 'payment_method'],
+                name='unique_platform_earnings_rollup'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.period} {self.period_start} {self.category}/{self.account_type}/{self.payment_method}: KES {self.fees_released}"
+
+
+class DailySettlement(models.Model):
+    """Nightly settlement summary and reconciliation run for one day (see settlement.py)"""
+    STATUS_CHOICES = (
+        ('running', 'Running'),
+        ('balanced', 'Balanced'),
+        ('discrepancies', 'Discrepancies Found'),
+        ('failed', 'Failed'),
+    )
+    
+    date = models.DateField(unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    
+    # Client payments that entered escrow on the day
+    payments_count = models.IntegerField(default=0)
+    payments_volume = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    platform_fees = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    
+    # Escrow released to technicians on the day
+    released_count = models.IntegerField(default=0)
+    released_volume = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    
+    # B2C payouts requested on the day
+    payouts_count = models.IntegerField(default=0)
+    payouts_volume = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    payouts_failed = models.IntegerField(default=0)
+    
+    # Wallet activity
+    transactions_count = models.IntegerField(default=0)
+    wallets_checked = models.IntegerField(default=0)
+    
+    # Escrow position at the end of the run
+    escrow_expected = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Sum of held payments
+    escrow_ledger = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    
+    discrepancy_count = models.IntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"Settlement {self.date} ({self.status})"
+
+
+class SettlementDiscrepancy(models.Model):
+    """One reconciliation failure found by a settlement run"""
+    KIND_CHOICES = (
+        ('escrow', 'Escrow vs Held Payments'),
+        ('commission', 'Commission vs Released Fees'),
+        ('platform_earnings', 'Platform Earnings vs Fee'),
+        ('wallet_chain', 'Wallet Transaction Chain'),
+        ('wallet_balance', 'Wallet vs Ledger Balance'),
+        ('payout_stuck', 'Payout Stuck'),
+    )
+    
+    settlement = models.ForeignKey(DailySettlement, on_delete=models.CASCADE, related_name='discrepancies')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    reference = models.CharField(max_length=100, blank=True)  # payment_ref, payout_ref, wallet id...
+    expected = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    actual = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    detail = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = "Settlement Discrepancies"
+    
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.reference}"
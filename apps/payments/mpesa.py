@@ -2,16 +2,86 @@
 M-Pesa Daraja API Integration
 Full implementation for STK Push (C2B) and B2C Payouts
 """
+import asyncio
 import requests
+import httpx
 import base64
+import os
+import time
+import threading
 from datetime import datetime
 from django.conf import settings
 from django.core.cache import cache
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+TOKEN_CACHE_KEY = 'mpesa_access_token'
+TOKEN_LOCK_KEY = 'mpesa_access_token:refresh_lock'
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_background_refresh = threading.Lock()
+
+
+def get_session():
+    """
+    Shared keep-alive session for Daraja calls, one per process.
+    Connection errors are retried for every method (nothing reached Safaricom);
+    5xx responses are retried only for idempotent GETs such as the OAuth call.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                retry = Retry(
+                    total=3,
+                    connect=3,
+                    read=0,
+                    status=2,
+                    backoff_factor=0.3,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(['GET'])
+                )
+                pool_size = getattr(settings, 'MPESA_HTTP_POOL_SIZE', 20)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def get_timeout():
+    """(connect, read) timeout for Daraja requests"""
+    return (
+        getattr(settings, 'MPESA_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'MPESA_READ_TIMEOUT', 30),
+    )
+
+
+def _json_or_empty(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+
+def _b2c_network_error(error, in_doubt):
+    """
+    B2C submit that got no usable response. Connection failures never reached
+    Safaricom and are safe to retry. A timeout after the request was sent is
+    'in doubt': Safaricom may have accepted it, so it must not be resent.
+    """
+    logger.error(f"B2C Payment failed: {error}")
+    return {'success': False, 'transient': not in_doubt, 'in_doubt': in_doubt, 'error': str(error) or type(error).__name__}
+
 
 class MpesaAPI:
     """M-Pesa Daraja API wrapper"""
@@ -31,24 +101,75 @@ class MpesaAPI:
         self.b2c_result_url = getattr(settings, 'MPESA_B2C_RESULT_URL', '')
         self.b2c_timeout_url = getattr(settings, 'MPESA_B2C_TIMEOUT_URL', '')
         
-        if self.environment == 'sandbox':
+        # MPESA_BASE_URL points the client at a stand-in such as daraja_simulator.py
+        if getattr(settings, 'MPESA_BASE_URL', ''):
+            self.base_url = settings.MPESA_BASE_URL.rstrip('/')
+        elif self.environment == 'sandbox':
             self.base_url = 'https://sandbox.safaricom.co.ke'
         else:
             self.base_url = 'https://api.safaricom.co.ke'
     
     def get_access_token(self):
-        """Get OAuth access token from M-Pesa API"""
-        cached_token = cache.get('mpesa_access_token')
-        if cached_token:
-            return cached_token
+        """
+        Get OAuth access token from M-Pesa API.
+        
+        The token is shared through the cache. Once it is within
+        MPESA_TOKEN_REFRESH_MARGIN seconds of expiry, one background thread
+        refreshes it while callers keep using the current token. Fetches are
+        single-flight across threads and processes (cache.add lock).
+        """
+        entry = cache.get(TOKEN_CACHE_KEY)
+        now = time.time()
         
+        if isinstance(entry, dict) and entry.get('expires_at', 0) > now:
+            margin = getattr(settings, 'MPESA_TOKEN_REFRESH_MARGIN', 300)
+            if entry['expires_at'] - now < margin:
+                self._refresh_in_background()
+            return entry['token']
+        
+        return self._refresh_token(wait=True)
+    
+    def _refresh_in_background(self):
+        # At most one refresh thread per process; other processes are held off by the cache lock
+        if not _background_refresh.acquire(blocking=False):
+            return
+        
+        def run():
+            try:
+                self._refresh_token(wait=False)
+            except Exception as e:
+                logger.warning(f"Background M-Pesa token refresh failed: {e}")
+            finally:
+                _background_refresh.release()
+        
+        threading.Thread(target=run, daemon=True).start()
+    
+    def _refresh_token(self, wait):
+        """Fetch a new token unless another caller already is"""
+        if not cache.add(TOKEN_LOCK_KEY, os.getpid(), 30):
+            if not wait:
+                return None
+            # Someone else is fetching - wait for their token rather than stampeding OAuth
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                time.sleep(0.1)
+                entry = cache.get(TOKEN_CACHE_KEY)
+                if isinstance(entry, dict) and entry.get('expires_at', 0) > time.time():
+                    return entry['token']
+        
+        try:
+            return self._fetch_token()
+        finally:
+            cache.delete(TOKEN_LOCK_KEY)
+    
+    def _fetch_token(self):
         url = f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials'
         
         try:
-            response = requests.get(
+            response = get_session().get(
                 url,
                 auth=(self.consumer_key, self.consumer_secret),
-                timeout=30
+                timeout=get_timeout()
             )
             response.raise_for_status()
             
@@ -56,7 +177,10 @@ class MpesaAPI:
             token = data.get('access_token')
             
             if token:
-                cache.set('mpesa_access_token', token, 3000)
+                expires_in = int(data.get('expires_in', 3599))
+                # Keep a minute of slack so we never hand out a token that expires in flight
+                ttl = max(expires_in - 60, 60)
+                cache.set(TOKEN_CACHE_KEY, {'token': token, 'expires_at': time.time() + ttl}, ttl)
                 logger.info("M-Pesa access token obtained")
                 return token
             else:
@@ -87,66 +211,124 @@ class MpesaAPI:
         
         return phone
     
+    def _headers(self, access_token):
+        return {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+    
+    def _stk_push_request(self, phone_number, amount, account_reference, transaction_desc):
+        """URL and payload for an STK Push"""
+        password, timestamp = self.generate_password()
+        formatted_phone = self.format_phone_number(phone_number)
+        
+        payload = {
+            'BusinessShortCode': self.shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'TransactionType': 'CustomerPayBillOnline',
+            'Amount': int(float(amount)),
+            'PartyA': formatted_phone,
+            'PartyB': self.shortcode,
+            'PhoneNumber': formatted_phone,
+            'CallBackURL': self.callback_url,
+            'AccountReference': account_reference[:12],
+            'TransactionDesc': transaction_desc[:13]
+        }
+        
+        logger.info(f"STK Push to {formatted_phone} for KES {amount}")
+        return f'{self.base_url}/mpesa/stkpush/v1/processrequest', payload
+    
+    def _stk_push_result(self, result):
+        logger.info(f"STK Push response: {result}")
+        
+        if result.get('ResponseCode') == '0':
+            return {
+                'success': True,
+                'checkout_request_id': result.get('CheckoutRequestID'),
+                'merchant_request_id': result.get('MerchantRequestID'),
+                'response_code': result.get('ResponseCode'),
+                'response_description': result.get('ResponseDescription'),
+                'customer_message': result.get('CustomerMessage')
+            }
+        
+        error_msg = result.get('errorMessage') or result.get('ResponseDescription', 'STK Push failed')
+        
+        # Clear token cache if access token error
+        if 'access token' in error_msg.lower():
+            cache.delete(TOKEN_CACHE_KEY)
+        
+        return {
+            'success': False,
+            'error': error_msg,
+            'response_code': result.get('ResponseCode')
+        }
+    
+    def _stk_query_request(self, checkout_request_id):
+        """URL and payload for an STK Push status query"""
+        password, timestamp = self.generate_password()
+        payload = {
+            'BusinessShortCode': self.shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'CheckoutRequestID': checkout_request_id
+        }
+        return f'{self.base_url}/mpesa/stkpushquery/v1/query', payload
+    
+    def _b2c_request(self, phone_number, amount, occasion='', remarks=''):
+        """URL and payload for a B2C payment"""
+        formatted_phone = self.format_phone_number(phone_number)
+        
+        payload = {
+            'InitiatorName': self.b2c_initiator,
+            'SecurityCredential': self.b2c_security_credential,
+            'CommandID': 'BusinessPayment',
+            'Amount': int(float(amount)),
+            'PartyA': self.b2c_shortcode,
+            'PartyB': formatted_phone,
+            'Remarks': remarks[:100] if remarks else 'Payout',
+            'QueueTimeOutURL': self.b2c_timeout_url,
+            'ResultURL': self.b2c_result_url,
+            'Occasion': occasion[:100] if occasion else 'Payout'
+        }
+        
+        logger.info(f"B2C Payment to {formatted_phone} for KES {amount}")
+        return f'{self.base_url}/mpesa/b2c/v1/paymentrequest', payload
+    
+    def _b2c_result(self, result, status_code=200):
+        """
+        Parse a B2C submit response. Failures carry 'transient': True when a
+        retry may succeed (throttling or a Safaricom-side 5xx).
+        """
+        if status_code == 429 or status_code >= 500:
+            return {
+                'success': False,
+                'transient': True,
+                'error': result.get('errorMessage') or f'Daraja returned HTTP {status_code}'
+            }
+        if result.get('ResponseCode') == '0':
+            return {
+                'success': True,
+                'conversation_id': result.get('ConversationID'),
+                'originator_conversation_id': result.get('OriginatorConversationID'),
+                'response_code': result.get('ResponseCode'),
+                'response_description': result.get('ResponseDescription')
+            }
+        return {
+            'success': False,
+            'transient': False,
+            'error': result.get('errorMessage') or result.get('ResponseDescription', 'B2C failed')
+        }
+    
     def stk_push(self, phone_number, amount, account_reference, transaction_desc):
         """
         Initiate STK Push (Lipa Na M-Pesa Online)
         """
         try:
             access_token = self.get_access_token()
-            password, timestamp = self.generate_password()
-            
-            url = f'{self.base_url}/mpesa/stkpush/v1/processrequest'
-            
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            formatted_phone = self.format_phone_number(phone_number)
-            
-            payload = {
-                'BusinessShortCode': self.shortcode,
-                'Password': password,
-                'Timestamp': timestamp,
-                'TransactionType': 'CustomerPayBillOnline',
-                'Amount': int(float(amount)),
-                'PartyA': formatted_phone,
-                'PartyB': self.shortcode,
-                'PhoneNumber': formatted_phone,
-                'CallBackURL': self.callback_url,
-                'AccountReference': account_reference[:12],
-                'TransactionDesc': transaction_desc[:13]
-            }
-            
-            logger.info(f"STK Push to {formatted_phone} for KES {amount}")
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            result = response.json()
-            
-            logger.info(f"STK Push response: {result}")
-            
-            if result.get('ResponseCode') == '0':
-                return {
-                    'success': True,
-                    'checkout_request_id': result.get('CheckoutRequestID'),
-                    'merchant_request_id': result.get('MerchantRequestID'),
-                    'response_code': result.get('ResponseCode'),
-                    'response_description': result.get('ResponseDescription'),
-                    'customer_message': result.get('CustomerMessage')
-                }
-            else:
-                error_msg = result.get('errorMessage') or result.get('ResponseDescription', 'STK Push failed')
-                
-                # Clear token cache if access token error
-                if 'access token' in error_msg.lower():
-                    cache.delete('mpesa_access_token')
-                
-                return {
-                    'success': False,
-                    'error': error_msg,
-                    'response_code': result.get('ResponseCode')
-                }
-                
+            url, payload = self._stk_push_request(phone_number, amount, account_reference, transaction_desc)
+            response = get_session().post(url, json=payload, headers=self._headers(access_token), timeout=get_timeout())
+            return self._stk_push_result(response.json())
         except Exception as e:
             logger.error(f"STK Push failed: {e}")
             return {'success': False, 'error': str(e)}
@@ -155,25 +337,9 @@ class MpesaAPI:
         """Query the status of an STK Push transaction"""
         try:
             access_token = self.get_access_token()
-            password, timestamp = self.generate_password()
-            
-            url = f'{self.base_url}/mpesa/stkpushquery/v1/query'
-            
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            payload = {
-                'BusinessShortCode': self.shortcode,
-                'Password': password,
-                'Timestamp': timestamp,
-                'CheckoutRequestID': checkout_request_id
-            }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            url, payload = self._stk_query_request(checkout_request_id)
+            response = get_session().post(url, json=payload, headers=self._headers(access_token), timeout=get_timeout())
             return response.json()
-            
         except Exception as e:
             logger.error(f"STK status query failed: {e}")
             return None
@@ -182,51 +348,150 @@ class MpesaAPI:
         """B2C Payment - Platform pays technician"""
         try:
             access_token = self.get_access_token()
-            
-            url = f'{self.base_url}/mpesa/b2c/v1/paymentrequest'
-            
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            formatted_phone = self.format_phone_number(phone_number)
-            
-            payload = {
-                'InitiatorName': self.b2c_initiator,
-                'SecurityCredential': self.b2c_security_credential,
-                'CommandID': 'BusinessPayment',
-                'Amount': int(float(amount)),
-                'PartyA': self.b2c_shortcode,
-                'PartyB': formatted_phone,
-                'Remarks': remarks[:100] if remarks else 'Payout',
-                'QueueTimeOutURL': self.b2c_timeout_url,
-                'ResultURL': self.b2c_result_url,
-                'Occasion': occasion[:100] if occasion else 'Payout'
-            }
-            
-            logger.info(f"B2C Payment to {formatted_phone} for KES {amount}")
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            result = response.json()
-            
-            if result.get('ResponseCode') == '0':
-                return {
-                    'success': True,
-                    'conversation_id': result.get('ConversationID'),
-                    'originator_conversation_id': result.get('OriginatorConversationID'),
-                    'response_code': result.get('ResponseCode'),
-                    'response_description': result.get('ResponseDescription')
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': result.get('errorMessage') or result.get('ResponseDescription', 'B2C failed')
-                }
-                
+        except Exception as e:
+            # Nothing was sent to Safaricom yet
+            return _b2c_network_error(e, in_doubt=False)
+        try:
+            url, payload = self._b2c_request(phone_number, amount, occasion, remarks)
+            response = get_session().post(url, json=payload, headers=self._headers(access_token), timeout=get_timeout())
+            return self._b2c_result(_json_or_empty(response), response.status_code)
+        except requests.exceptions.ConnectTimeout as e:
+            return _b2c_network_error(e, in_doubt=False)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            # Only a failed connect proves the request never left; resets and read timeouts may not
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            return _b2c_network_error(e, in_doubt=not isinstance(reason, NewConnectionError))
         except Exception as e:
             logger.error(f"B2C Payment failed: {e}")
+            return {'success': False, 'transient': False, 'error': str(e)}
+
+
+class AsyncMpesaAPI(MpesaAPI):
+    """
+    Asyncio counterpart of MpesaAPI for async views and batch workers.
+    
+    Same method surface (stk_push, query_stk_status, b2c_payment) as coroutines,
+    sharing one pooled httpx.AsyncClient so hundreds of Daraja calls can be in
+    flight without tying up threads. Tokens are shared with MpesaAPI through
+    the cache.
+    
+        async with AsyncMpesaAPI() as mpesa:
+            results = await mpesa.query_many(checkout_ids, concurrency=20)
+    """
+    
+    def __init__(self, max_connections=None):
+        super().__init__()
+        self.max_connections = max_connections or getattr(settings, 'MPESA_HTTP_POOL_SIZE', 20)
+        self._client = None
+        self._token_lock = None
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    @property
+    def client(self):
+        if self._client is None:
+            connect_timeout, read_timeout = get_timeout()
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                # The client ignores its own limits= when given a transport, so the pool is sized here
+                transport=httpx.AsyncHTTPTransport(
+                    retries=2,  # Connection errors only
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections
+                    )
+                )
+            )
+        return self._client
+    
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def get_access_token(self):
+        """Async token lookup; fetches (single-flight) when no valid token is cached"""
+        entry = await cache.aget(TOKEN_CACHE_KEY)
+        if isinstance(entry, dict) and entry.get('expires_at', 0) > time.time():
+            margin = getattr(settings, 'MPESA_TOKEN_REFRESH_MARGIN', 300)
+            if entry['expires_at'] - time.time() < margin:
+                self._refresh_in_background()
+            return entry['token']
+        
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            # Another coroutine may have fetched it while we waited
+            entry = await cache.aget(TOKEN_CACHE_KEY)
+            if isinstance(entry, dict) and entry.get('expires_at', 0) > time.time():
+                return entry['token']
+            return await sync_to_async(self._refresh_token, thread_sensitive=False)(wait=True)
+    
+    async def _post(self, url, payload, access_token=None):
+        access_token = access_token or await self.get_access_token()
+        return await self.client.post(url, json=payload, headers=self._headers(access_token))
+    
+    async def stk_push(self, phone_number, amount, account_reference, transaction_desc):
+        """Initiate STK Push (Lipa Na M-Pesa Online)"""
+        try:
+            url, payload = self._stk_push_request(phone_number, amount, account_reference, transaction_desc)
+            response = await self._post(url, payload)
+            return self._stk_push_result(response.json())
+        except Exception as e:
+            logger.error(f"STK Push failed: {e}")
             return {'success': False, 'error': str(e)}
+    
+    async def query_stk_status(self, checkout_request_id):
+        """Query the status of an STK Push transaction"""
+        try:
+            url, payload = self._stk_query_request(checkout_request_id)
+            response = await self._post(url, payload)
+            return response.json()
+        except Exception as e:
+            logger.error(f"STK status query failed: {e}")
+            return None
+    
+    async def b2c_payment(self, phone_number, amount, occasion='', remarks=''):
+        """B2C Payment - Platform pays technician"""
+        try:
+            access_token = await self.get_access_token()
+        except Exception as e:
+            # Nothing was sent to Safaricom yet
+            return _b2c_network_error(e, in_doubt=False)
+        try:
+            url, payload = self._b2c_request(phone_number, amount, occasion, remarks)
+            response = await self._post(url, payload, access_token)
+            return self._b2c_result(_json_or_empty(response), response.status_code)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            return _b2c_network_error(e, in_doubt=False)
+        except httpx.TransportError as e:
+            return _b2c_network_error(e, in_doubt=True)
+        except Exception as e:
+            logger.error(f"B2C Payment failed: {e}")
+            return {'success': False, 'transient': False, 'error': str(e)}
+    
+    async def query_many(self, checkout_request_ids, concurrency=20):
+        """Query many STK pushes concurrently; returns {checkout_request_id: result}"""
+        results = await gather_limited(
+            [self.query_stk_status(checkout_id) for checkout_id in checkout_request_ids],
+            concurrency
+        )
+        return dict(zip(checkout_request_ids, results))
+
+
+async def gather_limited(coroutines, concurrency):
+    """asyncio.gather with at most `concurrency` coroutines running at once"""
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+    
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
 
 
 def initiate_job_payment(job_payment, phone_number):
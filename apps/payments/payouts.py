@@ -0,0 +1,271 @@
+"""
+B2C payout scheduler
+
+request_payout only debits the wallet and queues a pending Payout. Workers
+(`manage.py drain_payouts`) claim due payouts in batches and submit them to
+Daraja concurrently through AsyncMpesaAPI, within a rate limit shared by all
+workers.
+
+- Transient failures (throttling, Safaricom 5xx, connection errors) are retried
+  with exponential backoff and jitter, up to PAYOUT_MAX_ATTEMPTS.
+- Consecutive transient failures trip a circuit breaker, and while it is open
+  no payouts are sent. After the cooldown a single probe payout decides
+  whether it closes again.
+- Permanent failures, and payouts that run out of attempts, are failed and
+  refunded to the wallet exactly once.
+- A submit that timed out after being sent is "in doubt". It stays in
+  processing for the B2C result callback or manual reconciliation, and is
+  never resent.
+"""
+import time
+import random
+import asyncio
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Payout, Wallet
+from .mpesa import AsyncMpesaAPI, gather_limited
+
+logger = logging.getLogger(__name__)
+
+RATE_KEY = 'payouts:rate:{}'
+BREAKER_FAILURES_KEY = 'payouts:breaker:failures'
+BREAKER_OPEN_UNTIL_KEY = 'payouts:breaker:open_until'
+BREAKER_PROBE_KEY = 'payouts:breaker:probe'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class RateLimiter:
+    """
+    Requests-per-second limit shared by every worker process through the cache
+    (one counter per one-second window).
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate or _setting('PAYOUT_RATE_PER_SECOND', 5)
+
+    def _take(self):
+        """Count one request against the current window; returns seconds to wait, 0 if allowed"""
+        now = time.time()
+        key = RATE_KEY.format(int(now))
+        cache.add(key, 0, 5)
+        try:
+            # Sync incr is atomic in the cache backend; BaseCache.aincr is a get + set
+            count = cache.incr(key)
+        except ValueError:
+            count = 1
+        if count <= self.rate:
+            return 0
+        return int(now) + 1 - now + random.uniform(0, 0.05)
+
+    async def acquire(self):
+        while True:
+            wait = await asyncio.to_thread(self._take)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """Cache-backed breaker shared by all workers: closed -> open -> half_open -> closed"""
+
+    def __init__(self, threshold=None, cooldown=None):
+        self.threshold = threshold or _setting('PAYOUT_BREAKER_THRESHOLD', 5)
+        self.cooldown = cooldown or _setting('PAYOUT_BREAKER_COOLDOWN', 60)
+
+    def state(self):
+        open_until = cache.get(BREAKER_OPEN_UNTIL_KEY)
+        if open_until is None:
+            return 'closed'
+        if time.time() < open_until:
+            return 'open'
+        return 'half_open'
+
+    def acquire_probe(self):
+        """Only one worker may send the half-open probe"""
+        return cache.add(BREAKER_PROBE_KEY, 1, self.cooldown)
+
+    def record_success(self):
+        if cache.get(BREAKER_OPEN_UNTIL_KEY) is not None:
+            logger.info("Payout circuit breaker closed")
+        cache.delete_many([BREAKER_FAILURES_KEY, BREAKER_OPEN_UNTIL_KEY, BREAKER_PROBE_KEY])
+
+    def record_failure(self):
+        cache.add(BREAKER_FAILURES_KEY, 0, self.cooldown * 10)
+        try:
+            failures = cache.incr(BREAKER_FAILURES_KEY)
+        except ValueError:
+            failures = 1
+        state = self.state()
+        if state == 'half_open' or (state == 'closed' and failures >= self.threshold):
+            cache.set(BREAKER_OPEN_UNTIL_KEY, time.time() + self.cooldown, None)
+            cache.delete(BREAKER_PROBE_KEY)
+            logger.warning(f"Payout circuit breaker open for {self.cooldown}s after {failures} failures")
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with equal jitter, in seconds"""
+    base = _setting('PAYOUT_RETRY_BASE_SECONDS', 30)
+    cap = _setting('PAYOUT_RETRY_MAX_SECONDS', 3600)
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def fail(payout, reason, from_statuses=('pending', 'processing')):
+    """
+    Fail a payout and refund the wallet. The refund happens only for the
+    caller whose conditional update moved the payout. Returns True if it did.
+    """
+    with db_transaction.atomic():
+        updated = Payout.objects.filter(pk=payout.pk, status__in=from_statuses).update(
+            status='failed', failure_reason=reason or 'Unknown'
+        )
+        if updated:
+            wallet, _ = Wallet.objects.get_or_create(user_id=payout.technician_id)
+            wallet.credit(payout.amount, 'refund', f'Payout failed: {payout.payout_ref}')
+    return bool(updated)
+
+
+def claim(batch_size):
+    """Move up to batch_size due M-Pesa payouts from pending to processing"""
+    now = timezone.now()
+    with db_transaction.atomic():
+        payouts = list(
+            Payout.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', payout_method='mpesa')
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .order_by('created_at')[:batch_size]
+        )
+        if payouts:
+            Payout.objects.filter(pk__in=[p.pk for p in payouts]).update(status='processing')
+    return payouts
+
+
+async def _submit(payouts, limiter, breaker, concurrency):
+    """Send each payout and settle it as soon as its own response arrives. Returns the outcomes."""
+    # One thread for every settle() keeps the ORM off the event loop and reuses one connection
+    settle_async = sync_to_async(settle, thread_sensitive=True)
+
+    async def send(mpesa, payout):
+        await limiter.acquire()
+        # Stop sending as soon as another worker trips the breaker
+        if await asyncio.to_thread(breaker.state) == 'open':
+            result = {'success': False, 'transient': True, 'skipped': True, 'error': 'Circuit breaker open'}
+        else:
+            result = await mpesa.b2c_payment(
+                phone_number=payout.phone_number,
+                amount=payout.amount,
+                occasion=f'Payout {payout.payout_ref}',
+                remarks='FundiGO payout'
+            )
+        # Record the conversation id now, not after the batch: the B2C result can arrive within seconds
+        return await settle_async(payout, result, breaker)
+
+    async with AsyncMpesaAPI(max_connections=concurrency) as mpesa:
+        return await gather_limited([send(mpesa, payout) for payout in payouts], concurrency)
+
+
+def settle(payout, result, breaker):
+    """Record the outcome of one B2C submit"""
+    if result.get('success'):
+        breaker.record_success()
+        Payout.objects.filter(pk=payout.pk, status='processing').update(
+            mpesa_conversation_id=result.get('conversation_id') or '',
+            mpesa_originator_conversation_id=result.get('originator_conversation_id') or '',
+            attempts=payout.attempts + 1,
+            failure_reason=''
+        )
+        return 'submitted'
+
+    if result.get('skipped'):
+        Payout.objects.filter(pk=payout.pk, status='processing').update(
+            status='pending', next_attempt_at=timezone.now() + timedelta(seconds=breaker.cooldown)
+        )
+        return 'deferred'
+
+    attempts = payout.attempts + 1
+    error = result.get('error') or 'Unknown error'
+
+    if result.get('in_doubt'):
+        breaker.record_failure()
+        Payout.objects.filter(pk=payout.pk, status='processing').update(
+            attempts=attempts,
+            failure_reason=f'No response from Daraja, awaiting result callback: {error}'
+        )
+        logger.warning(f"Payout {payout.payout_ref} in doubt: {error}")
+        return 'in_doubt'
+
+    if result.get('transient'):
+        breaker.record_failure()
+        if attempts < _setting('PAYOUT_MAX_ATTEMPTS', 6):
+            Payout.objects.filter(pk=payout.pk, status='processing').update(
+                status='pending',
+                attempts=attempts,
+                next_attempt_at=timezone.now() + timedelta(seconds=backoff_delay(attempts)),
+                failure_reason=error
+            )
+            return 'retry'
+
+    if not result.get('transient'):
+        # Daraja answered, so it is up even though it rejected this payout
+        breaker.record_success()
+    Payout.objects.filter(pk=payout.pk).update(attempts=attempts)
+    fail(payout, error, from_statuses=('processing',))
+    logger.warning(f"Payout {payout.payout_ref} failed after {attempts} attempt(s): {error}")
+    return 'failed'
+
+
+def drain_batch(batch_size=None, concurrency=None):
+    """
+    Claim, submit and settle one batch. Returns a dict of outcome counts, or
+    None if the circuit breaker is open.
+    """
+    batch_size = batch_size or _setting('PAYOUT_BATCH_SIZE', 50)
+    concurrency = concurrency or _setting('PAYOUT_CONCURRENCY', 10)
+    breaker = CircuitBreaker()
+
+    state = breaker.state()
+    if state == 'open':
+        return None
+    if state == 'half_open':
+        if not breaker.acquire_probe():
+            return None
+        batch_size = 1
+
+    payouts = claim(batch_size)
+    outcomes = {}
+    if not payouts:
+        return outcomes
+
+    for outcome in asyncio.run(_submit(payouts, RateLimiter(), breaker, concurrency)):
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    logger.info(f"Payout batch of {len(payouts)}: {outcomes}")
+    return outcomes
+
+
+def run(batch_size=None, concurrency=None, loop=False, idle_sleep=1.0):
+    """Drain due payouts; with loop=True keep polling. Returns outcome totals."""
+    totals = {}
+    try:
+        while True:
+            outcomes = drain_batch(batch_size, concurrency)
+            for outcome, count in (outcomes or {}).items():
+                totals[outcome] = totals.get(outcome, 0) + count
+            if outcomes:
+                continue
+            if not loop:
+                return totals
+            time.sleep(idle_sleep)
+    finally:
+        close_old_connections()
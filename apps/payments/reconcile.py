@@ -0,0 +1,114 @@
+"""
+STK Push status reconciliation
+
+Clients poll check_payment_status, which only reads the database. When an STK
+callback is late or lost, the reconciler (`manage.py reconcile_stk_payments`)
+finds processing JobPayments older than STK_RECONCILE_AFTER_SECONDS and asks
+Daraja about them. The queries run concurrently through AsyncMpesaAPI, and the
+results are settled in bulk.
+
+Payments are taken least recently queried first, so ones Daraja keeps
+answering "unknown" for rotate to the back instead of holding every batch.
+A payment still unknown STK_RECONCILE_MAX_AGE_SECONDS after it was created is
+marked failed; a confirmation that arrives later still moves it to escrow.
+"""
+import time
+import asyncio
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import escrow
+from .models import JobPayment
+from .mpesa import AsyncMpesaAPI
+
+logger = logging.getLogger(__name__)
+
+# Query errorCode while the customer has not answered the prompt yet
+STILL_PROCESSING_CODE = '500.001.1001'
+# Query errorCode for a CheckoutRequestID Daraja does not know
+INVALID_CHECKOUT_CODE = '400.002.02'
+
+
+def stale_payments(limit):
+    """Processing STK payments old enough that their callback should have arrived, least recently queried first"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'STK_RECONCILE_AFTER_SECONDS', 60))
+    return list(
+        JobPayment.objects.filter(status='processing', created_at__lte=cutoff)
+        .exclude(mpesa_checkout_request_id='')
+        .order_by(F('last_reconciled_at').asc(nulls_first=True), 'created_at')
+        .only('id', 'payment_ref', 'mpesa_checkout_request_id', 'created_at')[:limit]
+    )
+
+
+async def _query(checkout_request_ids, concurrency):
+    async with AsyncMpesaAPI(max_connections=concurrency) as mpesa:
+        return await mpesa.query_many(checkout_request_ids, concurrency=concurrency)
+
+
+def classify(result):
+    """'paid', 'failed' or None (unknown / still waiting) for an STK query response"""
+    if not result:
+        return None
+    result_code = result.get('ResultCode')
+    if result_code is not None:
+        return 'paid' if str(result_code) == '0' else 'failed'
+    if result.get('errorCode') == INVALID_CHECKOUT_CODE:
+        return 'failed'
+    return None
+
+
+def reconcile_batch(batch_size=None, concurrency=None):
+    """Query and settle one batch of stale payments. Returns outcome counts."""
+    batch_size = batch_size or getattr(settings, 'STK_RECONCILE_BATCH_SIZE', 200)
+    concurrency = concurrency or getattr(settings, 'STK_RECONCILE_CONCURRENCY', 10)
+
+    payments = stale_payments(batch_size)
+    if not payments:
+        return {}
+
+    results = asyncio.run(_query([p.mpesa_checkout_request_id for p in payments], concurrency))
+
+    now = timezone.now()
+    expire_before = now - timedelta(seconds=getattr(settings, 'STK_RECONCILE_MAX_AGE_SECONDS', 6 * 3600))
+    paid, failed, expired, pending = [], [], [], 0
+    for payment in payments:
+        outcome = classify(results.get(payment.mpesa_checkout_request_id))
+        if outcome == 'paid':
+            paid.append(payment)
+        elif outcome == 'failed':
+            failed.append(payment.pk)
+        elif payment.created_at <= expire_before:
+            expired.append(payment.pk)
+        else:
+            pending += 1
+
+    JobPayment.objects.filter(pk__in=[p.pk for p in payments]).update(last_reconciled_at=now)
+    # Paid payments need escrow, earnings and ledger rows; failures are one UPDATE
+    settled = sum(1 for payment in paid if escrow.mark_paid(payment))
+    failed_count = JobPayment.objects.filter(pk__in=failed, status='processing').update(status='failed') if failed else 0
+    expired_count = JobPayment.objects.filter(pk__in=expired, status='processing').update(status='failed') if expired else 0
+    if expired_count:
+        logger.warning(f"STK reconciliation: {expired_count} payment(s) still unknown after the maximum age, marked failed")
+
+    outcomes = {'paid': settled, 'failed': failed_count, 'expired': expired_count, 'pending': pending}
+    logger.info(f"STK reconciliation of {len(payments)} payment(s): {outcomes}")
+    return outcomes
+
+
+def run(batch_size=None, concurrency=None, loop=False, interval=30):
+    """Reconcile once, or every `interval` seconds with loop=True. Returns outcome totals."""
+    totals = {}
+    try:
+        while True:
+            for outcome, count in reconcile_batch(batch_size, concurrency).items():
+                totals[outcome] = totals.get(outcome, 0) + count
+            if not loop:
+                return totals
+            time.sleep(interval)
+    finally:
+        close_old_connections()
@@ -0,0 +1,174 @@
+"""
+Platform revenue rollups
+
+PlatformEarningsRollup holds one row per period bucket (day, week, month)
+and dimension (job category, technician account type, payment method). The
+escrow transitions bump the rows with relative UPDATEs in the same
+transaction as the JobPayment status, so revenue reports read a handful of
+rows instead of scanning PlatformEarnings. rebuild() recomputes them from
+JobPayment if they ever drift.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Q, Sum, Count
+from django.db.models.functions import Coalesce, TruncDay, TruncWeek, TruncMonth
+from django.utils import timezone
+
+from apps.technicians.models import TechnicianProfile
+from .models import PlatformEarningsRollup, JobPayment
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('day', 'week', 'month')
+TRUNCATE = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+DIMENSIONS = ('category', 'account_type', 'payment_method')
+TOTALS = (
+    'payments_count', 'payments_volume', 'fees_held', 'released_count',
+    'fees_released', 'refunded_count', 'refunded_volume'
+)
+
+
+def period_start(period, day):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _dimensions(job_payments):
+    """{job_payment pk: (category, account_type, payment_method)}"""
+    account_types = dict(
+        TechnicianProfile.objects.filter(
+            user_id__in={job_payment.technician_id for job_payment in job_payments}
+        ).values_list('user_id', 'account_type')
+    )
+    return {
+        job_payment.pk: (
+            job_payment.job.category,
+            account_types.get(job_payment.technician_id, 'individual'),
+            job_payment.payment_method
+        )
+        for job_payment in job_payments
+    }
+
+
+def _paid_day(job_payment):
+    return timezone.localdate(job_payment.paid_at or job_payment.created_at)
+
+
+def _bump(day, dimensions, **deltas):
+    category, account_type, payment_method = dimensions
+    for period in PERIODS:
+        lookup = {
+            'period': period, 'period_start': period_start(period, day),
+            'category': category, 'account_type': account_type, 'payment_method': payment_method
+        }
+        PlatformEarningsRollup.objects.bulk_create([PlatformEarningsRollup(**lookup)], ignore_conflicts=True)
+        PlatformEarningsRollup.objects.filter(**lookup).update(
+            updated_at=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()}
+        )
+
+
+def payment_held(job_payment):
+    """Client paid: the fee is revenue held in escrow"""
+    _bump(
+        _paid_day(job_payment), _dimensions([job_payment])[job_payment.pk],
+        payments_count=1, payments_volume=job_payment.amount_paid, fees_held=job_payment.platform_fee
+    )
+
+
+def payments_released(job_payments):
+    """Escrow released: the fee leaves its paid-day bucket's held total and is earned on the release day"""
+    dimensions = _dimensions(job_payments)
+    held, released = defaultdict(Decimal), defaultdict(lambda: [0, Decimal('0')])
+    for job_payment in job_payments:
+        key = dimensions[job_payment.pk]
+        held[(_paid_day(job_payment), key)] += job_payment.platform_fee
+        totals = released[(timezone.localdate(job_payment.released_at), key)]
+        totals[0] += 1
+        totals[1] += job_payment.platform_fee
+
+    for (day, key), fees in held.items():
+        _bump(day, key, fees_held=-fees)
+    for (day, key), (count, fees) in released.items():
+        _bump(day, key, released_count=count, fees_released=fees)
+
+
+def payment_refunded(job_payment):
+    """Held payment refunded to the client: the fee will never be earned"""
+    _bump(
+        _paid_day(job_payment), _dimensions([job_payment])[job_payment.pk],
+        fees_held=-job_payment.platform_fee, refunded_count=1, refunded_volume=job_payment.amount_paid
+    )
+
+
+def report(period, start=None, end=None, group_by=None):
+    """
+    Rollup rows for `period` with period_start in [start, end], summed over
+    every dimension not in group_by. Reads only the rollup table.
+    """
+    group_by = [dimension for dimension in (group_by or []) if dimension in DIMENSIONS]
+    rows = PlatformEarningsRollup.objects.filter(period=period)
+    if start:
+        rows = rows.filter(period_start__gte=period_start(period, start))
+    if end:
+        rows = rows.filter(period_start__lte=end)
+    return list(
+        rows.values('period_start', *group_by).annotate(**{field: Sum(field) for field in TOTALS})
+        .order_by('period_start', *group_by)
+    )
+
+
+def rebuild():
+    """Recompute every rollup row from JobPayment. Returns the number of rows written."""
+    payments = JobPayment.objects.filter(status__in=['held', 'released', 'refunded'])
+    dimensions = {
+        'category': F('job__category'),
+        'account_type': F('technician__technician_profile__account_type'),
+        'method': F('payment_method'),
+    }
+    rows = defaultdict(lambda: dict.fromkeys(TOTALS, 0))
+
+    for period in PERIODS:
+        truncate = TRUNCATE[period]
+        paid = payments.annotate(bucket=truncate(Coalesce('paid_at', 'created_at')), **dimensions).values(
+            'bucket', 'category', 'account_type', 'method'
+        ).annotate(
+            payments_count=Count('id'),
+            payments_volume=Sum('amount_paid'),
+            fees_held=Sum('platform_fee', filter=Q(status='held')),
+            refunded_count=Count('id', filter=Q(status='refunded')),
+            refunded_volume=Sum('amount_paid', filter=Q(status='refunded'))
+        )
+        released = payments.filter(status='released').annotate(bucket=truncate('released_at'), **dimensions).values(
+            'bucket', 'category', 'account_type', 'method'
+        ).annotate(released_count=Count('id'), fees_released=Sum('platform_fee'))
+
+        for aggregate in (paid, released):
+            for row in aggregate:
+                bucket = row.pop('bucket')
+                key = (
+                    period, bucket.date() if hasattr(bucket, 'date') else bucket,
+                    row.pop('category'), row.pop('account_type') or 'individual', row.pop('method')
+                )
+                for field, value in row.items():
+                    rows[key][field] += value or 0
+
+    rollups = [
+        PlatformEarningsRollup(
+            period=period, period_start=start, category=category,
+            account_type=account_type, payment_method=payment_method, **totals
+        )
+        for (period, start, category, account_type, payment_method), totals in rows.items()
+    ]
+    with db_transaction.atomic():
+        PlatformEarningsRollup.objects.all().delete()
+        PlatformEarningsRollup.objects.bulk_create(rollups, batch_size=1000)
+
+    logger.info(f"Rebuilt {len(rollups)} platform earnings rollup rows")
+    return len(rollups)
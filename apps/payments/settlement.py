@@ -0,0 +1,260 @@
+"""
+Daily settlement and reconciliation
+
+`manage.py run_daily_settlement` summarises one day of money movement into a
+DailySettlement row and records every check that fails as a
+SettlementDiscrepancy:
+
+- escrow: the ledger escrow balance equals the sum of held JobPayments
+- commission: the ledger commission balance equals the released platform fees
+- platform_earnings: each payment paid that day has a PlatformEarnings row for
+  its platform_fee
+- wallet_chain: within the day, each wallet Transaction's balance_after follows
+  from the previous one
+- wallet_balance: each wallet touched that day agrees with its latest
+  Transaction and with its ledger account
+- payout_stuck: the payout has been processing for more than a day
+
+The wallet checks run in a process pool, sharded into contiguous wallet id ranges. Every query
+streams its rows in chunks, so memory does not grow with the day's volume.
+"""
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from operator import itemgetter
+
+from django.db import connections
+from django.db.models import Sum, Count, Q, OuterRef, Subquery, Min, Max
+from django.utils import timezone
+
+from . import ledger
+from .models import (
+    Transaction, Wallet, JobPayment, Payout, LedgerAccount,
+    DailySettlement, SettlementDiscrepancy
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+WALLET_BATCH = 500
+STUCK_PAYOUT_HOURS = 24
+
+# Transaction types that move held_balance, not balance
+HOLD_TYPES = ('escrow_hold', 'escrow_release')
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _discrepancy(kind, reference='', expected=None, actual=None, detail=''):
+    return {'kind': kind, 'reference': str(reference)[:100], 'expected': expected, 'actual': actual, 'detail': detail}
+
+
+def _zero(value):
+    return value if value is not None else Decimal('0.00')
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # Never share the parent's database connections
+    connections.close_all()
+
+
+def shard_ranges(shards):
+    """[low, high) wallet id ranges splitting every wallet into at most `shards` contiguous shards"""
+    bounds = Wallet.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+    step = -(-(bounds['high'] - bounds['low'] + 1) // shards)
+    return [(low, min(low + step, bounds['high'] + 1)) for low in range(bounds['low'], bounds['high'] + 1, step)]
+
+
+def check_wallet_shard(day, low, high):
+    """
+    Verify the transaction chains and balances of wallets with
+    low <= wallet_id < high that had activity on `day`.
+    Returns (stats, discrepancies).
+    """
+    start, end = day_bounds(day)
+    discrepancies = []
+    stats = {'transactions': 0, 'wallets': 0}
+
+    # A wallet id range, unlike a modulus, can use the (wallet, created_at) index
+    rows = (
+        Transaction.objects
+        .filter(wallet_id__gte=low, wallet_id__lt=high, created_at__gte=start, created_at__lt=end)
+        .order_by('wallet_id', 'id')
+        .values_list('wallet_id', 'id', 'type', 'amount', 'balance_after')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+    touched = []
+    for wallet_id, transactions in itertools.groupby(rows, key=itemgetter(0)):
+        previous = Transaction.objects.filter(wallet_id=wallet_id, created_at__lt=start).order_by(
+            '-created_at', '-id'
+        ).values_list('balance_after', flat=True).first()
+
+        for _, transaction_id, transaction_type, amount, balance_after in transactions:
+            stats['transactions'] += 1
+            if previous is not None:
+                expected = previous if transaction_type in HOLD_TYPES else previous + amount
+                if balance_after != expected:
+                    discrepancies.append(_discrepancy(
+                        'wallet_chain', f'wallet {wallet_id}', expected, balance_after,
+                        f'Transaction {transaction_id} ({transaction_type} {amount})'
+                    ))
+            previous = balance_after
+
+        touched.append(wallet_id)
+        if len(touched) >= WALLET_BATCH:
+            discrepancies.extend(_check_wallet_balances(touched))
+            stats['wallets'] += len(touched)
+            touched = []
+
+    if touched:
+        discrepancies.extend(_check_wallet_balances(touched))
+        stats['wallets'] += len(touched)
+
+    connections.close_all()
+    return stats, discrepancies
+
+
+def _check_wallet_balances(wallet_ids):
+    """Wallet.balance against its latest Transaction and its ledger account (current values)"""
+    discrepancies = []
+    latest = Transaction.objects.filter(wallet=OuterRef('pk')).order_by('-id').values('balance_after')[:1]
+    wallets = Wallet.objects.filter(pk__in=wallet_ids).annotate(
+        last_balance=Subquery(latest)
+    ).values_list('pk', 'user_id', 'balance', 'last_balance')
+
+    accounts = dict(
+        LedgerAccount.objects.filter(
+            user_id__in=[user_id for _, user_id, _, _ in wallets], type__in=['technician', 'client']
+        ).values_list('user_id', 'id')
+    )
+
+    for wallet_id, user_id, balance, last_balance in wallets:
+        if last_balance is not None and last_balance != balance:
+            discrepancies.append(_discrepancy(
+                'wallet_balance', f'wallet {wallet_id}', last_balance, balance, 'Wallet balance vs latest transaction'
+            ))
+        account_id = accounts.get(user_id)
+        if account_id is not None:
+            ledger_balance = ledger.balance(account_id)
+            if ledger_balance != balance:
+                discrepancies.append(_discrepancy(
+                    'wallet_balance', f'wallet {wallet_id}', ledger_balance, balance, 'Wallet balance vs ledger account'
+                ))
+    return discrepancies
+
+
+def _summarise(settlement, start, end):
+    paid = JobPayment.objects.filter(paid_at__gte=start, paid_at__lt=end).aggregate(
+        count=Count('id'), volume=Sum('amount_paid'), fees=Sum('platform_fee')
+    )
+    released = JobPayment.objects.filter(released_at__gte=start, released_at__lt=end).aggregate(
+        count=Count('id'), volume=Sum('technician_amount')
+    )
+    payouts = Payout.objects.filter(created_at__gte=start, created_at__lt=end).aggregate(
+        count=Count('id'), volume=Sum('amount'), failed=Count('id', filter=Q(status='failed'))
+    )
+    settlement.payments_count = paid['count']
+    settlement.payments_volume = _zero(paid['volume'])
+    settlement.platform_fees = _zero(paid['fees'])
+    settlement.released_count = released['count']
+    settlement.released_volume = _zero(released['volume'])
+    settlement.payouts_count = payouts['count']
+    settlement.payouts_volume = _zero(payouts['volume'])
+    settlement.payouts_failed = payouts['failed']
+
+
+def _check_platform(settlement, start, end):
+    discrepancies = []
+
+    escrow_expected = _zero(JobPayment.objects.filter(status='held').aggregate(total=Sum('amount_paid'))['total'])
+    escrow_ledger = ledger.balance(ledger.get_account('escrow'))
+    settlement.escrow_expected, settlement.escrow_ledger = escrow_expected, escrow_ledger
+    if escrow_expected != escrow_ledger:
+        discrepancies.append(_discrepancy('escrow', 'escrow', escrow_expected, escrow_ledger, 'Held payments vs ledger escrow'))
+
+    commission_expected = _zero(JobPayment.objects.filter(status='released').aggregate(total=Sum('platform_fee'))['total'])
+    commission_ledger = ledger.balance(ledger.get_account('commission'))
+    if commission_expected != commission_ledger:
+        discrepancies.append(_discrepancy(
+            'commission', 'commission', commission_expected, commission_ledger, 'Released fees vs ledger commission'
+        ))
+
+    payments = JobPayment.objects.filter(
+        paid_at__gte=start, paid_at__lt=end, status__in=['held', 'released']
+    ).values_list('payment_ref', 'platform_fee', 'platform_earning__amount').iterator(chunk_size=CHUNK_SIZE)
+    for payment_ref, platform_fee, earning in payments:
+        if earning != platform_fee:
+            discrepancies.append(_discrepancy(
+                'platform_earnings', payment_ref, platform_fee, earning,
+                'Missing PlatformEarnings' if earning is None else 'PlatformEarnings amount differs from fee'
+            ))
+
+    stuck = Payout.objects.filter(
+        status='processing', created_at__lt=end - timedelta(hours=STUCK_PAYOUT_HOURS)
+    ).values_list('payout_ref', 'amount', 'failure_reason').iterator(chunk_size=CHUNK_SIZE)
+    for payout_ref, amount, reason in stuck:
+        discrepancies.append(_discrepancy('payout_stuck', payout_ref, None, amount, reason or 'No B2C result received'))
+
+    return discrepancies
+
+
+def run(day, workers=1, shards=None):
+    """Settle and reconcile `day`. Re-running a day replaces its previous results."""
+    shards = shards or max(workers * 4, 1)
+    start, end = day_bounds(day)
+
+    settlement, _ = DailySettlement.objects.get_or_create(date=day)
+    settlement.discrepancies.all().delete()
+    settlement.status = 'running'
+    settlement.started_at = timezone.now()
+    settlement.finished_at = None
+    settlement.save()
+
+    try:
+        _summarise(settlement, start, end)
+        discrepancies = _check_platform(settlement, start, end)
+
+        stats = {'transactions': 0, 'wallets': 0}
+        ranges = shard_ranges(shards)
+        if workers > 1 and len(ranges) > 1:
+            # Children must open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                results = pool.map(
+                    check_wallet_shard, [day] * len(ranges), [low for low, _ in ranges], [high for _, high in ranges]
+                )
+                results = list(results)
+        else:
+            results = [check_wallet_shard(day, low, high) for low, high in ranges]
+
+        for shard_stats, shard_discrepancies in results:
+            stats['transactions'] += shard_stats['transactions']
+            stats['wallets'] += shard_stats['wallets']
+            discrepancies.extend(shard_discrepancies)
+
+        SettlementDiscrepancy.objects.bulk_create(
+            [SettlementDiscrepancy(settlement=settlement, **row) for row in discrepancies], batch_size=1000
+        )
+        settlement.transactions_count = stats['transactions']
+        settlement.wallets_checked = stats['wallets']
+        settlement.discrepancy_count = len(discrepancies)
+        settlement.status = 'discrepancies' if discrepancies else 'balanced'
+    except Exception:
+        settlement.status = 'failed'
+        raise
+    finally:
+        settlement.finished_at = timezone.now()
+        settlement.save()
+
+    logger.info(f"Settlement {day}: {settlement.status}, {settlement.discrepancy_count} discrepancies")
+    return settlement
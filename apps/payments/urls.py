@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, exports
 
 router = DefaultRouter()
 router.register(r'payments', views.PaymentViewSet)
@@ -62,6 +62,20 @@ urlpatterns = [
     # Technician's earnings history
     path('history/earnings/', views.get_my_earnings, name='my_earnings'),
     
+    # ============================================
+    # PLATFORM REVENUE (admin)
+    # ============================================
+    
+    path('platform/revenue/', views.platform_revenue, name='platform_revenue'),
+    
+    # ============================================
+    # EXPORTS (streaming CSV / NDJSON)
+    # ============================================
+    
+    path('export/wallet/', exports.export_wallet, name='export_wallet'),
+    path('export/earnings/', exports.export_earnings, name='export_earnings'),
+    path('export/platform/', exports.export_platform, name='export_platform'),
+    
     # ============================================
     # LEGACY ENDPOINTS (Backward Compatibility)
     # ============================================
@@ -9,9 +9,12 @@ Flow:
 """
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, permission_classes, action
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.db import transaction as db_transaction
 from decimal import Decimal
 import logging
@@ -24,18 +27,18 @@ from .serializers import (
     PaymentSerializer, WalletSerializer, TransactionSerializer,
     PayoutRequestSerializer, JobPaymentSerializer, PayoutSerializer
 )
-from .mpesa import (
-    MpesaAPI, initiate_job_payment, verify_mpesa_payment,
-    parse_stk_callback, parse_b2c_result, process_technician_payout
-)
+from .mpesa import MpesaAPI, initiate_job_payment
+from . import escrow, callbacks, payouts, earnings, revenue
 from apps.bookings.models import JobPosting
 from apps.accounts.permissions import IsTechnician
+from apps.core.idempotency import idempotent
 
 logger = logging.getLogger(__name__)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def initiate_job_payment_view(request):
     """Client initiates payment for a job - sends STK Push"""
     job_id = request.data.get('job_id')
@@ -113,6 +116,9 @@ def initiate_job_payment_view(request):
 def mpesa_stk_callback(request):
     """M-Pesa STK Push callback - called by Safaricom
     
+    The callback is stored in the MpesaCallback inbox and acknowledged at once;
+    `manage.py process_mpesa_callbacks` applies it to the payment.
+    
     Security Note: In production, you should:
     1. Whitelist Safaricom IPs
     2. Verify the callback signature if available
@@ -127,55 +133,16 @@ def mpesa_stk_callback(request):
         return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
     
     try:
-        callback_data = parse_stk_callback(request.data)
-        if not callback_data:
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-        
-        checkout_request_id = callback_data.get('checkout_request_id')
-        result_code = callback_data.get('result_code')
-        
-        if not checkout_request_id:
-            logger.warning("Missing checkout_request_id in callback")
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-        
-        try:
-            job_payment = JobPayment.objects.get(mpesa_checkout_request_id=checkout_request_id)
-        except JobPayment.DoesNotExist:
-            logger.error(f"Payment not found: {checkout_request_id}")
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-        
-        if result_code == 0:
-            with db_transaction.atomic():
-                job_payment.status = 'held'
-                job_payment.mpesa_receipt_number = callback_data.get('mpesa_receipt', '')
-                job_payment.paid_at = timezone.now()
-                job_payment.save()
-                
-                job = job_payment.job
-                job.payment_status = 'paid'
-                job.save()
-                
-                PlatformEarnings.objects.get_or_create(
-                    job_payment=job_payment,
-                    defaults={'amount': job_payment.platform_fee}
-                )
-                
-            logger.info(f"Payment {job_payment.payment_ref} successful - HELD in escrow")
-        else:
-            job_payment.status = 'failed'
-            job_payment.save()
-            logger.info(f"Payment {job_payment.payment_ref} failed")
-        
-        return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+        callbacks.enqueue('stk', request.data, request.META.get('REMOTE_ADDR'))
     except Exception as e:
         logger.error(f"Callback error: {e}")
-        return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+    return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def check_payment_status(request):
-    """Check payment status"""
+    """Check payment status (read-only; late callbacks are picked up by reconcile_stk_payments)"""
     payment_ref = request.data.get('payment_ref')
     checkout_request_id = request.data.get('checkout_request_id')
     
@@ -187,13 +154,6 @@ def check_payment_status(request):
         else:
             return Response({'success': False, 'error': 'payment_ref or checkout_request_id required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if job_payment.status == 'processing' and job_payment.mpesa_checkout_request_id:
-            mpesa_status = verify_mpesa_payment(job_payment.mpesa_checkout_request_id)
-            if mpesa_status and mpesa_status.get('ResultCode') == '0':
-                job_payment.status = 'held'
-                job_payment.paid_at = timezone.now()
-                job_payment.save()
-        
         return Response({
             'success': True,
             'payment_ref': job_payment.payment_ref,
@@ -229,21 +189,8 @@ def release_payment(request):
         if job_payment.status != 'held':
             return Response({'success': False, 'error': f'Cannot release. Status: {job_payment.status}'}, status=status.HTTP_400_BAD_REQUEST)
         
-        with db_transaction.atomic():
-            technician_wallet, _ = Wallet.objects.get_or_create(user=job_payment.technician)
-            technician_wallet.credit(
-                amount=job_payment.technician_amount,
-                transaction_type='earning',
-                reference=job_payment.payment_ref,
-                metadata={'job_id': job.id, 'job_title': job.title}
-            )
-            
-            job_payment.status = 'released'
-            job_payment.released_at = timezone.now()
-            job_payment.save()
-            
-            job.payment_status = 'released'
-            job.save()
+        if not escrow.release(job_payment, metadata={'job_id': job.id, 'job_title': job.title}):
+            return Response({'success': False, 'error': 'Payment is no longer held'}, status=status.HTTP_409_CONFLICT)
         
         return Response({
             'success': True,
@@ -259,6 +206,7 @@ def release_payment(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated, IsTechnician])
+@idempotent
 def request_payout(request):
     """Technician requests payout"""
     amount = request.data.get('amount')
@@ -284,7 +232,10 @@ def request_payout(request):
             return Response({'success': False, 'error': 'Phone number required for M-Pesa'}, status=status.HTTP_400_BAD_REQUEST)
         
         with db_transaction.atomic():
-            wallet.debit(amount, 'payout', 'Payout request', {'method': payout_method})
+            try:
+                wallet.debit(amount, 'payout', 'Payout request', {'method': payout_method})
+            except ValueError:
+                return Response({'success': False, 'error': f'Insufficient balance. Available: KES {wallet.balance}'}, status=status.HTTP_400_BAD_REQUEST)
             
             payout = Payout.objects.create(
                 technician=request.user,
@@ -295,25 +246,18 @@ def request_payout(request):
             )
         
         if payout_method == 'mpesa':
-            result = process_technician_payout(payout)
+            # Sent by the payout scheduler (manage.py drain_payouts)
+            if getattr(settings, 'PAYOUT_INLINE', False):
+                payouts.drain_batch()
+                payout.refresh_from_db()
             
-            if result.get('success'):
-                payout.status = 'processing'
-                payout.mpesa_conversation_id = result.get('conversation_id', '')
-                payout.save()
-                
-                return Response({
-                    'success': True,
-                    'message': 'Payout initiated. You will receive the money shortly.',
-                    'payout_ref': payout.payout_ref,
-                    'amount': str(payout.amount)
-                })
-            else:
-                wallet.credit(amount, 'refund', f'Payout failed: {payout.payout_ref}')
-                payout.status = 'failed'
-                payout.failure_reason = result.get('error', 'Unknown error')
-                payout.save()
-                return Response({'success': False, 'error': result.get('error')}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({
+                'success': True,
+                'message': 'Payout queued. You will receive the money shortly.',
+                'payout_ref': payout.payout_ref,
+                'amount': str(payout.amount),
+                'status': payout.status
+            })
         else:
             return Response({
                 'success': True,
@@ -327,37 +271,18 @@ def request_payout(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def mpesa_b2c_result(request):
-    """M-Pesa B2C result callback"""
+    """M-Pesa B2C result callback - stored in the inbox, processed by the worker"""
     logger.info(f"B2C Result: {request.data}")
     
-    try:
-        result_data = parse_b2c_result(request.data)
-        if not result_data:
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-        
-        conversation_id = result_data.get('conversation_id')
-        
-        try:
-            payout = Payout.objects.get(mpesa_conversation_id=conversation_id)
-        except Payout.DoesNotExist:
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-        
-        if result_data.get('result_code') == 0:
-            payout.status = 'completed'
-            payout.mpesa_transaction_id = result_data.get('transaction_id', '')
-            payout.completed_at = timezone.now()
-            payout.save()
-        else:
-            wallet = Wallet.objects.get(user=payout.technician)
-            wallet.credit(payout.amount, 'refund', f'Payout failed: {payout.payout_ref}')
-            payout.status = 'failed'
-            payout.failure_reason = result_data.get('result_desc', 'Unknown')
-            payout.save()
-        
+    if not request.data or 'Result' not in request.data:
+        logger.warning("Invalid B2C result structure received")
         return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+    
+    try:
+        callbacks.enqueue('b2c_result', request.data, request.META.get('REMOTE_ADDR'))
     except Exception as e:
         logger.error(f"B2C result error: {e}")
-        return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+    return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
 
 @api_view(['POST'])
@@ -396,15 +321,62 @@ def get_my_payments(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_my_earnings(request):
-    """Get technician's earnings"""
-    payments = JobPayment.objects.filter(technician=request.user, status__in=['held', 'released'])
-    total_earned = sum(p.technician_amount for p in payments.filter(status='released'))
-    pending = sum(p.technician_amount for p in payments.filter(status='held'))
+    """Get technician's earnings - totals from the earnings summary, payments paginated"""
+    summary = earnings.summary(request.user)
+    
+    payments = JobPayment.objects.filter(
+        technician=request.user, status__in=['held', 'released']
+    ).select_related('client', 'technician', 'job')
+    paginator = PageNumberPagination()
+    paginator.page_size = 20
+    page = paginator.paginate_queryset(payments, request)
+    
+    return Response({
+        'total_earned': str(summary['total_released']),
+        'pending_release': str(summary['pending_release']),
+        'jobs_paid': summary['released_count'],
+        'monthly': [
+            {'month': row['month'].strftime('%Y-%m'), 'earned': str(row['released']), 'jobs': row['jobs']}
+            for row in summary['monthly']
+        ],
+        'count': paginator.page.paginator.count,
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'payments': JobPaymentSerializer(page, many=True).data
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def platform_revenue(request):
+    """
+    Platform revenue from the rollup tables (admin only)
+    ?period=day|week|month&from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=category,account_type,payment_method
+    """
+    period = request.query_params.get('period', 'month')
+    if period not in revenue.PERIODS:
+        return Response({'success': False, 'error': "period must be 'day', 'week' or 'month'"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    bounds = {}
+    for name in ('from', 'to'):
+        raw = request.query_params.get(name)
+        bounds[name] = parse_date(raw) if raw else None
+        if raw and bounds[name] is None:
+            return Response({'success': False, 'error': f"'{name}' must be a date (YYYY-MM-DD)"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    group_by = [name for name in request.query_params.get('group_by', '').split(',') if name]
+    unknown = set(group_by) - set(revenue.DIMENSIONS)
+    if unknown:
+        return Response({'success': False, 'error': f"Unknown group_by: {', '.join(sorted(unknown))}"}, status=status.HTTP_400_BAD_REQUEST)
     
+    rows = revenue.report(period, bounds['from'], bounds['to'], group_by)
     return Response({
-        'total_earned': str(total_earned),
-        'pending_release': str(pending),
-        'payments': JobPaymentSerializer(payments, many=True).data
+        'success': True,
+        'period': period,
+        'rows': [
+            {key: str(value) if isinstance(value, Decimal) else value for key, value in row.items()}
+            for row in rows
+        ]
     })
 
 
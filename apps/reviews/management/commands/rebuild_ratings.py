@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from apps.reviews.ratings import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute technician and company rating averages and star histograms from reviews'
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {count} technician(s) and companies'))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db import transaction as db_transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from apps.accounts.models import User
 from apps.bookings.models import Booking
@@ -20,19 +21,20 @@ class Review(models.Model):
         return f"Review by {self.customer.username} for {self.technician.username} - {self.rating}/5"
     
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.update_technician_rating()
-    
-    def update_technician_rating(self):
-        """Update technician's average rating."""
-        from django.db.models import Avg, Count
+        from . import ratings
         
-        stats = Review.objects.filter(technician=self.technician).aggregate(
-            avg_rating=Avg('rating'),
-            total_reviews=Count('id')
-        )
+        with db_transaction.atomic():
+            before = None
+            if self.pk:
+                before = Review.objects.select_for_update().filter(pk=self.pk).values_list('technician_id', 'rating').first()
+            super().save(*args, **kwargs)
+            ratings.review_changed(before, (self.technician_id, self.rating))
+    
+    def delete(self, *args, **kwargs):
+        from . import ratings
         
-        profile = self.technician.technician_profile
-        profile.rating = stats['avg_rating'] or 0
-        profile.total_reviews = stats['total_reviews'] or 0
-        profile.save()
+        with db_transaction.atomic():
+            before = (self.technician_id, self.rating)
+            result = super().delete(*args, **kwargs)
+            ratings.review_changed(before, None)
+        return result
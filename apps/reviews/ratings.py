@@ -0,0 +1,113 @@
+"""
+Rating aggregates
+
+Each TechnicianProfile and Company keeps the running sum, the count
+(total_ratings), the average (rating) and a five-bucket star histogram of
+its reviews. A review write adjusts them by its own rating, inside the
+review's transaction, with the profile and then the company row locked.
+Nothing ever scans a technician's reviews. rebuild() recomputes every
+aggregate from the Review table if they drift, e.g. after a bulk delete.
+"""
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction as db_transaction
+from django.db.models import Count, Q, Sum
+
+from apps.technicians.models import TechnicianProfile, Company
+
+logger = logging.getLogger(__name__)
+
+STARS = range(1, 6)
+FIELDS = ['rating', 'rating_sum', 'total_ratings'] + [f'stars_{stars}' for stars in STARS]
+
+
+def average(total, count):
+    if not count:
+        return Decimal('0.00')
+    return (Decimal(total) / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _adjust(row, added, removed):
+    for value, sign in ((added, 1), (removed, -1)):
+        if value is None:
+            continue
+        field = f'stars_{int(value)}'
+        row.rating_sum += sign * int(value)
+        row.total_ratings += sign
+        setattr(row, field, getattr(row, field) + sign)
+    row.rating = average(row.rating_sum, row.total_ratings)
+    row.save(update_fields=FIELDS + ['updated_at'])
+
+
+def apply(technician_id, added=None, removed=None):
+    """Add and/or remove one star rating for a technician and their company"""
+    with db_transaction.atomic():
+        profile = TechnicianProfile.objects.select_for_update().filter(user_id=technician_id).first()
+        if profile is None:
+            return
+        _adjust(profile, added, removed)
+        if profile.account_type == 'company' and profile.company_id:
+            company = Company.objects.select_for_update().get(pk=profile.company_id)
+            _adjust(company, added, removed)
+
+
+def review_changed(before, after):
+    """
+    Apply a review write. before/after are (technician_id, rating) or None
+    for a created / deleted review.
+    """
+    if before and after and before[0] == after[0]:
+        if before[1] != after[1]:
+            apply(after[0], added=after[1], removed=before[1])
+        return
+    if before:
+        apply(before[0], removed=before[1])
+    if after:
+        apply(after[0], added=after[1])
+
+
+def _totals(reviews, key):
+    return {
+        row[key]: row
+        for row in reviews.values(key).annotate(
+            rating_sum=Sum('rating'),
+            total_ratings=Count('id'),
+            **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in STARS}
+        )
+    }
+
+
+def _rewrite(model, totals, key):
+    rows = list(model.objects.filter(**{f'{key}__in': totals}))
+    for row in rows:
+        values = totals[getattr(row, key)]
+        for field in FIELDS[1:]:
+            setattr(row, field, values[field])
+        row.rating = average(row.rating_sum, row.total_ratings)
+    model.objects.bulk_update(rows, FIELDS, batch_size=500)
+    return len(rows)
+
+
+def rebuild():
+    """Recompute every technician and company aggregate from Review. Returns rows written."""
+    from .models import Review
+
+    zero = dict.fromkeys(FIELDS, 0)
+    technician_totals = _totals(Review.objects.all(), 'technician_id')
+    company_totals = _totals(
+        Review.objects.filter(
+            technician__technician_profile__account_type='company',
+            technician__technician_profile__company__isnull=False
+        ),
+        'technician__technician_profile__company_id'
+    )
+
+    with db_transaction.atomic():
+        TechnicianProfile.objects.update(**zero)
+        Company.objects.update(**zero)
+        written = _rewrite(TechnicianProfile, technician_totals, 'user_id')
+        written += _rewrite(Company, company_totals, 'id')
+
+    logger.info(f"Rebuilt rating aggregates for {written} technicians and companies")
+    return written
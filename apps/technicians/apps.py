@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TechniciansConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.technicians'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import projections  # noqa: F401  (registers the projection system check)
@@ -0,0 +1,231 @@
+"""
+Technician dashboard snapshots
+
+The dashboard is built with one conditional aggregate per model and cached
+per technician. Rating breakdowns come from the star histograms kept on the
+profile and company rows (see apps/reviews/ratings.py). Signals (see signals.py) and the wallet postings evict a
+technician's snapshot when something it shows changes. Open-job counts
+depend on every job posting, not just the technician's own, so they live in
+one shared cache entry. Both entries are fetched with a single get_many,
+so a dashboard refresh costs one cache read.
+
+Company dashboards read the materialized CompanyStats row for the member
+totals. The bid and booking counts are conditional aggregates
+filtered by a members subquery, so their cost does not grow with the
+number of technicians in the company.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import TechnicianProfile, CompanyStats
+from .serializers import TechnicianDashboardProfileSerializer, CompanySerializer
+
+SNAPSHOT_KEY = 'technician_dashboard:{}'
+OPEN_JOBS_KEY = 'technician_dashboard:open_jobs'
+
+COMPANY_STAT_FIELDS = {
+    'total_technicians': Count('id'),
+    'wallet_balance': Sum('wallet_balance'),
+    'total_earnings': Sum('total_earnings'),
+    'pending_earnings': Sum('pending_earnings'),
+    'completed_jobs': Sum('completed_jobs_count'),
+    'cancelled_jobs': Sum('cancelled_jobs_count'),
+}
+# Profile fields behind CompanyStats; saves that touch none of them skip the refresh
+COMPANY_STAT_SOURCES = {
+    'company', 'wallet_balance', 'total_earnings', 'pending_earnings', 'completed_jobs_count', 'cancelled_jobs_count'
+}
+
+
+def _ttl():
+    return getattr(settings, 'TECHNICIAN_DASHBOARD_CACHE_SECONDS', 300)
+
+
+def invalidate(user_ids):
+    """Evict the dashboard snapshots of these technicians once the transaction commits"""
+    keys = [SNAPSHOT_KEY.format(user_id) for user_id in user_ids if user_id]
+    if keys:
+        db_transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_open_jobs():
+    db_transaction.on_commit(lambda: cache.delete(OPEN_JOBS_KEY))
+
+
+def profiles_changed(user_ids):
+    """A technician's profile or wallet changed: evict snapshots and refresh company totals on commit"""
+    user_ids = [user_id for user_id in user_ids if user_id]
+    invalidate(user_ids)
+    db_transaction.on_commit(lambda: refresh_company_stats(
+        TechnicianProfile.objects.filter(user_id__in=user_ids, company__isnull=False).values_list('company_id', flat=True)
+    ))
+
+
+def refresh_company_stats(company_ids):
+    """Recompute CompanyStats for these companies with one grouped aggregate"""
+    company_ids = {company_id for company_id in company_ids if company_id}
+    if not company_ids:
+        return {}
+    totals = {
+        row['company_id']: row
+        for row in TechnicianProfile.objects.filter(company_id__in=company_ids).values('company_id').annotate(
+            **COMPANY_STAT_FIELDS
+        )
+    }
+    CompanyStats.objects.bulk_create(
+        [CompanyStats(company_id=company_id) for company_id in company_ids], ignore_conflicts=True
+    )
+    for company_id in company_ids:
+        row = totals.get(company_id, {})
+        CompanyStats.objects.filter(company_id=company_id).update(
+            updated_at=timezone.now(), **{field: row.get(field) or 0 for field in COMPANY_STAT_FIELDS}
+        )
+    return {stats.company_id: stats for stats in CompanyStats.objects.filter(company_id__in=company_ids)}
+
+
+def open_job_counts():
+    """{category: number of open jobs}, from the shared cache entry when present"""
+    from apps.bookings.models import JobPosting
+
+    counts = cache.get(OPEN_JOBS_KEY)
+    if counts is None:
+        counts = dict(
+            JobPosting.objects.filter(status='open').values('category').annotate(count=Count('id')).values_list(
+                'category', 'count'
+            )
+        )
+        cache.set(OPEN_JOBS_KEY, counts, _ttl())
+    return counts
+
+
+def _activity(**technicians):
+    """Active bookings and bid counts for a technician filter - one query each"""
+    from apps.bookings.models import Booking, Bid
+
+    active_jobs = Booking.objects.filter(**technicians).aggregate(
+        active=Count('id', filter=Q(status__in=['accepted', 'enroute', 'in_progress']))
+    )['active']
+    bids = Bid.objects.filter(**technicians).aggregate(
+        total=Count('id'),
+        pending=Count('id', filter=Q(status='pending')),
+        accepted=Count('id', filter=Q(status='accepted')),
+        rejected=Count('id', filter=Q(status='rejected'))
+    )
+    bids['success_rate'] = round((bids['accepted'] / bids['total'] * 100) if bids['total'] > 0 else 0, 1)
+    return active_jobs, bids
+
+
+def _completion_rate(completed, cancelled):
+    return round((completed / (completed + cancelled) * 100) if (completed + cancelled) > 0 else 100, 1)
+
+
+def build(profile):
+    """Snapshot of everything on the dashboard except the open-job count"""
+    from apps.bookings.models import JobPosting
+    from apps.payments import earnings
+
+    user_id = profile.user_id
+    active_jobs, bids = _activity(technician_id=user_id)
+    assigned = JobPosting.objects.filter(assigned_technician_id=user_id).aggregate(
+        in_progress=Count('id', filter=Q(status='in_progress'))
+    )
+
+    return {
+        'profile': dict(TechnicianDashboardProfileSerializer(profile).data),
+        'stats': {
+            'active_jobs': active_jobs,
+            'pending_bids': bids['pending'],
+            'accepted_bids': bids['accepted'],
+            'rejected_bids': bids['rejected'],
+            'total_bids': bids['total'],
+            'bid_success_rate': bids['success_rate'],
+            'in_progress_jobs': assigned['in_progress'],
+            'completed_jobs': profile.completed_jobs_count,
+            'cancelled_jobs': profile.cancelled_jobs_count,
+            'wallet_balance': float(profile.wallet_balance),
+            'total_earnings': float(profile.total_earnings),
+            'pending_earnings': float(profile.pending_earnings),
+            'rating': float(profile.rating),
+            'total_ratings': profile.total_ratings,
+            'trust_score': profile.trust_score,
+            'avg_completion_time': "2-3 hours",  # This would be calculated from actual data
+        },
+        'performance': {
+            'rating_breakdown': profile.rating_breakdown(),
+            'monthly_earnings': earnings.technician_monthly(user_id),
+            'job_completion_rate': _completion_rate(profile.completed_jobs_count, profile.cancelled_jobs_count),
+            'response_rate': 95.0,  # Mock - would be calculated
+        },
+        'kyc': {
+            'status': profile.kyc_status,
+            'is_complete': profile.is_kyc_complete(),
+            'can_accept_jobs': bool(profile.can_accept_jobs())
+        },
+    }
+
+
+def get(user):
+    """The dashboard for `user`; raises TechnicianProfile.DoesNotExist"""
+    key = SNAPSHOT_KEY.format(user.pk)
+    cached = cache.get_many([key, OPEN_JOBS_KEY])
+
+    snapshot = cached.get(key)
+    if snapshot is None:
+        profile = TechnicianProfile.objects.projection('dashboard').get(user=user)
+        snapshot = build(profile)
+        cache.set(key, snapshot, _ttl())
+
+    counts = cached.get(OPEN_JOBS_KEY)
+    if counts is None:
+        counts = open_job_counts()
+
+    skills = snapshot['profile'].get('skills') or []
+    snapshot['stats']['available_jobs'] = sum(counts.get(skill, 0) for skill in set(skills))
+    return snapshot
+
+
+def company(company):
+    """The company dashboard - member totals from CompanyStats, activity from aggregates"""
+    from apps.payments import earnings
+
+    stats = CompanyStats.objects.filter(company=company).first()
+    if stats is None:
+        stats = refresh_company_stats([company.pk])[company.pk]
+
+    members = TechnicianProfile.objects.filter(company=company).values('user_id')
+    active_jobs, bids = _activity(technician_id__in=members)
+    counts = open_job_counts()
+
+    return {
+        'company': CompanySerializer(company).data,
+        'stats': {
+            'total_technicians': stats.total_technicians,
+            'active_jobs': active_jobs,
+            'pending_bids': bids['pending'],
+            'accepted_bids': bids['accepted'],
+            'rejected_bids': bids['rejected'],
+            'total_bids': bids['total'],
+            'bid_success_rate': bids['success_rate'],
+            'available_jobs': sum(counts.get(service, 0) for service in set(company.services or [])),
+            'completed_jobs': stats.completed_jobs,
+            'cancelled_jobs': stats.cancelled_jobs,
+            'wallet_balance': float(stats.wallet_balance),
+            'total_earnings': float(stats.total_earnings),
+            'pending_earnings': float(stats.pending_earnings),
+            'rating': float(company.rating),
+            'total_ratings': company.total_ratings,
+        },
+        'performance': {
+            'rating_breakdown': company.rating_breakdown(),
+            'monthly_earnings': earnings.company_monthly(company.pk),
+            'job_completion_rate': _completion_rate(stats.completed_jobs, stats.cancelled_jobs),
+            'response_rate': 95.0,
+        },
+        'verification': {
+            'status': company.verification_status,
+            'is_verified': company.is_verified(),
+        }
+    }
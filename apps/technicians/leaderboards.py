@@ -0,0 +1,233 @@
+"""
+Technician leaderboards
+
+The public top, by-skill and by-city lists are kept in the cache as ranked
+boards. Each board holds the serialized entries and the JSON already
+rendered for the response, so a hit costs one cache read and no
+serialization. When a technician's rating, trust score, verification or
+anything else shown changes, signals (see signals.py) merge that one
+technician into the boards they are on or now qualify for. A board holds
+twice as many entries as it shows, so removals seldom need a refill. A
+board that runs short, or that another process is updating at the same
+moment, is dropped and rebuilt from the database on the next read.
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction as db_transaction
+
+from apps.core.conditional import make_etag
+
+from .models import TechnicianProfile
+from .serializers import TechnicianProfileSerializer
+
+logger = logging.getLogger(__name__)
+
+BOARD_KEY = 'leaderboard:{}'
+JSON_KEY = 'leaderboard:{}:json'
+ETAG_KEY = 'leaderboard:{}:etag'
+LOCK_KEY = 'leaderboard:{}:lock'
+REGISTRY_KEY = 'leaderboard:boards'
+REGISTRY_LOCK_KEY = 'leaderboard:boards:lock'
+REGISTRY_ATTEMPTS = 20
+
+SIZES = {'top': 20, 'skill': 10, 'city': 20}
+ORDERING = ('-rating', '-trust_score', '-completed_jobs_count', 'id')
+
+
+def _ttl():
+    return getattr(settings, 'LEADERBOARD_CACHE_SECONDS', 600)
+
+
+def eligible():
+    """Technicians shown on public lists"""
+    return TechnicianProfile.objects.filter(
+        verification_status='approved',
+        is_active=True,
+        trust_score__gte=0,
+        kyc_status='approved'
+    )
+
+
+def is_eligible(profile):
+    return (
+        profile.verification_status == 'approved' and profile.is_active and
+        profile.trust_score >= 0 and profile.kyc_status == 'approved'
+    )
+
+
+def board_name(kind, value=''):
+    """Cache name of a board; skills match exactly, cities case-insensitively"""
+    if not value:
+        return kind
+    return f'{kind}:{value.strip().lower() if kind == "city" else value}'
+
+
+def _size(board):
+    return SIZES[board.split(':', 1)[0]]
+
+
+def _sort_key(profile):
+    return [-float(profile.rating), -profile.trust_score, -profile.completed_jobs_count, profile.pk]
+
+
+def _candidates(board):
+    kind, _, value = board.partition(':')
+    queryset = eligible().projection('public_profile')
+    if kind == 'skill':
+        queryset = queryset.filter(skills__contains=[value])
+    elif kind == 'city':
+        queryset = queryset.filter(user__location__city__iexact=value)
+    return queryset.order_by(*ORDERING)
+
+
+def _boards_for(profile):
+    boards = ['top'] + [board_name('skill', skill) for skill in profile.skills or [] if isinstance(skill, str)]
+    city = getattr(getattr(profile.user, 'location', None), 'city', '')
+    if city:
+        boards.append(board_name('city', city))
+    return boards
+
+
+def _store(board, entries, complete):
+    """Save a board and its rendered JSON; complete means every candidate is held"""
+    rendered = json.dumps([entry for _, _, entry in entries[:_size(board)]], cls=DjangoJSONEncoder)
+    stored = {JSON_KEY.format(board): rendered, ETAG_KEY.format(board): make_etag(rendered)}
+    if not entries:
+        # Not registered, so arbitrary skills and cities in URLs cannot grow the registry;
+        # technician_changed drops it when someone qualifies
+        cache.set_many(stored, _ttl())
+        cache.delete(BOARD_KEY.format(board))
+        return rendered
+    stored[BOARD_KEY.format(board)] = {'entries': entries, 'complete': complete}
+    cache.set_many(stored, _ttl())
+    if board not in (cache.get(REGISTRY_KEY) or set()) and not _register(board):
+        # An unregistered board would never see merges; let the next read rebuild it
+        _drop([board])
+    return rendered
+
+
+def _register(board):
+    """Add a board to the registry under its lock, so concurrent builds cannot drop each other's"""
+    for _ in range(REGISTRY_ATTEMPTS):
+        if cache.add(REGISTRY_LOCK_KEY, 1, 5):
+            try:
+                registry = cache.get(REGISTRY_KEY) or set()
+                if board not in registry:
+                    cache.set(REGISTRY_KEY, registry | {board}, None)
+                return True
+            finally:
+                cache.delete(REGISTRY_LOCK_KEY)
+        time.sleep(0.01)
+    logger.warning(f"Could not register leaderboard {board}; registry lock busy")
+    return False
+
+
+def build(board):
+    """Rank the board from the database and cache it; returns the rendered JSON"""
+    capacity = _size(board) * 2
+    profiles = list(_candidates(board)[:capacity])
+    data = TechnicianProfileSerializer(profiles, many=True).data
+    entries = [(_sort_key(profile), profile.pk, dict(entry)) for profile, entry in zip(profiles, data)]
+    return _store(board, entries, len(entries) < capacity)
+
+
+def rendered(board):
+    """The board's response body, from the cache or freshly built"""
+    content = cache.get(JSON_KEY.format(board))
+    if content is None:
+        content = build(board)
+    return content
+
+
+def etag(board):
+    """ETag of the board's current JSON, or None when it is not cached"""
+    return cache.get(ETAG_KEY.format(board))
+
+
+def _drop(boards):
+    cache.delete_many([key.format(board) for board in boards for key in (BOARD_KEY, JSON_KEY, ETAG_KEY)])
+
+
+def _merge(board, state, profile_id, entry):
+    """Move one technician within a board state; returns the new state or None when it must be rebuilt"""
+    entries = [item for item in state['entries'] if item[1] != profile_id]
+    complete = state['complete']
+    # An incomplete board cannot place anyone below its last entry: unseen candidates may rank between
+    if entry and (complete or (entries and entry[0] < entries[-1][0])):
+        entries.append(entry)
+        entries.sort(key=lambda item: item[0])
+    capacity = _size(board) * 2
+    if len(entries) > capacity:
+        entries, complete = entries[:capacity], False
+    if not complete and len(entries) < _size(board):
+        return None
+    return {'entries': entries, 'complete': complete}
+
+
+def technician_changed(user_id):
+    """Merge one technician's current standing into every cached board they are on or qualify for"""
+    profile = TechnicianProfile.objects.projection('public_profile', 'user__location').filter(
+        user_id=user_id
+    ).first()
+    if profile is None:
+        return
+
+    registry = cache.get(REGISTRY_KEY) or set()
+    states = cache.get_many([BOARD_KEY.format(board) for board in registry])
+    qualifies = set(_boards_for(profile)) if is_eligible(profile) else set()
+    entry = None
+    if qualifies:
+        entry = (_sort_key(profile), profile.pk, dict(TechnicianProfileSerializer(profile).data))
+
+    _drop(qualifies - registry)
+    for board in registry:
+        state = states.get(BOARD_KEY.format(board))
+        if state is None:
+            continue
+        listed = any(item[1] == profile.pk for item in state['entries'])
+        if not listed and board not in qualifies:
+            continue
+        if not cache.add(LOCK_KEY.format(board), 1, 5):
+            # Someone else is merging into this board; let the next read rebuild it
+            _drop([board])
+            continue
+        try:
+            # Merge into the board as it is now: the snapshot above may predate a merge that just finished
+            state = cache.get(BOARD_KEY.format(board))
+            if state is None:
+                continue
+            state = _merge(board, state, profile.pk, entry if board in qualifies else None)
+            if state is None:
+                _drop([board])
+            else:
+                _store(board, state['entries'], state['complete'])
+        finally:
+            cache.delete(LOCK_KEY.format(board))
+
+
+def technicians_changed(user_ids):
+    """Update the boards for these technicians once the transaction commits"""
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if not user_ids:
+        return
+
+    def update():
+        for user_id in user_ids:
+            try:
+                technician_changed(user_id)
+            except Exception as e:
+                logger.warning(f"Leaderboard update failed for technician {user_id}: {e}")
+                clear()
+                return
+
+    db_transaction.on_commit(update)
+
+
+def clear():
+    """Drop every board, e.g. after a company change or bulk update"""
+    _drop(cache.get(REGISTRY_KEY) or set())
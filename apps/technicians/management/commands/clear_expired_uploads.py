@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.technicians import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads older than UPLOAD_EXPIRY_HOURS and the chunks they left in blob storage'
+
+    def handle(self, *args, **options):
+        deleted = uploads.clear_expired()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired upload(s)'))
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from apps.bookings.models import JobPosting
+from apps.core import blobs, images
+from apps.technicians import dashboard, leaderboards
+from apps.technicians.models import TechnicianProfile
+
+
+def _inline_filter():
+    """Profiles with at least one image field that is neither empty, a blob key nor a URL"""
+    query = Q()
+    for field in TechnicianProfile.IMAGE_FIELDS:
+        query |= ~(
+            Q(**{field: ''}) | Q(**{f'{field}__startswith': blobs.KEY_PREFIX}) |
+            Q(**{f'{field}__startswith': 'http'})
+        )
+    return query
+
+
+class Command(BaseCommand):
+    help = 'Move base64 technician and job images into blob storage, keeping only blob keys on the rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Rows loaded per batch (default 50)')
+
+    def handle(self, *args, **options):
+        self.externalize_profiles(options['batch_size'])
+        self.externalize_jobs(options['batch_size'])
+
+    def externalize_profiles(self, batch_size):
+        fields = list(TechnicianProfile.IMAGE_FIELDS)
+        # Walk primary keys so only one batch of images is in memory at a time
+        ids = list(TechnicianProfile.objects.filter(_inline_filter()).order_by('pk').values_list('pk', flat=True))
+        moved = 0
+
+        for start in range(0, len(ids), batch_size):
+            profiles = list(
+                TechnicianProfile.objects.filter(pk__in=ids[start:start + batch_size]).only('pk', 'user_id', 'photo_sizes', *fields)
+            )
+            changed = []
+            for profile in profiles:
+                before = [getattr(profile, field) for field in fields]
+                for field in fields:
+                    setattr(profile, field, blobs.externalize(getattr(profile, field)))
+                if [getattr(profile, field) for field in fields] != before:
+                    images.mark(profile, 'profile_photo', 'photo_sizes', 'photo_sizes_pending')
+                    changed.append(profile)
+            TechnicianProfile.objects.bulk_update(changed, fields + ['photo_sizes_pending'])
+            dashboard.invalidate([profile.user_id for profile in changed])
+            moved += len(changed)
+            self.stdout.write(f'{min(start + batch_size, len(ids))}/{len(ids)} profiles checked')
+
+        if moved:
+            leaderboards.clear()
+        self.stdout.write(self.style.SUCCESS(f'Moved images for {moved} profile(s) to blob storage'))
+
+    def externalize_jobs(self, batch_size):
+        # Job images are a JSON list, which the database cannot filter element by element;
+        # skip the jobs without images and check the rest a batch at a time
+        ids = list(JobPosting.objects.exclude(images=[]).order_by('pk').values_list('pk', flat=True))
+        moved = 0
+
+        for start in range(0, len(ids), batch_size):
+            jobs = list(JobPosting.objects.filter(pk__in=ids[start:start + batch_size]).only('pk', 'images', 'image_sizes'))
+            changed = []
+            for job in jobs:
+                if not isinstance(job.images, list):
+                    continue
+                externalized = [blobs.externalize(image) for image in job.images]
+                if externalized != job.images:
+                    job.images = externalized
+                    images.mark(job, 'images', 'image_sizes', 'image_sizes_pending')
+                    changed.append(job)
+            JobPosting.objects.bulk_update(changed, ['images', 'image_sizes_pending'])
+            moved += len(changed)
+            self.stdout.write(f'{min(start + batch_size, len(ids))}/{len(ids)} jobs checked')
+
+        self.stdout.write(self.style.SUCCESS(f'Moved images for {moved} job(s) to blob storage'))
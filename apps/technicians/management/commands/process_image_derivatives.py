@@ -0,0 +1,26 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core import images
+
+
+class Command(BaseCommand):
+    help = 'Render thumbnail, card and full-size copies of uploaded images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows loaded per batch (default 100)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes resizing images')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new uploads')
+        parser.add_argument('--idle-sleep', type=float, default=5.0, help='Seconds to wait when nothing is pending')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = images.run(batch_size=options['batch_size'], workers=options['workers'])
+            summary = ', '.join(f'{count} {label}' for label, count in totals.items() if count) or 'nothing pending'
+            self.stdout.write(self.style.SUCCESS(f'Image derivatives: {summary}'))
+            if not options['loop']:
+                return
+            if not any(totals.values()):
+                time.sleep(options['idle_sleep'])
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:45
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('technicians', '0005_alter_technicianprofile_id_back_photo_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_technicians', models.IntegerField(default=0)),
+                ('wallet_balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('total_earnings', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('pending_earnings', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('completed_jobs', models.IntegerField(default=0)),
+                ('cancelled_jobs', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='technicians.company')),
+            ],
+            options={
+                'verbose_name_plural': 'Company Stats',
+            },
+        ),
+    ]
@@ -0,0 +1,133 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:46
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+STARS = range(1, 6)
+FIELDS = ['rating', 'rating_sum', 'total_ratings'] + [f'stars_{stars}' for stars in STARS]
+
+
+def _average(total, count):
+    if not count:
+        return Decimal('0.00')
+    return (Decimal(total) / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _totals(reviews, key):
+    return {
+        row[key]: row
+        for row in reviews.values(key).annotate(
+            rating_sum=Sum('rating'),
+            total_ratings=Count('id'),
+            **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in STARS}
+        )
+    }
+
+
+def _rewrite(model, totals, key):
+    rows = list(model.objects.filter(**{f'{key}__in': totals}))
+    for row in rows:
+        values = totals[getattr(row, key)]
+        for field in FIELDS[1:]:
+            setattr(row, field, values[field])
+        row.rating = _average(row.rating_sum, row.total_ratings)
+    model.objects.bulk_update(rows, FIELDS, batch_size=500)
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    """
+    Fill the new sums and histograms from existing reviews. Same as
+    apps.reviews.ratings.rebuild(), frozen for this migration; without it
+    every review written afterwards would adjust aggregates starting at zero.
+    """
+    Review = apps.get_model('reviews', 'Review')
+    TechnicianProfile = apps.get_model('technicians', 'TechnicianProfile')
+    Company = apps.get_model('technicians', 'Company')
+
+    zero = dict.fromkeys(FIELDS, 0)
+    technician_totals = _totals(Review.objects.all(), 'technician_id')
+    company_totals = _totals(
+        Review.objects.filter(
+            technician__technician_profile__account_type='company',
+            technician__technician_profile__company__isnull=False
+        ),
+        'technician__technician_profile__company_id'
+    )
+    TechnicianProfile.objects.update(**zero)
+    Company.objects.update(**zero)
+    _rewrite(TechnicianProfile, technician_totals, 'user_id')
+    _rewrite(Company, company_totals, 'id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('technicians', '0006_companystats'),
+        ('reviews', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='stars_1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='stars_2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='stars_3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='stars_4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='stars_5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='stars_1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='stars_2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='stars_3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='stars_4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='stars_5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('technicians', '0007_company_rating_sum_company_stars_1_company_stars_2_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='photo_sizes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
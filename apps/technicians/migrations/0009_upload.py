@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('technicians', '0008_technicianprofile_photo_sizes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('content_type', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField()),
+                ('checksum', models.CharField(max_length=64)),
+                ('parts', models.JSONField(blank=True, default=list)),
+                ('received', models.PositiveBigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('complete', 'Complete'), ('used', 'Used')], default='uploading', max_length=10)),
+                ('blob_key', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='technicians_created_d323b9_idx')],
+            },
+        ),
+    ]
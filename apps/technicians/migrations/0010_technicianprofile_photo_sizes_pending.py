@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:29
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def flag_pending_photos(apps, schema_editor):
+    """Flag profile photos stored as blobs that have no recorded derivatives yet"""
+    TechnicianProfile = apps.get_model('technicians', 'TechnicianProfile')
+    rows = TechnicianProfile.objects.filter(profile_photo__startswith='blob:').values_list('pk', 'profile_photo', 'photo_sizes')
+    pending = [pk for pk, photo, recorded in rows.iterator(chunk_size=BATCH_SIZE) if photo not in (recorded or {})]
+    for start in range(0, len(pending), BATCH_SIZE):
+        TechnicianProfile.objects.filter(pk__in=pending[start:start + BATCH_SIZE]).update(photo_sizes_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('technicians', '0009_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='technicianprofile',
+            name='photo_sizes_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='technicianprofile',
+            index=models.Index(condition=models.Q(('photo_sizes_pending', True)), fields=['id'], name='technician_photo_pending'),
+        ),
+        migrations.RunPython(flag_pending_photos, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from apps.accounts.models import User
 from math import radians, cos, sin, asin, sqrt
@@ -61,6 +63,13 @@ class Company(models.Model):
     # Stats
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0)
     total_ratings = models.IntegerField(default=0)
+    # Running sum and star histogram over member technicians' reviews (see apps/reviews/ratings.py)
+    rating_sum = models.IntegerField(default=0)
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
     completed_jobs_count = models.IntegerField(default=0)
     
     # Status
@@ -81,6 +90,39 @@ class Company(models.Model):
     def get_commission_rate(self):
         """Companies pay 20% commission"""
         return self.commission_rate
+    
+    def rating_breakdown(self):
+        return {f'{stars}_star': getattr(self, f'stars_{stars}') for stars in range(5, 0, -1)}
+
+
+class CompanyStats(models.Model):
+    """
+    Totals over a company's technicians, refreshed with one aggregate query
+    whenever a member's profile or wallet changes (see dashboard.py)
+    """
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, related_name='stats')
+    total_technicians = models.IntegerField(default=0)
+    wallet_balance = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    total_earnings = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    pending_earnings = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    completed_jobs = models.IntegerField(default=0)
+    cancelled_jobs = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Company Stats"
+    
+    def __str__(self):
+        return f"Stats for {self.company.name}: {self.total_technicians} technicians"
+
+
+class TechnicianProfileQuerySet(models.QuerySet):
+    def projection(self, name, *extra_related):
+        """Load only the columns the named projection renders (see projections.py),
+        plus every column of `extra_related` relations the caller reads itself"""
+        from .projections import only_fields
+        fields, related = only_fields(name)
+        return self.select_related(*related, *extra_related).only(*fields, *extra_related)
 
 
 class TechnicianProfile(models.Model):
@@ -114,13 +156,18 @@ class TechnicianProfile(models.Model):
     bio = models.TextField(blank=True)
     experience_years = models.IntegerField(default=0)
     
+    # Image fields hold a blob key (see apps/core/blobs.py) or an external URL;
+    # base64 uploads are moved to blob storage on save
+    IMAGE_FIELDS = ('profile_photo', 'id_front_photo', 'id_back_photo', 'selfie_with_id')
+    KYC_IMAGE_FIELDS = ('id_front_photo', 'id_back_photo', 'selfie_with_id')
+    
     # Profile Photo (REQUIRED for security)
-    # Using TextField to support base64 encoded images or URLs
     profile_photo = models.TextField(blank=True)
+    photo_sizes = models.JSONField(default=dict, blank=True)  # Resized copies (see apps/core/images.py)
+    photo_sizes_pending = models.BooleanField(default=False)  # profile_photo has no resized copies yet
     
     # KYC Documents
     id_number = models.CharField(max_length=20, blank=True)
-    # Using TextField to support base64 encoded images or URLs
     id_front_photo = models.TextField(blank=True)  # Front of ID card
     id_back_photo = models.TextField(blank=True)   # Back of ID card
     selfie_with_id = models.TextField(blank=True)  # Selfie holding ID for verification
@@ -134,6 +181,13 @@ class TechnicianProfile(models.Model):
     rejection_reason = models.TextField(blank=True)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0)
     total_ratings = models.IntegerField(default=0)
+    # Running sum and star histogram of reviews (see apps/reviews/ratings.py)
+    rating_sum = models.IntegerField(default=0)
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
     trust_score = models.IntegerField(default=5)
     
     # Wallet & Earnings
@@ -154,6 +208,29 @@ class TechnicianProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = TechnicianProfileQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(photo_sizes_pending=True), name='technician_photo_pending'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        from apps.core import blobs, images
+        deferred = self.get_deferred_fields()
+        update_fields = kwargs.get('update_fields')
+        saving = [
+            field for field in self.IMAGE_FIELDS
+            if field not in deferred and (update_fields is None or field in update_fields)
+        ]
+        for field in saving:
+            setattr(self, field, blobs.externalize(getattr(self, field)))
+        if 'profile_photo' in saving:
+            kwargs['update_fields'] = images.mark(self, 'profile_photo', 'photo_sizes', 'photo_sizes_pending', update_fields)
+        super().save(*args, **kwargs)
+        if 'profile_photo' in saving:
+            images.changed(self, 'profile_photo', 'photo_sizes', 'photo_sizes_pending')
+    
     def update_trust_score(self, rating_value):
         """Update trust score based on rating (1-5 stars)"""
         if rating_value >= 4:
@@ -169,12 +246,15 @@ class TechnicianProfile(models.Model):
         self.save()
     
     def add_rating(self, rating_value):
-        """Add a new rating and update average"""
-        total = float(self.rating) * self.total_ratings
-        self.total_ratings += 1
-        self.rating = Decimal((total + rating_value) / self.total_ratings)
+        """Add a new rating to the aggregates and update the trust score"""
+        from apps.reviews import ratings
+        ratings.apply(self.user_id, added=rating_value)
+        self.refresh_from_db()
         self.update_trust_score(rating_value)
     
+    def rating_breakdown(self):
+        return {f'{stars}_star': getattr(self, f'stars_{stars}') for stars in range(5, 0, -1)}
+    
     def add_earnings(self, amount):
         """Add earnings to wallet"""
         self.wallet_balance += Decimal(amount)
@@ -204,10 +284,9 @@ class TechnicianProfile(models.Model):
         )
     
     def get_commission_rate(self):
-        """Get commission rate - 20% for companies, 15% for individuals"""
-        if self.account_type == 'company' and self.company:
-            return self.company.commission_rate
-        return Decimal('0.15')  # 15% for individuals
+        """Get commission rate - the company's rate for company accounts, the platform rate otherwise"""
+        from apps.payments import fees
+        return fees.rate_for(self.user_id)
     
     def __str__(self):
         if self.account_type == 'company' and self.company:
@@ -274,3 +353,33 @@ class TechnicianAvailability(models.Model):
     
     def __str__(self):
         return f"{self.technician.email} - {self.day_of_week}"
+
+
+class Upload(models.Model):
+    """A resumable chunked upload of one KYC document or photo (see uploads.py)"""
+    STATUS_CHOICES = (
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+        ('used', 'Used'),
+    )
+    
+    # The random id is what authorizes chunk requests, so anonymous signups can upload too
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='uploads')
+    filename = models.CharField(max_length=255, blank=True)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64)  # SHA-256 of the whole file, hex
+    parts = models.JSONField(default=list, blank=True)  # Byte length of each stored chunk, in order
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='uploading')
+    blob_key = models.CharField(max_length=100, blank=True)  # Set on finalize
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['created_at'])]
+    
+    def __str__(self):
+        return f"Upload {self.id} ({self.status}, {self.received}/{self.size})"
@@ -0,0 +1,160 @@
+"""
+TechnicianProfile projections
+
+A profile row carries a bio, several review notes and four image columns
+that most screens never show. Each projection names the columns one screen
+needs and the serializer that renders them:
+
+    TechnicianProfile.objects.projection('public_profile').filter(...)
+
+loads only those columns (with the related rows it reads joined in). The
+``technicians.E001`` system check renders each serializer against an
+instance holding nothing but its projection. If a serializer or helper
+touches a column outside the projection, which would cost one extra query
+per row, ``manage.py check`` fails and names the column.
+"""
+from collections import namedtuple
+
+from django.core import checks
+from django.db.models import DEFERRED
+from django.utils.module_loading import import_string
+
+# fields: TechnicianProfile columns; related: {relation path: columns, or None for all}
+# methods: model methods the endpoint calls besides the serializer
+Projection = namedtuple('Projection', ['fields', 'related', 'serializer', 'methods'])
+
+USER_NAME = ('full_name', 'email')
+COMPANY_CARD = ('name', 'logo', 'verification_status')
+
+PROJECTIONS = {
+    # Technician summary on bids
+    'card': Projection(
+        fields=(
+            'rating', 'total_ratings', 'completed_jobs_count', 'trust_score', 'profile_photo', 'photo_sizes',
+            'kyc_status',
+        ),
+        related={},
+        serializer='apps.technicians.serializers.TechnicianCardSerializer',
+        methods=(),
+    ),
+    # Leaderboards, nearby search and the public profile page
+    'public_profile': Projection(
+        fields=(
+            'phone', 'skills', 'bio', 'experience_years', 'profile_photo', 'photo_sizes', 'account_type',
+            'verification_status', 'kyc_status', 'rating', 'total_ratings', 'trust_score',
+            'completed_jobs_count', 'is_online', 'is_active', 'created_at',
+        ),
+        related={'user': USER_NAME, 'company': COMPANY_CARD},
+        serializer='apps.technicians.serializers.TechnicianProfileSerializer',
+        methods=(),
+    ),
+    # Technician dashboard snapshot (see dashboard.build)
+    'dashboard': Projection(
+        fields=(
+            'phone', 'skills', 'bio', 'experience_years', 'profile_photo', 'photo_sizes', 'account_type',
+            'id_number', 'kyc_status', 'kyc_rejection_reason', 'kyc_submitted_at', 'kyc_verified_at',
+            'verification_status', 'rejection_reason', 'rating', 'total_ratings', 'trust_score',
+            'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5',
+            'wallet_balance', 'total_earnings', 'pending_earnings',
+            'completed_jobs_count', 'cancelled_jobs_count', 'active_jobs_count',
+            'is_online', 'is_active', 'is_available_for_jobs', 'created_at', 'updated_at',
+        ),
+        related={'user': USER_NAME, 'company': None, 'company__owner': USER_NAME},
+        serializer='apps.technicians.serializers.TechnicianDashboardProfileSerializer',
+        methods=('rating_breakdown', 'is_kyc_complete', 'can_accept_jobs'),
+    ),
+    # A technician's own KYC review status
+    'kyc_review': Projection(
+        fields=(
+            'kyc_status', 'kyc_rejection_reason', 'kyc_submitted_at', 'kyc_verified_at',
+            'profile_photo', 'id_front_photo', 'id_back_photo', 'selfie_with_id',
+        ),
+        related={},
+        serializer='apps.technicians.serializers.KYCReviewSerializer',
+        methods=(),
+    ),
+}
+
+
+def only_fields(name):
+    """Arguments for QuerySet.only() / select_related() for a projection"""
+    projection = PROJECTIONS[name]
+    fields = ['user', 'company', *projection.fields]
+    for path, columns in projection.related.items():
+        if columns is not None:
+            fields += [f'{path}__{column}' for column in columns]
+        else:
+            fields.append(path)
+    return fields, list(projection.related)
+
+
+def _instance(model, columns, touched, label):
+    """Unsaved model instance holding only `columns`; loading any other column is recorded"""
+    concrete = [field for field in model._meta.concrete_fields]
+    loaded = {'id', *columns}
+    values = [
+        (field.get_default() if field.attname in loaded or field.name in loaded else DEFERRED)
+        for field in concrete
+    ]
+    instance = model.from_db('default', [field.attname for field in concrete], values)
+
+    def refresh_from_db(fields=None, **kwargs):
+        for attname in fields or []:
+            touched.add(f'{label}.{attname}')
+            instance.__dict__[attname] = model._meta.get_field(attname).get_default() if attname != 'id' else None
+    instance.refresh_from_db = refresh_from_db
+    return instance
+
+
+def _render(model, projection, account_type):
+    """Columns outside the projection that rendering it touches"""
+    touched = set()
+    profile = _instance(model, ('user', 'company', *projection.fields), touched, model.__name__)
+    if 'account_type' in projection.fields:
+        profile.account_type = account_type
+    objects = {'': profile}
+    for path in sorted(projection.related, key=lambda path: path.count('__')):
+        parent_path, _, name = path.rpartition('__')
+        parent = objects.get(parent_path)
+        if parent is None or (path == 'company' and account_type != 'company'):
+            continue
+        field = parent._meta.get_field(name)
+        columns = projection.related[path]
+        if columns is None:
+            columns = [column.attname for column in field.related_model._meta.concrete_fields]
+        related = _instance(field.related_model, columns, touched, path)
+        field.set_cached_value(parent, related)
+        objects[path] = related
+    if 'company' not in objects:
+        model._meta.get_field('company').set_cached_value(profile, None)
+
+    import_string(projection.serializer)(profile).data
+    for method in projection.methods:
+        getattr(profile, method)()
+    return touched
+
+
+@checks.register(checks.Tags.models)
+def check_projections(app_configs=None, **kwargs):
+    from .models import TechnicianProfile
+
+    errors = []
+    for name, projection in PROJECTIONS.items():
+        for account_type in ('individual', 'company'):
+            try:
+                touched = _render(TechnicianProfile, projection, account_type)
+            except Exception as e:
+                errors.append(checks.Error(
+                    f"Projection '{name}' could not render {projection.serializer}: {e}",
+                    obj=TechnicianProfile, id='technicians.E001'
+                ))
+                break
+            if touched:
+                errors.append(checks.Error(
+                    f"Projection '{name}' ({account_type}) loads {', '.join(sorted(touched))} "
+                    f"outside its columns",
+                    hint=f"Add the columns to PROJECTIONS['{name}'] or stop reading them in {projection.serializer}",
+                    obj=TechnicianProfile, id='technicians.E001'
+                ))
+                break
+    return errors
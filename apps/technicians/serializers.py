@@ -1,4 +1,6 @@
 from rest_framework import serializers
+from apps.core.blobs import BlobField
+from apps.core.images import ImageSizesField
 from .models import TechnicianProfile, TechnicianAvailability, TechnicianLocation, Company
 
 
@@ -62,12 +64,14 @@ class TechnicianProfileSerializer(serializers.ModelSerializer):
     is_kyc_verified = serializers.SerializerMethodField()
     company_info = serializers.SerializerMethodField()
     commission_rate = serializers.SerializerMethodField()
+    profile_photo = BlobField(read_only=True)
+    profile_photo_sizes = ImageSizesField('profile_photo', 'photo_sizes')
     
     class Meta:
         model = TechnicianProfile
         fields = [
             'id', 'name', 'email', 'phone', 'skills', 'bio', 'experience_years',
-            'profile_photo', 'account_type', 'company_info', 'commission_rate',
+            'profile_photo', 'profile_photo_sizes', 'account_type', 'company_info', 'commission_rate',
             'verification_status', 'is_verified', 'is_kyc_verified',
             'rating', 'total_ratings', 'trust_score', 'completed_jobs_count',
             'is_online', 'is_active', 'created_at'
@@ -102,6 +106,25 @@ class TechnicianProfileSerializer(serializers.ModelSerializer):
         return str(obj.get_commission_rate())
 
 
+class TechnicianCardSerializer(serializers.ModelSerializer):
+    """Technician summary shown next to a bid"""
+    rating = serializers.FloatField(read_only=True)
+    completed_jobs = serializers.IntegerField(source='completed_jobs_count', read_only=True)
+    profile_photo = BlobField(read_only=True)
+    profile_photo_sizes = ImageSizesField('profile_photo', 'photo_sizes')
+    kyc_verified = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = TechnicianProfile
+        fields = [
+            'rating', 'total_ratings', 'completed_jobs', 'trust_score',
+            'profile_photo', 'profile_photo_sizes', 'kyc_verified'
+        ]
+    
+    def get_kyc_verified(self, obj):
+        return obj.kyc_status == 'approved'
+
+
 class TechnicianDashboardSerializer(serializers.ModelSerializer):
     """Full profile for technician's own dashboard"""
     name = serializers.SerializerMethodField()
@@ -109,12 +132,17 @@ class TechnicianDashboardSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(source='user.id', read_only=True)
     company_info = serializers.SerializerMethodField()
     commission_rate = serializers.SerializerMethodField()
+    profile_photo = BlobField(required=False)
+    profile_photo_sizes = ImageSizesField('profile_photo', 'photo_sizes')
+    id_front_photo = BlobField(private=True, required=False)
+    id_back_photo = BlobField(private=True, required=False)
+    selfie_with_id = BlobField(private=True, required=False)
     
     class Meta:
         model = TechnicianProfile
         fields = [
             'id', 'user_id', 'name', 'email', 'phone', 'skills', 'bio', 'experience_years',
-            'profile_photo', 'account_type', 'company_info', 'commission_rate', 'id_number',
+            'profile_photo', 'profile_photo_sizes', 'account_type', 'company_info', 'commission_rate', 'id_number',
             'id_front_photo', 'id_back_photo', 'selfie_with_id',
             'kyc_status', 'kyc_rejection_reason', 'kyc_submitted_at', 'kyc_verified_at',
             'verification_status', 'rejection_reason',
@@ -139,8 +167,22 @@ class TechnicianDashboardSerializer(serializers.ModelSerializer):
         return str(obj.get_commission_rate())
 
 
+class TechnicianDashboardProfileSerializer(TechnicianDashboardSerializer):
+    """Dashboard profile without the KYC document images"""
+    class Meta(TechnicianDashboardSerializer.Meta):
+        fields = [
+            field for field in TechnicianDashboardSerializer.Meta.fields
+            if field not in ('id_front_photo', 'id_back_photo', 'selfie_with_id')
+        ]
+
+
 class KYCSubmissionSerializer(serializers.ModelSerializer):
     """Serializer for KYC document submission"""
+    profile_photo = BlobField(required=False)
+    id_front_photo = BlobField(private=True, required=False)
+    id_back_photo = BlobField(private=True, required=False)
+    selfie_with_id = BlobField(private=True, required=False)
+    
     class Meta:
         model = TechnicianProfile
         fields = ['id_number', 'id_front_photo', 'id_back_photo', 'selfie_with_id', 'profile_photo']
@@ -157,6 +199,33 @@ class KYCSubmissionSerializer(serializers.ModelSerializer):
         return data
 
 
+class KYCReviewSerializer(serializers.ModelSerializer):
+    """A technician's KYC review status and which documents are on file"""
+    has_profile_photo = serializers.SerializerMethodField()
+    has_id_front = serializers.SerializerMethodField()
+    has_id_back = serializers.SerializerMethodField()
+    has_selfie = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = TechnicianProfile
+        fields = [
+            'kyc_status', 'kyc_rejection_reason', 'kyc_submitted_at', 'kyc_verified_at',
+            'has_profile_photo', 'has_id_front', 'has_id_back', 'has_selfie'
+        ]
+    
+    def get_has_profile_photo(self, obj):
+        return bool(obj.profile_photo)
+    
+    def get_has_id_front(self, obj):
+        return bool(obj.id_front_photo)
+    
+    def get_has_id_back(self, obj):
+        return bool(obj.id_back_photo)
+    
+    def get_has_selfie(self, obj):
+        return bool(obj.selfie_with_id)
+
+
 class TechnicianAvailabilitySerializer(serializers.ModelSerializer):
     class Meta:
         model = TechnicianAvailability
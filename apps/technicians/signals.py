@@ -0,0 +1,108 @@
+"""Evict technician dashboard snapshots and update leaderboards when the data behind them changes"""
+from django.db.models.signals import post_init, post_save, post_delete
+from django.db import transaction as db_transaction
+from django.dispatch import receiver
+
+from apps.accounts.models import User
+from apps.bookings.models import Booking, JobPosting, Bid
+from . import dashboard, leaderboards
+from .models import TechnicianProfile, TechnicianLocation, Company
+
+# Profile fields shown on or deciding membership of the public leaderboards
+LEADERBOARD_SOURCES = {
+    'phone', 'skills', 'bio', 'experience_years', 'profile_photo', 'photo_sizes', 'account_type', 'company',
+    'verification_status', 'kyc_status', 'rating', 'total_ratings', 'trust_score',
+    'completed_jobs_count', 'is_online', 'is_active'
+}
+ELIGIBILITY_FIELDS = {'verification_status', 'is_active', 'trust_score', 'kyc_status'}
+# User fields shown on dashboards and leaderboard entries (names fall back to the email)
+USER_SOURCES = {'full_name', 'email', 'is_technician'}
+
+
+@receiver(post_init, sender=TechnicianProfile)
+def profile_loaded(sender, instance, **kwargs):
+    # Remember the company so a technician who moves refreshes both companies' stats.
+    # Read from __dict__: touching a deferred field here would reload the row and recurse.
+    loaded = instance.__dict__
+    instance._loaded_company_id = loaded.get('company_id')
+    instance._loaded_eligible = None
+    if ELIGIBILITY_FIELDS <= loaded.keys():
+        instance._loaded_eligible = leaderboards.is_eligible(instance)
+
+
+@receiver(post_save, sender=TechnicianProfile)
+def profile_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not set(update_fields) & LEADERBOARD_SOURCES:
+        return
+    eligible = leaderboards.is_eligible(instance)
+    # Skip technicians who were and still are off every board
+    if eligible or getattr(instance, '_loaded_eligible', None) is not False:
+        leaderboards.technicians_changed([instance.user_id])
+    instance._loaded_eligible = eligible
+
+
+@receiver(post_delete, sender=TechnicianProfile)
+def profile_deleted(sender, instance, **kwargs):
+    db_transaction.on_commit(leaderboards.clear)
+
+
+@receiver([post_save, post_delete], sender=TechnicianProfile)
+def profile_changed(sender, instance, update_fields=None, **kwargs):
+    dashboard.invalidate([instance.user_id])
+    if update_fields and not set(update_fields) & dashboard.COMPANY_STAT_SOURCES:
+        return
+    company_ids = {instance.company_id, getattr(instance, '_loaded_company_id', None)}
+    db_transaction.on_commit(lambda: dashboard.refresh_company_stats(company_ids))
+    instance._loaded_company_id = instance.company_id
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # e.g. the last_login update on every sign-in
+    if update_fields and not set(update_fields) & USER_SOURCES:
+        return
+    if instance.is_technician and not created:
+        dashboard.invalidate([instance.pk])
+        leaderboards.technicians_changed([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Company)
+def company_changed(sender, instance, **kwargs):
+    dashboard.invalidate(list(instance.technicians.values_list('user_id', flat=True)))
+    # Company name and verification show on every member's entry
+    db_transaction.on_commit(leaderboards.clear)
+
+
+@receiver(post_init, sender=TechnicianLocation)
+def location_loaded(sender, instance, **kwargs):
+    instance._loaded_city = instance.__dict__.get('city')
+
+
+@receiver(post_save, sender=TechnicianLocation)
+def location_saved(sender, instance, created, **kwargs):
+    # Live position updates keep the city; only a new city moves the technician between boards
+    if created or instance.city != getattr(instance, '_loaded_city', None):
+        leaderboards.technicians_changed([instance.technician_id])
+    instance._loaded_city = instance.city
+
+
+@receiver(post_delete, sender=TechnicianLocation)
+def location_deleted(sender, instance, **kwargs):
+    leaderboards.technicians_changed([instance.technician_id])
+
+
+@receiver([post_save, post_delete], sender=Bid)
+def bid_changed(sender, instance, **kwargs):
+    dashboard.invalidate([instance.technician_id])
+
+
+@receiver([post_save, post_delete], sender=Booking)
+def booking_changed(sender, instance, **kwargs):
+    dashboard.invalidate([instance.technician_id])
+
+
+@receiver([post_save, post_delete], sender=JobPosting)
+def job_changed(sender, instance, **kwargs):
+    dashboard.invalidate([instance.assigned_technician_id])
+    dashboard.invalidate_open_jobs()
+
@@ -0,0 +1,7 @@
+from rest_framework.throttling import AnonRateThrottle
+
+
+class UploadThrottle(AnonRateThrottle):
+    """Anonymous chunked uploads: a signup sends four files in many small requests"""
+    rate = '600/hour'
+    scope = 'uploads'
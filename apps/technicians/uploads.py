@@ -0,0 +1,226 @@
+"""
+Resumable chunked uploads for KYC documents and photos
+
+Signup and KYC submission used to carry four base64 images in one JSON
+body: several megabytes parsed in memory, and any dropped connection meant
+starting over. Instead a client uploads each file on its own:
+
+    POST uploads/                      {filename, content_type, size, checksum}
+                                       -> {upload_id, chunk_size, offset: 0}
+    PUT  uploads/<id>/chunks/          raw bytes, Upload-Offset and optional
+                                       Upload-Checksum (SHA-256 hex of the chunk)
+    GET  uploads/<id>/                 offset to resume from after a drop
+    POST uploads/<id>/finalize/        joins the chunks into a blob
+
+and then sends ``<field>_upload_id`` in place of the base64 field. Each
+chunk is stored as soon as it arrives, so a request holds at most
+``UPLOAD_CHUNK_SIZE`` bytes. Finalize streams the chunks into blob storage
+(see apps/core/blobs.py) and checks the whole-file ``checksum``. An upload
+can be attached to one profile only.
+
+The random upload id authorizes the chunk requests, so anonymous signups
+can upload before their account exists. Uploads started while signed in are
+bound to that user. ``manage.py clear_expired_uploads`` deletes uploads
+older than ``UPLOAD_EXPIRY_HOURS`` along with any chunks left behind.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from apps.core import blobs
+from .models import Upload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/heic', 'application/pdf')
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A request the upload cannot accept; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def chunk_size():
+    return getattr(settings, 'UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+
+def max_size():
+    return getattr(settings, 'UPLOAD_MAX_BYTES', 15 * 1024 * 1024)
+
+
+def expiry_cutoff():
+    return timezone.now() - timedelta(hours=getattr(settings, 'UPLOAD_EXPIRY_HOURS', 24))
+
+
+def _part_name(upload, index):
+    return f'uploads/{upload.id}.{index:05d}'
+
+
+def describe(upload):
+    return {
+        'upload_id': str(upload.id),
+        'status': upload.status,
+        'size': upload.size,
+        'offset': upload.received,
+        'chunk_size': chunk_size(),
+    }
+
+
+def start(user, filename, content_type, size, checksum):
+    """Create an upload after validating what the client says it will send"""
+    content_types = getattr(settings, 'UPLOAD_CONTENT_TYPES', DEFAULT_CONTENT_TYPES)
+    if content_type not in content_types:
+        raise UploadError(f"content_type must be one of: {', '.join(content_types)}")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('size must be the file size in bytes')
+    if size <= 0 or size > max_size():
+        raise UploadError(f'size must be between 1 and {max_size()} bytes', status=413 if size > 0 else 400)
+    checksum = (checksum or '').lower()
+    if len(checksum) != 64 or any(c not in '0123456789abcdef' for c in checksum):
+        raise UploadError('checksum must be the SHA-256 of the file, hex encoded')
+
+    return Upload.objects.create(
+        user=user if user and user.is_authenticated else None,
+        filename=(filename or '')[:255],
+        content_type=content_type,
+        size=size,
+        checksum=checksum,
+    )
+
+
+def get(upload_id, user, for_update=False):
+    """The upload, if it exists, has not expired and `user` may use it"""
+    queryset = Upload.objects.select_for_update() if for_update else Upload.objects
+    try:
+        upload = queryset.filter(id=upload_id).first()
+    except ValidationError:
+        upload = None
+    if upload is None or (upload.user_id and upload.user_id != getattr(user, 'id', None)):
+        raise UploadError('Upload not found', status=404)
+    if upload.created_at < expiry_cutoff():
+        raise UploadError('Upload has expired; start a new one', status=410)
+    return upload
+
+
+def append(upload, offset, data, chunk_checksum=None):
+    """Store one chunk at `offset`. Call inside a transaction holding the row lock (get(for_update=True))."""
+    if upload.status != 'uploading':
+        raise UploadError('Upload is already finalized', status=409)
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        raise UploadError('Upload-Offset header is required')
+    if offset != upload.received:
+        # Usually a retry of a chunk whose response was lost; the client resumes from here
+        raise UploadError('Offset does not match the bytes received', status=409, offset=upload.received)
+    if not data:
+        raise UploadError('Chunk is empty')
+    if len(data) > chunk_size():
+        raise UploadError(f'Chunks may be at most {chunk_size()} bytes', status=413)
+    if upload.received + len(data) > upload.size:
+        raise UploadError('Chunk runs past the declared size')
+    if chunk_checksum and hashlib.sha256(data).hexdigest() != chunk_checksum.lower():
+        raise UploadError('Chunk checksum does not match; send it again', offset=upload.received)
+
+    storage = blobs.storage()
+    name = _part_name(upload, len(upload.parts))
+    if storage.exists(name):
+        # Left by an earlier attempt whose row update rolled back
+        storage.delete(name)
+    storage.save(name, ContentFile(data))
+    upload.parts.append(len(data))
+    upload.received += len(data)
+    upload.save(update_fields=['parts', 'received', 'updated_at'])
+    return upload
+
+
+def _read_parts(upload):
+    storage = blobs.storage()
+    for index in range(len(upload.parts)):
+        with storage.open(_part_name(upload, index), 'rb') as part:
+            for block in iter(lambda: part.read(READ_SIZE), b''):
+                yield block
+
+
+def _delete_parts(upload):
+    storage = blobs.storage()
+    for index in range(len(upload.parts)):
+        name = _part_name(upload, index)
+        if storage.exists(name):
+            storage.delete(name)
+
+
+def finalize(upload):
+    """Join the chunks into a blob. Call inside a transaction holding the row lock."""
+    if upload.status != 'uploading':
+        return upload
+    if upload.received != upload.size:
+        raise UploadError(f'{upload.size - upload.received} bytes are still missing', status=409, offset=upload.received)
+    try:
+        upload.blob_key = blobs.put_stream(_read_parts(upload), upload.content_type, sha256=upload.checksum)
+    except ValueError:
+        # A corrupted chunk got through without its own checksum; only a fresh upload can fix it
+        logger.warning(f"Upload {upload.id} failed its checksum; discarding {len(upload.parts)} chunk(s)")
+        _delete_parts(upload)
+        upload.parts, upload.received = [], 0
+        upload.save(update_fields=['parts', 'received', 'updated_at'])
+        raise UploadError('File checksum does not match; upload it again from offset 0', status=422, offset=0)
+    _delete_parts(upload)
+    upload.status = 'complete'
+    upload.save(update_fields=['blob_key', 'status', 'updated_at'])
+    return upload
+
+
+def claim(data, fields, user):
+    """{field: blob key} for each of `fields` sent as ``<field>_upload_id``.
+
+    Marks the uploads used and binds them to `user`. Call inside the
+    transaction that saves the keys so a failed save releases them.
+    """
+    claimed = {}
+    for field in fields:
+        upload_id = data.get(f'{field}_upload_id')
+        if not upload_id:
+            continue
+        try:
+            upload = get(upload_id, user, for_update=True)
+        except UploadError as e:
+            raise UploadError(f'{field}: {e}', status=e.status)
+        if upload.status != 'complete':
+            raise UploadError(f'{field}: upload is {"already used" if upload.status == "used" else "not finalized"}', status=409)
+        upload.status = 'used'
+        upload.user = user
+        upload.save(update_fields=['status', 'user', 'updated_at'])
+        claimed[field] = upload.blob_key
+    return claimed
+
+
+def provided(data, field):
+    """Whether the request carries `field` inline or as an upload reference"""
+    return bool(data.get(field) or data.get(f'{field}_upload_id'))
+
+
+def clear_expired():
+    """Delete expired uploads and their chunks. Returns the number deleted.
+
+    Finalized blobs are kept: they are content addressed and may be shared
+    with a profile.
+    """
+    expired = list(Upload.objects.filter(created_at__lt=expiry_cutoff()))
+    for upload in expired:
+        if upload.status == 'uploading':
+            _delete_parts(upload)
+    Upload.objects.filter(id__in=[upload.id for upload in expired]).delete()
+    return len(expired)
@@ -10,6 +10,7 @@ urlpatterns = [
     path('', include(router.urls)),
     path('top/', views.get_top_technicians, name='top_technicians'),
     path('by-skill/<str:skill>/', views.get_technicians_by_skill, name='technicians_by_skill'),
+    path('by-city/<str:city>/', views.get_technicians_by_city, name='technicians_by_city'),
     path('profile/<int:technician_id>/', views.get_technician_profile, name='technician_profile'),
     path('nearby/', views.get_nearby_technicians, name='nearby_technicians'),
     
@@ -22,6 +23,12 @@ urlpatterns = [
     path('kyc/status/', views.get_kyc_status, name='kyc_status'),
     path('profile-photo/', views.update_profile_photo, name='update_profile_photo'),
     
+    # Resumable chunked uploads for KYC documents and photos
+    path('uploads/', views.start_upload, name='start_upload'),
+    path('uploads/<uuid:upload_id>/', views.get_upload, name='upload_status'),
+    path('uploads/<uuid:upload_id>/chunks/', views.append_upload_chunk, name='append_upload_chunk'),
+    path('uploads/<uuid:upload_id>/finalize/', views.finalize_upload, name='finalize_upload'),
+    
     # Company endpoints
     path('company/register/', views.register_company, name='register_company'),
     path('company/me/', views.get_my_company, name='my_company'),
@@ -1,9 +1,12 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.decorators import api_view, permission_classes, action, throttle_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from rest_framework.throttling import UserRateThrottle
 from django.utils import timezone
-from django.db.models import Q
+from django.db import transaction as db_transaction
+from django.db.models import Q, Count, Max
+from django.http import HttpResponse
 from .models import TechnicianProfile, TechnicianAvailability, TechnicianLocation, Company
 from .serializers import (
     TechnicianProfileSerializer,
@@ -11,51 +14,81 @@ from .serializers import (
     TechnicianLocationSerializer,
     TechnicianDashboardSerializer,
     KYCSubmissionSerializer,
+    KYCReviewSerializer,
     CompanySerializer,
     CompanyRegistrationSerializer,
     CompanyVerificationSerializer,
     LiveLocationUpdateSerializer
 )
 from apps.accounts.permissions import IsTechnician
+from apps.core import blobs
+from apps.core.conditional import conditional, make_etag
+from apps.payments import fees
+from . import dashboard, leaderboards, uploads
+from .throttles import UploadThrottle
+
+
+PUBLIC_LIST_CACHE = {'public': True, 'max_age': 60}
+
+
+def _skill_board_etag(request, skill):
+    return leaderboards.etag(leaderboards.board_name('skill', skill))
+
+
+def _city_board_etag(request, city):
+    return leaderboards.etag(leaderboards.board_name('city', city))
+
+
+def _profile_etag(request, technician_id):
+    """Version of everything the public profile shows"""
+    row = TechnicianProfile.objects.filter(id=technician_id, is_active=True).values_list(
+        'user_id', 'updated_at', 'user__updated_at', 'company__updated_at'
+    ).first()
+    if not row:
+        return None
+    user_id, *versions = row
+    # commission_rate comes from the fee policy, which also changes with PLATFORM_COMMISSION_RATE
+    return make_etag(*versions, fees.rate_for(user_id))
+
+
+def _companies_etag(request):
+    totals = Company.objects.aggregate(
+        changed=Max('updated_at'), listed=Count('id', filter=Q(verification_status='approved', is_active=True))
+    )
+    return make_etag(totals['changed'], totals['listed'])
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@conditional(etag=lambda request: leaderboards.etag('top'), cache_control=PUBLIC_LIST_CACHE)
 def get_top_technicians(request):
     """Get top-rated verified technicians"""
-    technicians = TechnicianProfile.objects.filter(
-        verification_status='approved',
-        is_active=True,
-        trust_score__gte=0,
-        kyc_status='approved'
-    ).order_by('-rating', '-trust_score', '-completed_jobs_count')[:20]
-    
-    serializer = TechnicianProfileSerializer(technicians, many=True, context={'request': request})
-    return Response(serializer.data)
+    return HttpResponse(leaderboards.rendered('top'), content_type='application/json')
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@conditional(etag=_skill_board_etag, cache_control=PUBLIC_LIST_CACHE)
 def get_technicians_by_skill(request, skill):
     """Get verified technicians by skill"""
-    technicians = TechnicianProfile.objects.filter(
-        verification_status='approved',
-        is_active=True,
-        trust_score__gte=0,
-        kyc_status='approved',
-        skills__contains=[skill]
-    ).order_by('-rating', '-trust_score')[:10]
-    
-    serializer = TechnicianProfileSerializer(technicians, many=True, context={'request': request})
-    return Response(serializer.data)
+    return HttpResponse(leaderboards.rendered(leaderboards.board_name('skill', skill)), content_type='application/json')
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@conditional(etag=_city_board_etag, cache_control=PUBLIC_LIST_CACHE)
+def get_technicians_by_city(request, city):
+    """Get top-rated verified technicians in a city"""
+    return HttpResponse(leaderboards.rendered(leaderboards.board_name('city', city)), content_type='application/json')
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional(etag=_profile_etag, cache_control={'private': True, 'no_cache': True})
 def get_technician_profile(request, technician_id):
     """Get detailed technician profile"""
     try:
-        technician = TechnicianProfile.objects.get(id=technician_id, is_active=True)
+        technician = TechnicianProfile.objects.projection('public_profile').get(id=technician_id, is_active=True)
         serializer = TechnicianProfileSerializer(technician, context={'request': request})
         return Response(serializer.data)
     except TechnicianProfile.DoesNotExist:
@@ -86,17 +119,27 @@ def submit_kyc(request):
     if profile.kyc_status == 'approved':
         return Response({'error': 'KYC already approved'}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = KYCSubmissionSerializer(profile, data=request.data, partial=True)
-    if serializer.is_valid():
-        profile = serializer.save()
-        profile.kyc_status = 'pending'
-        profile.kyc_submitted_at = timezone.now()
-        profile.save()
-        return Response({
-            'message': 'KYC documents submitted successfully. Verification usually takes 24-48 hours.',
-            'kyc_status': profile.kyc_status
-        })
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    # Documents may arrive inline or as finalized chunked uploads (<field>_upload_id)
+    data = request.data.copy()
+    try:
+        with db_transaction.atomic():
+            for field, key in uploads.claim(request.data, TechnicianProfile.IMAGE_FIELDS, request.user).items():
+                data[field] = key
+            serializer = KYCSubmissionSerializer(profile, data=data, partial=True)
+            if not serializer.is_valid():
+                # Leave the uploads unclaimed so the client can fix the request and retry
+                db_transaction.set_rollback(True)
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            profile = serializer.save()
+            profile.kyc_status = 'pending'
+            profile.kyc_submitted_at = timezone.now()
+            profile.save()
+    except uploads.UploadError as e:
+        return Response({'error': str(e)}, status=e.status)
+    return Response({
+        'message': 'KYC documents submitted successfully. Verification usually takes 24-48 hours.',
+        'kyc_status': profile.kyc_status
+    })
 
 
 @api_view(['GET'])
@@ -104,17 +147,8 @@ def submit_kyc(request):
 def get_kyc_status(request):
     """Get KYC verification status"""
     try:
-        profile = TechnicianProfile.objects.get(user=request.user)
-        return Response({
-            'kyc_status': profile.kyc_status,
-            'kyc_rejection_reason': profile.kyc_rejection_reason,
-            'kyc_submitted_at': profile.kyc_submitted_at,
-            'kyc_verified_at': profile.kyc_verified_at,
-            'has_profile_photo': bool(profile.profile_photo),
-            'has_id_front': bool(profile.id_front_photo),
-            'has_id_back': bool(profile.id_back_photo),
-            'has_selfie': bool(profile.selfie_with_id)
-        })
+        profile = TechnicianProfile.objects.projection('kyc_review').get(user=request.user)
+        return Response(KYCReviewSerializer(profile).data)
     except TechnicianProfile.DoesNotExist:
         return Response({'error': 'Technician profile not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -128,127 +162,103 @@ def update_profile_photo(request):
     except TechnicianProfile.DoesNotExist:
         return Response({'error': 'Technician profile not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    profile_photo = request.data.get('profile_photo')
-    if not profile_photo:
+    if not uploads.provided(request.data, 'profile_photo'):
         return Response({'error': 'Profile photo URL is required'}, status=status.HTTP_400_BAD_REQUEST)
     
-    profile.profile_photo = profile_photo
-    profile.save()
-    return Response({'message': 'Profile photo updated', 'profile_photo': profile.profile_photo})
+    try:
+        with db_transaction.atomic():
+            claimed = uploads.claim(request.data, ['profile_photo'], request.user)
+            profile.profile_photo = claimed.get('profile_photo', request.data.get('profile_photo'))
+            profile.save()
+    except uploads.UploadError as e:
+        return Response({'error': str(e)}, status=e.status)
+    return Response({
+        'message': 'Profile photo updated',
+        'profile_photo': blobs.url(profile.profile_photo, request=request)
+    })
+
+
+def _upload_error(e):
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return Response(body, status=e.status)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([UploadThrottle, UserRateThrottle])
+def start_upload(request):
+    """Start a resumable chunked upload of a KYC document or photo (see uploads.py)"""
+    try:
+        upload = uploads.start(
+            request.user,
+            request.data.get('filename'),
+            request.data.get('content_type'),
+            request.data.get('size'),
+            request.data.get('checksum'),
+        )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return Response(uploads.describe(upload), status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([UploadThrottle, UserRateThrottle])
+def get_upload(request, upload_id):
+    """Upload progress; clients resume from `offset` after a dropped connection"""
+    try:
+        return Response(uploads.describe(uploads.get(upload_id, request.user)))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
+
+@api_view(['PUT'])
+@permission_classes([AllowAny])
+@throttle_classes([UploadThrottle, UserRateThrottle])
+def append_upload_chunk(request, upload_id):
+    """Append the raw request body at the Upload-Offset header"""
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return Response({'error': 'Content-Length must be the chunk size in bytes'}, status=status.HTTP_400_BAD_REQUEST)
+    if length > uploads.chunk_size():
+        # Refuse before reading the body
+        return Response({'error': f'Chunks may be at most {uploads.chunk_size()} bytes'},
+                        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    # Errors are answered inside the transaction so the row matches storage
+    with db_transaction.atomic():
+        try:
+            upload = uploads.get(upload_id, request.user, for_update=True)
+            uploads.append(upload, request.headers.get('Upload-Offset'), request.body,
+                           request.headers.get('Upload-Checksum'))
+        except uploads.UploadError as e:
+            return _upload_error(e)
+    return Response(uploads.describe(upload))
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([UploadThrottle, UserRateThrottle])
+def finalize_upload(request, upload_id):
+    """Verify the whole-file checksum and store the upload; it can then be referenced by id"""
+    with db_transaction.atomic():
+        try:
+            upload = uploads.finalize(uploads.get(upload_id, request.user, for_update=True))
+        except uploads.UploadError as e:
+            return _upload_error(e)
+    return Response(uploads.describe(upload))
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_technician_dashboard(request):
-    """Get technician dashboard data with enhanced stats"""
+    """Get technician dashboard data with enhanced stats (cached snapshot, see dashboard.py)"""
     try:
-        profile = TechnicianProfile.objects.get(user=request.user)
+        return Response(dashboard.get(request.user))
     except TechnicianProfile.DoesNotExist:
         return Response({'error': 'Technician profile not found'}, status=status.HTTP_404_NOT_FOUND)
-    
-    # Get job and bid stats
-    from apps.bookings.models import Booking, JobPosting, Bid
-    from django.db.models import Avg, Count, Sum
-    from django.db.models.functions import TruncMonth
-    from datetime import datetime, timedelta
-    
-    active_jobs = Booking.objects.filter(
-        technician=request.user,
-        status__in=['accepted', 'enroute', 'in_progress']
-    ).count()
-    
-    # All bids stats
-    all_bids = Bid.objects.filter(technician=request.user)
-    pending_bids = all_bids.filter(status='pending').count()
-    accepted_bids = all_bids.filter(status='accepted').count()
-    rejected_bids = all_bids.filter(status='rejected').count()
-    total_bids = all_bids.count()
-    
-    # Calculate bid success rate
-    bid_success_rate = (accepted_bids / total_bids * 100) if total_bids > 0 else 0
-    
-    # Get available jobs count (open jobs matching technician skills)
-    available_jobs = JobPosting.objects.filter(
-        status='open',
-        category__in=profile.skills if profile.skills else []
-    ).count()
-    
-    # Get jobs assigned to this technician
-    assigned_jobs = JobPosting.objects.filter(
-        assigned_technician=request.user
-    )
-    
-    # Job performance stats
-    completed_jobs_from_postings = assigned_jobs.filter(status='completed').count()
-    in_progress_jobs = assigned_jobs.filter(status='in_progress').count()
-    
-    # Calculate average job completion time (mock for now)
-    avg_completion_time = "2-3 hours"  # This would be calculated from actual data
-    
-    # Rating breakdown (mock - would come from reviews)
-    rating_breakdown = {
-        '5_star': 0,
-        '4_star': 0,
-        '3_star': 0,
-        '2_star': 0,
-        '1_star': 0
-    }
-    
-    # Try to get actual rating breakdown from reviews
-    try:
-        from apps.reviews.models import Review
-        reviews = Review.objects.filter(technician=request.user)
-        for review in reviews:
-            star_key = f'{int(review.rating)}_star'
-            if star_key in rating_breakdown:
-                rating_breakdown[star_key] += 1
-    except:
-        pass
-    
-    # Monthly earnings (last 6 months)
-    monthly_earnings = []
-    for i in range(5, -1, -1):
-        month_date = datetime.now() - timedelta(days=i*30)
-        month_name = month_date.strftime('%b')
-        # Mock data - would be calculated from actual transactions
-        monthly_earnings.append({
-            'month': month_name,
-            'amount': float(profile.total_earnings) / 6 if profile.total_earnings else 0
-        })
-    
-    return Response({
-        'profile': TechnicianDashboardSerializer(profile, context={'request': request}).data,
-        'stats': {
-            'active_jobs': active_jobs,
-            'pending_bids': pending_bids,
-            'accepted_bids': accepted_bids,
-            'rejected_bids': rejected_bids,
-            'total_bids': total_bids,
-            'bid_success_rate': round(bid_success_rate, 1),
-            'available_jobs': available_jobs,
-            'in_progress_jobs': in_progress_jobs,
-            'completed_jobs': profile.completed_jobs_count,
-            'cancelled_jobs': profile.cancelled_jobs_count,
-            'wallet_balance': float(profile.wallet_balance),
-            'total_earnings': float(profile.total_earnings),
-            'pending_earnings': float(profile.pending_earnings),
-            'rating': float(profile.rating),
-            'total_ratings': profile.total_ratings,
-            'trust_score': profile.trust_score,
-            'avg_completion_time': avg_completion_time,
-        },
-        'performance': {
-            'rating_breakdown': rating_breakdown,
-            'monthly_earnings': monthly_earnings,
-            'job_completion_rate': round((profile.completed_jobs_count / (profile.completed_jobs_count + profile.cancelled_jobs_count) * 100) if (profile.completed_jobs_count + profile.cancelled_jobs_count) > 0 else 100, 1),
-            'response_rate': 95.0,  # Mock - would be calculated
-        },
-        'kyc': {
-            'status': profile.kyc_status,
-            'is_complete': profile.is_kyc_complete(),
-            'can_accept_jobs': profile.can_accept_jobs()
-        }
-    })
 
 
 class TechnicianAvailabilityViewSet(viewsets.ModelViewSet):
@@ -361,6 +371,7 @@ def submit_company_verification(request):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@conditional(etag=_companies_etag, cache_control=PUBLIC_LIST_CACHE)
 def get_verified_companies(request):
     """Get list of verified companies"""
     companies = Company.objects.filter(
@@ -374,113 +385,13 @@ def get_verified_companies(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_company_dashboard(request):
-    """Get company dashboard data with enhanced stats"""
+    """Get company dashboard data with enhanced stats (see dashboard.company)"""
     try:
-        company = Company.objects.get(owner=request.user)
+        company = Company.objects.select_related('owner').get(owner=request.user)
     except Company.DoesNotExist:
         return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    from apps.bookings.models import Booking, JobPosting, Bid
-    from django.db.models import Avg, Count, Sum
-    from datetime import datetime, timedelta
-    
-    # Get all technicians in this company
-    company_technicians = TechnicianProfile.objects.filter(company=company)
-    technician_users = [t.user for t in company_technicians]
-    
-    # Aggregate stats from all company technicians
-    total_wallet_balance = sum([float(t.wallet_balance) for t in company_technicians])
-    total_earnings = sum([float(t.total_earnings) for t in company_technicians])
-    pending_earnings = sum([float(t.pending_earnings) for t in company_technicians])
-    total_completed_jobs = sum([t.completed_jobs_count for t in company_technicians])
-    total_cancelled_jobs = sum([t.cancelled_jobs_count for t in company_technicians])
-    
-    # Bids stats
-    all_bids = Bid.objects.filter(technician__in=technician_users)
-    pending_bids = all_bids.filter(status='pending').count()
-    accepted_bids = all_bids.filter(status='accepted').count()
-    rejected_bids = all_bids.filter(status='rejected').count()
-    total_bids = all_bids.count()
-    
-    bid_success_rate = (accepted_bids / total_bids * 100) if total_bids > 0 else 0
-    
-    # Active jobs
-    active_jobs = Booking.objects.filter(
-        technician__in=technician_users,
-        status__in=['accepted', 'enroute', 'in_progress']
-    ).count()
-    
-    # Available jobs matching company services
-    available_jobs = JobPosting.objects.filter(
-        status='open',
-        category__in=company.services if company.services else []
-    ).count()
-    
-    # Rating breakdown
-    rating_breakdown = {
-        '5_star': 0,
-        '4_star': 0,
-        '3_star': 0,
-        '2_star': 0,
-        '1_star': 0
-    }
-    
-    try:
-        from apps.reviews.models import Review
-        reviews = Review.objects.filter(technician__in=technician_users)
-        for review in reviews:
-            star_key = f'{int(review.rating)}_star'
-            if star_key in rating_breakdown:
-                rating_breakdown[star_key] += 1
-    except:
-        pass
-    
-    # Monthly earnings
-    monthly_earnings = []
-    for i in range(5, -1, -1):
-        month_date = datetime.now() - timedelta(days=i*30)
-        month_name = month_date.strftime('%b')
-        monthly_earnings.append({
-            'month': month_name,
-            'amount': total_earnings / 6 if total_earnings else 0
-        })
-    
-    # Job completion rate
-    job_completion_rate = round(
-        (total_completed_jobs / (total_completed_jobs + total_cancelled_jobs) * 100) 
-        if (total_completed_jobs + total_cancelled_jobs) > 0 else 100, 1
-    )
-    
-    return Response({
-        'company': CompanySerializer(company).data,
-        'stats': {
-            'total_technicians': company_technicians.count(),
-            'active_jobs': active_jobs,
-            'pending_bids': pending_bids,
-            'accepted_bids': accepted_bids,
-            'rejected_bids': rejected_bids,
-            'total_bids': total_bids,
-            'bid_success_rate': round(bid_success_rate, 1),
-            'available_jobs': available_jobs,
-            'completed_jobs': total_completed_jobs,
-            'cancelled_jobs': total_cancelled_jobs,
-            'wallet_balance': total_wallet_balance,
-            'total_earnings': total_earnings,
-            'pending_earnings': pending_earnings,
-            'rating': float(company.rating),
-            'total_ratings': company.total_ratings,
-        },
-        'performance': {
-            'rating_breakdown': rating_breakdown,
-            'monthly_earnings': monthly_earnings,
-            'job_completion_rate': job_completion_rate,
-            'response_rate': 95.0,
-        },
-        'verification': {
-            'status': company.verification_status,
-            'is_verified': company.is_verified(),
-        }
-    })
+    return Response(dashboard.company(company))
 
 
 # ============================================
@@ -571,10 +482,10 @@ def get_nearby_technicians(request):
         return Response({'error': 'Invalid coordinates'}, status=status.HTTP_400_BAD_REQUEST)
     
     # Get all active technicians with locations
-    technicians = TechnicianProfile.objects.filter(
+    technicians = TechnicianProfile.objects.projection('public_profile', 'user__location').filter(
         is_active=True,
         is_available_for_jobs=True
-    ).select_related('user')
+    )
     
     # Filter by skill if provided
     if skill:
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+End-to-end payment load benchmark against the local Daraja simulator
+Run: python benchmark_payments.py --flows 200 --rate 10 --latency 150
+
+Each flow drives the full money path over HTTP:
+initiate STK Push -> simulator callback -> escrow held -> release -> payout
+request -> B2C result callback -> payout completed.
+The callback inbox worker and the payout scheduler run in background threads,
+as they would in production. Reports p50/p99 latency per step and the number
+of DB queries per flow.
+
+Uses a throwaway test database. Numbers are only meaningful on PostgreSQL
+(set DATABASE_URL); SQLite serialises all writes.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import django
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+django.setup()
+
+import requests
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from rest_framework.settings import api_settings
+
+import daraja_simulator
+
+
+_local = threading.local()
+
+
+class QueryCounter:
+    """Counts queries on every DB connection, grouped by what the thread is doing"""
+
+    def __init__(self):
+        self.queries = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        role = getattr(_local, 'role', 'benchmark')
+        with self.lock:
+            self.queries[role] = self.queries.get(role, 0) + 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def wsgi(self, application):
+        """Attribute queries made while serving a request to its path"""
+        def counted(environ, start_response):
+            _local.role = environ.get('PATH_INFO', '')
+            with self.lock:
+                self.requests[_local.role] = self.requests.get(_local.role, 0) + 1
+            return application(environ, start_response)
+        return counted
+
+
+def worker_loop(process, idle_sleep):
+    """Background worker: like the management commands, but on a daemon thread"""
+    _local.role = 'workers'
+    while True:
+        try:
+            if not process():
+                time.sleep(idle_sleep)
+        except Exception as e:
+            print(f"Worker error: {e}")
+            time.sleep(idle_sleep)
+        finally:
+            connection.close()
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def wait_for(predicate, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def configure(app_url, simulator_url):
+    """Point the app at the simulator and lift limits that would skew the numbers"""
+    settings.ALLOWED_HOSTS = ['*']
+    settings.MPESA_BASE_URL = simulator_url
+    settings.MPESA_CONSUMER_KEY = settings.MPESA_CONSUMER_KEY or 'benchmark'
+    settings.MPESA_CONSUMER_SECRET = settings.MPESA_CONSUMER_SECRET or 'benchmark'
+    settings.MPESA_CALLBACK_URL = f'{app_url}/api/payments/mpesa/callback/'
+    settings.MPESA_B2C_RESULT_URL = f'{app_url}/api/payments/mpesa/b2c/result/'
+    settings.MPESA_B2C_TIMEOUT_URL = f'{app_url}/api/payments/mpesa/b2c/timeout/'
+    settings.MPESA_CALLBACK_INLINE = False
+    settings.PAYOUT_INLINE = False
+    settings.PAYOUT_RATE_PER_SECOND = 1000
+    # Views pick up throttle classes when they are defined, so this must run before urls are loaded
+    settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': []}
+    api_settings.reload()
+
+
+def create_actors(count):
+    from apps.accounts.models import User
+
+    pairs = []
+    for i in range(count):
+        client = User.objects.create_user(
+            email=f'bench-client-{i}@example.com', password='benchmark', phone_number=f'07{i:08d}'[:10],
+            email_verified=True
+        )
+        technician = User.objects.create_user(
+            email=f'bench-tech-{i}@example.com', password='benchmark', phone_number=f'01{i:08d}'[:10],
+            is_technician=True, email_verified=True
+        )
+        pairs.append((client, technician))
+    return pairs
+
+
+def auth_headers(user):
+    from rest_framework_simplejwt.tokens import RefreshToken
+    return {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+
+def run_flow(app_url, client, technician, timings, failures, timeout):
+    from apps.bookings.models import JobPosting
+    from apps.payments.models import JobPayment, Payout
+
+    session = requests.Session()
+    client_headers, technician_headers = auth_headers(client), auth_headers(technician)
+
+    try:
+        job = JobPosting.objects.create(
+            customer=client, assigned_technician=technician, title='Benchmark job', description='Benchmark',
+            category='other', latitude=0, longitude=0, address='Nairobi', budget_min=1000, budget_max=1000,
+            final_price=Decimal('1000.00'), status='assigned'
+        )
+        flow_start = time.perf_counter()
+
+        start = time.perf_counter()
+        response = session.post(f'{app_url}/api/payments/job/initiate/', json={'job_id': job.id}, headers=client_headers)
+        timings['initiate'].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'initiate: {response.status_code} {response.text[:200]}')
+        payment_ref = response.json()['payment_ref']
+
+        # Client app polls the (read-only) status endpoint until the callback lands
+        def held():
+            start = time.perf_counter()
+            status = session.post(
+                f'{app_url}/api/payments/job/status/', json={'payment_ref': payment_ref}, headers=client_headers
+            ).json().get('status')
+            timings['status'].append(time.perf_counter() - start)
+            return status in ('held', 'failed')
+        if not wait_for(held, timeout, interval=0.25):
+            raise RuntimeError('payment never reached escrow')
+        timings['paid'].append(time.perf_counter() - flow_start)
+        if JobPayment.objects.filter(payment_ref=payment_ref, status='failed').exists():
+            raise RuntimeError('payment declined')
+
+        JobPosting.objects.filter(pk=job.pk).update(status='completed')
+        start = time.perf_counter()
+        response = session.post(f'{app_url}/api/payments/job/release/', json={'job_id': job.id}, headers=client_headers)
+        timings['release'].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'release: {response.status_code} {response.text[:200]}')
+
+        start = time.perf_counter()
+        response = session.post(
+            f'{app_url}/api/payments/payout/request/',
+            json={'amount': response.json()['technician_amount'], 'payout_method': 'mpesa'},
+            headers=technician_headers
+        )
+        timings['payout_request'].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'payout: {response.status_code} {response.text[:200]}')
+        payout_ref = response.json()['payout_ref']
+
+        if not wait_for(lambda: Payout.objects.filter(payout_ref=payout_ref, status__in=['completed', 'failed']).exists(), timeout):
+            raise RuntimeError('payout never completed')
+        timings['flow'].append(time.perf_counter() - flow_start)
+    except Exception as e:
+        failures.append(str(e))
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end M-Pesa payment load benchmark')
+    parser.add_argument('--flows', type=int, default=50, help='Number of payment flows')
+    parser.add_argument('--rate', type=float, default=5, help='New flows started per second')
+    parser.add_argument('--concurrency', type=int, default=50, help='Max flows in progress')
+    parser.add_argument('--latency', type=float, default=100, help='Simulator mean latency (ms)')
+    parser.add_argument('--jitter', type=float, default=50, help='Simulator latency jitter (ms)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of Daraja calls answered with 503')
+    parser.add_argument('--callback-delay', type=float, default=1.0, help='Seconds until simulator callbacks')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds a flow may wait for a callback')
+    parser.add_argument('--port', type=int, default=8901, help='Port for the app server')
+    parser.add_argument('--simulator-port', type=int, default=8900)
+    args = parser.parse_args()
+
+    print("\n" + "="*50)
+    print("M-Pesa Payment Load Benchmark")
+    print("="*50)
+
+    counter = QueryCounter()
+    connection_created.connect(counter.install)
+    for conn in connections.all():
+        counter.install(connection=conn)
+
+    old_database_name = connection.settings_dict['NAME']
+    if connection.vendor == 'sqlite':
+        # A file database lets threads wait for the write lock instead of failing
+        connection.settings_dict['TEST']['NAME'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark.sqlite3')
+        connection.settings_dict.setdefault('OPTIONS', {})['timeout'] = 30
+        print("⚠️  SQLite serialises writes; use PostgreSQL (DATABASE_URL) for representative numbers")
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        simulator_server, simulator = daraja_simulator.serve(
+            '127.0.0.1', args.simulator_port,
+            latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+            callback_delay=args.callback_delay
+        )
+        app_url = f'http://127.0.0.1:{args.port}'
+        configure(app_url, f'http://127.0.0.1:{args.simulator_port}')
+
+        app_server = make_server('127.0.0.1', args.port, counter.wsgi(WSGIHandler()), ThreadingWSGIServer, QuietHandler)
+        threading.Thread(target=app_server.serve_forever, daemon=True).start()
+
+        from apps.payments import callbacks, payouts
+        threading.Thread(target=worker_loop, args=(callbacks.process_batch, 0.1), daemon=True).start()
+        threading.Thread(target=worker_loop, args=(payouts.drain_batch, 0.2), daemon=True).start()
+
+        actors = create_actors(min(args.flows, args.concurrency))
+        print(f"Flows: {args.flows} at {args.rate}/s (max {args.concurrency} in flight)")
+        print(f"Daraja latency: {args.latency}±{args.jitter} ms, error rate {args.error_rate:.0%}")
+
+        timings = {step: [] for step in ('initiate', 'status', 'paid', 'release', 'payout_request', 'flow')}
+        failures = []
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for i in range(args.flows):
+                time.sleep(max(0, started + i / args.rate - time.perf_counter()))
+                client, technician = actors[i % len(actors)]
+                pool.submit(run_flow, app_url, client, technician, timings, failures, args.timeout)
+
+        elapsed = time.perf_counter() - started
+        completed = len(timings['flow'])
+
+        print("\n" + "-"*50)
+        print(f"{'step':<16}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}")
+        for step, values in timings.items():
+            print(f"{step:<16}{len(values):>8}{percentile(values, 50) * 1000:>12.1f}{percentile(values, 99) * 1000:>12.1f}")
+        print("-"*50)
+        print(f"Completed flows: {completed}/{args.flows} in {elapsed:.1f}s ({completed / elapsed:.2f}/s)")
+
+        print(f"\n{'endpoint':<36}{'requests':>10}{'queries/req':>14}")
+        for path, requests_served in sorted(counter.requests.items()):
+            print(f"{path:<36}{requests_served:>10}{counter.queries.get(path, 0) / requests_served:>14.1f}")
+        http_queries = sum(count for role, count in counter.queries.items() if role.startswith('/'))
+        print(f"DB queries per flow: {http_queries / max(completed, 1):.1f} in requests, "
+              f"{counter.queries.get('workers', 0) / max(completed, 1):.1f} in workers (incl. idle polling)")
+        print(f"Simulator: {simulator.stats}")
+        if failures:
+            print(f"\n❌ {len(failures)} failed flow(s), e.g. {failures[0]}")
+        else:
+            print("\n✅ All flows completed")
+
+        app_server.shutdown()
+        simulator_server.shutdown()
+        simulator.callbacks.shutdown(cancel_futures=True)
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 django.setup()
 
+from django.db.models import ProtectedError
+
 from apps.accounts.models import User
+from apps.payments import ledger
 from apps.technicians.models import TechnicianProfile
 
 def cleanup_orphans():
@@ -25,10 +28,17 @@ def cleanup_orphans():
     print(f"Found {count} orphaned technician users")
     
     if count > 0:
+        ledger.close_empty_accounts(orphaned)
+        deleted = 0
         for user in orphaned:
-            print(f"  - Deleting: {user.email}")
-        orphaned.delete()
-        print(f"\nDeleted {count} orphaned users")
+            try:
+                user.delete()
+                print(f"  - Deleted: {user.email}")
+                deleted += 1
+            except ProtectedError:
+                # Users with money history in the ledger are never deleted
+                print(f"  - Kept (has wallet history): {user.email}")
+        print(f"\nDeleted {deleted} orphaned users")
     else:
         print("No orphaned users found")
 
@@ -9,7 +9,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 django.setup()
 
+from django.db.models import ProtectedError
+
 from apps.accounts.models import User
+from apps.payments import ledger
 from apps.technicians.models import TechnicianProfile, TechnicianLocation, Company
 
 def clear_all_users():
@@ -31,10 +34,18 @@ def clear_all_users():
     Company.objects.all().delete()
     print(f"  Deleted {company_count} companies")
     
-    # Delete all users
-    user_count = User.objects.count()
-    User.objects.all().delete()
-    print(f"  Deleted {user_count} users")
+    # Delete all users; those with ledger history are kept (LedgerAccount.user is PROTECT)
+    ledger.close_empty_accounts(User.objects.all())
+    deleted, kept = 0, []
+    for user in User.objects.all():
+        try:
+            user.delete()
+            deleted += 1
+        except ProtectedError:
+            kept.append(user.email)
+    print(f"  Deleted {deleted} users")
+    if kept:
+        print(f"  Kept {len(kept)} users with wallet history in the ledger: {', '.join(kept)}")
     
     print("\nDatabase cleared successfully!")
 
@@ -6,6 +6,7 @@ from pathlib import Path
 from datetime import timedelta
 import os
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import dj_database_url
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -113,6 +114,49 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Uploaded images (profile photos, KYC documents) - see apps/core/blobs.py.
+# Any Django storage class works; blobs are only served through signed links.
+# Production sets BLOB_STORAGE_BUCKET to an S3-compatible bucket that the web,
+# worker and cron services all reach; otherwise blobs go to BLOB_STORAGE_LOCATION.
+BLOB_STORAGE_BUCKET = config("BLOB_STORAGE_BUCKET", default="")
+if BLOB_STORAGE_BUCKET:
+    BLOB_STORAGE = {
+        "BACKEND": "storages.backends.s3.S3Storage",
+        "OPTIONS": {
+            "bucket_name": BLOB_STORAGE_BUCKET,
+            "endpoint_url": config("BLOB_STORAGE_ENDPOINT_URL", default="") or None,
+            "region_name": config("BLOB_STORAGE_REGION", default="") or None,
+            "access_key": config("BLOB_STORAGE_ACCESS_KEY", default=""),
+            "secret_key": config("BLOB_STORAGE_SECRET_KEY", default=""),
+            "location": "blobs",
+            "default_acl": "private",
+        },
+    }
+else:
+    BLOB_STORAGE = {
+        "BACKEND": config("BLOB_STORAGE_BACKEND", default="django.core.files.storage.FileSystemStorage"),
+        "OPTIONS": {"location": config("BLOB_STORAGE_LOCATION", default=str(BASE_DIR / "blobs"))},
+    }
+    # Deployed containers lose everything outside a mounted volume on restart
+    if not DEBUG and Path(BLOB_STORAGE["OPTIONS"]["location"]).resolve().is_relative_to(BASE_DIR):
+        raise ImproperlyConfigured(
+            "BLOB_STORAGE_LOCATION is inside the project directory; set BLOB_STORAGE_BUCKET or point it at a persistent volume"
+        )
+BLOB_URL_BASE = config("BLOB_URL_BASE", default="")  # Prefix for links rendered without a request, e.g. https://api.example.com
+BLOB_PRIVATE_URL_MAX_AGE = 3600  # Seconds a KYC document link stays valid
+
+# Resized image copies (see apps/core/images.py), longest edge in pixels.
+# Rendered by the `manage.py process_image_derivatives --loop` worker, or after each
+# upload's commit when IMAGE_DERIVATIVES_INLINE is set.
+IMAGE_DERIVATIVE_SIZES = {"thumbnail": 160, "card": 480, "full": 1280}
+IMAGE_DERIVATIVES_INLINE = config("IMAGE_DERIVATIVES_INLINE", default=False, cast=bool)
+
+# Resumable chunked uploads of KYC documents (see apps/technicians/uploads.py).
+# Chunks must stay under DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB by default).
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_MAX_BYTES = 15 * 1024 * 1024
+UPLOAD_EXPIRY_HOURS = 24  # Unused uploads and stray chunks are removed by `manage.py clear_expired_uploads`
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "accounts.User"
@@ -133,6 +177,7 @@ REST_FRAMEWORK = {
         "user": "1000/hour",
         "otp": "5/hour",
         "otp_verify": "10/hour",
+        "uploads": "600/hour",
     },
 }
 
@@ -165,6 +210,7 @@ CORS_ALLOW_HEADERS = [
     "user-agent",
     "x-csrftoken",
     "x-requested-with",
+    "idempotency-key",
 ]
 
 CORS_ALLOW_METHODS = [
@@ -188,13 +234,28 @@ if not DEBUG:
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
 
-# Cache - Use in-memory for simplicity
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "unique-snowflake",
+# Cache - shared by the web, worker and cron processes. Idempotency locks, the M-Pesa
+# token lock, the payout rate limiter and circuit breaker, dashboard snapshots and
+# leaderboards are coordinated through it, so anything but a single local process needs
+# REDIS_URL. The in-memory fallback is per process and only suits development.
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
+        }
+    }
+elif not DEBUG:
+    raise ImproperlyConfigured("REDIS_URL must be set when DEBUG=False; the cache must be shared between processes")
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "unique-snowflake",
+        }
     }
-}
 
 # Email Configuration
 EMAIL_BACKEND = config("EMAIL_BACKEND", default="django.core.mail.backends.console.EmailBackend")
@@ -207,11 +268,23 @@ DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="noreply@fundigo.com")
 
 # M-Pesa Configuration
 MPESA_ENVIRONMENT = config("MPESA_ENVIRONMENT", default="sandbox")
+MPESA_BASE_URL = config("MPESA_BASE_URL", default="")  # Overrides the environment URL, e.g. http://127.0.0.1:8900 for daraja_simulator.py
 MPESA_CONSUMER_KEY = config("MPESA_CONSUMER_KEY", default="")
 MPESA_CONSUMER_SECRET = config("MPESA_CONSUMER_SECRET", default="")
 MPESA_SHORTCODE = config("MPESA_SHORTCODE", default="174379")
 MPESA_PASSKEY = config("MPESA_PASSKEY", default="bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919")
 MPESA_CALLBACK_URL = config("MPESA_CALLBACK_URL", default="")
+# Process stored callbacks inside the request instead of via process_mpesa_callbacks (local dev only)
+MPESA_CALLBACK_INLINE = config("MPESA_CALLBACK_INLINE", default=False, cast=bool)
+MPESA_CALLBACK_MAX_ATTEMPTS = 8  # Failed callbacks are then parked with status 'failed'
+MPESA_CALLBACK_RETRY_BASE_SECONDS = 5  # Backoff doubles per attempt, with jitter
+MPESA_CALLBACK_RETRY_MAX_SECONDS = 600
+
+# M-Pesa HTTP client
+MPESA_HTTP_POOL_SIZE = config("MPESA_HTTP_POOL_SIZE", default=20, cast=int)
+MPESA_CONNECT_TIMEOUT = 5
+MPESA_READ_TIMEOUT = 30
+MPESA_TOKEN_REFRESH_MARGIN = 300  # Refresh the OAuth token 5 minutes before expiry
 
 # M-Pesa B2C Configuration (for payouts)
 MPESA_B2C_SHORTCODE = config("MPESA_B2C_SHORTCODE", default="600000")
@@ -220,13 +293,47 @@ MPESA_B2C_SECURITY_CREDENTIAL = config("MPESA_B2C_SECURITY_CREDENTIAL", default=
 MPESA_B2C_RESULT_URL = config("MPESA_B2C_RESULT_URL", default="")
 MPESA_B2C_TIMEOUT_URL = config("MPESA_B2C_TIMEOUT_URL", default="")
 
+# B2C payout scheduler (manage.py drain_payouts)
+PAYOUT_RATE_PER_SECOND = config("PAYOUT_RATE_PER_SECOND", default=5, cast=int)  # Shared by all workers
+PAYOUT_BATCH_SIZE = 50
+PAYOUT_CONCURRENCY = 10  # B2C requests in flight per worker
+PAYOUT_MAX_ATTEMPTS = 6
+PAYOUT_RETRY_BASE_SECONDS = 30  # Backoff doubles per attempt, with jitter
+PAYOUT_RETRY_MAX_SECONDS = 3600
+PAYOUT_BREAKER_THRESHOLD = 5  # Consecutive transient failures before the breaker opens
+PAYOUT_BREAKER_COOLDOWN = 60
+# Submit payouts inside request_payout instead of via drain_payouts (local dev only)
+PAYOUT_INLINE = config("PAYOUT_INLINE", default=False, cast=bool)
+
+# STK Push reconciliation (manage.py reconcile_stk_payments)
+STK_RECONCILE_AFTER_SECONDS = 60  # Query Daraja for payments still processing after this long
+STK_RECONCILE_BATCH_SIZE = 200
+STK_RECONCILE_CONCURRENCY = 10
+STK_RECONCILE_MAX_AGE_SECONDS = 6 * 3600  # Still unknown after this long: marked failed
+
+# Escrow auto-release (manage.py auto_release_escrow)
+ESCROW_AUTO_RELEASE_HOURS = config("ESCROW_AUTO_RELEASE_HOURS", default=72, cast=int)  # Completed jobs not approved within this are released
+ESCROW_AUTO_RELEASE_BATCH_SIZE = 500
+
 # Platform Commission
-PLATFORM_COMMISSION_RATE = config("PLATFORM_COMMISSION_RATE", default=0.15, cast=float)
+PLATFORM_COMMISSION_RATE = config("PLATFORM_COMMISSION_RATE", default=0.15, cast=float)  # Individuals; companies use Company.commission_rate
+FEE_POLICY_CACHE_SECONDS = 300  # Per-process cache of resolved technician rates (see apps/payments/fees.py)
+
+# Technician dashboard snapshots
+TECHNICIAN_DASHBOARD_CACHE_SECONDS = 300  # Snapshots are also evicted on change (see apps/technicians/dashboard.py)
+
+# Public technician leaderboards (top, by skill, by city)
+LEADERBOARD_CACHE_SECONDS = 600  # Boards are also updated in place on change (see apps/technicians/leaderboards.py)
 
 # OTP Configuration
 OTP_LENGTH = 6
 OTP_EXPIRY_SECONDS = 600  # 10 minutes
 
+# Idempotency-Key replay for retried POSTs
+IDEMPOTENCY_KEY_TTL = 86400  # 24 hours
+IDEMPOTENCY_LOCK_TIMEOUT = 120  # Max time a request can hold a key
+IDEMPOTENCY_WAIT_SECONDS = 5  # How long a duplicate waits before 409
+
 # Sentry (Error Tracking) - Optional
 SENTRY_DSN = config("SENTRY_DSN", default="")
 if SENTRY_DSN:
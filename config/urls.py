@@ -6,7 +6,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.http import JsonResponse
-from apps.core.views import health_check
+from apps.core.views import health_check, serve_blob
 
 
 def api_root(request):
@@ -28,6 +28,7 @@ urlpatterns = [
     path('api/', api_root, name='api_root'),
     path('admin/', admin.site.urls),
     path('api/health/', health_check, name='health_check'),
+    path('api/blobs/<path:token>/', serve_blob, name='serve_blob'),
     path('api/auth/', include('apps.accounts.urls')),
     path('api/technicians/', include('apps.technicians.urls')),
     path('api/bookings/', include('apps.bookings.urls')),
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Safaricom Daraja API
+Run: python daraja_simulator.py --port 8900 --latency 200 --error-rate 0.02
+
+Implements OAuth, STK Push, STK Push query and B2C with configurable latency,
+failure rates and asynchronous result callbacks to the CallBackURL/ResultURL
+sent in each request. Point the app at it with MPESA_BASE_URL=http://127.0.0.1:8900
+and set MPESA_CALLBACK_URL / MPESA_B2C_RESULT_URL to URLs of the local server.
+"""
+import argparse
+import json
+import random
+import string
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _code(prefix, length=10):
+    return prefix + ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+class DarajaSimulator:
+    """Simulator state and knobs; shared by all request handler threads"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, decline_rate=0.0,
+                 b2c_failure_rate=0.0, callback_delay=1.0, callback_workers=16):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate  # Share of API calls answered with 503
+        self.decline_rate = decline_rate  # Share of STK pushes the customer cancels
+        self.b2c_failure_rate = b2c_failure_rate  # Share of B2C payments whose result fails
+        self.callback_delay = callback_delay  # Seconds before a result callback is sent
+
+        self.tokens = set()
+        self.stk_results = {}  # CheckoutRequestID -> final ResultCode (once the callback fired)
+        self.stats = {'oauth': 0, 'stk': 0, 'query': 0, 'b2c': 0, 'errors': 0, 'callbacks': 0, 'callback_failures': 0}
+        self.lock = threading.Lock()
+        self.callbacks = ThreadPoolExecutor(max_workers=callback_workers)
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    def send_callback(self, url, payload, on_sent=None):
+        def deliver():
+            time.sleep(self.callback_delay)
+            if on_sent:
+                on_sent()
+            try:
+                request = urllib.request.Request(
+                    url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'}
+                )
+                urllib.request.urlopen(request, timeout=30).read()
+                self.count('callbacks')
+            except Exception:
+                self.count('callback_failures')
+        self.callbacks.submit(deliver)
+
+    # Endpoint implementations return (status, body)
+
+    def oauth(self, headers):
+        if not headers.get('Authorization', '').startswith('Basic '):
+            return 400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'}
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        return 200, {'access_token': token, 'expires_in': '3599'}
+
+    def stk_push(self, body):
+        checkout_request_id = f"ws_CO_{datetime.now().strftime('%d%m%Y%H%M%S')}{uuid.uuid4().hex[:12]}"
+        merchant_request_id = f"{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1"
+        declined = random.random() < self.decline_rate
+
+        if declined:
+            callback = {'ResultCode': 1032, 'ResultDesc': 'Request cancelled by user'}
+        else:
+            callback = {
+                'ResultCode': 0,
+                'ResultDesc': 'The service request is processed successfully.',
+                'CallbackMetadata': {'Item': [
+                    {'Name': 'Amount', 'Value': body.get('Amount')},
+                    {'Name': 'MpesaReceiptNumber', 'Value': _code('S')},
+                    {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                    {'Name': 'PhoneNumber', 'Value': body.get('PhoneNumber')},
+                ]}
+            }
+        payload = {'Body': {'stkCallback': {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            **callback
+        }}}
+
+        def settled():
+            with self.lock:
+                self.stk_results[checkout_request_id] = callback['ResultCode']
+
+        with self.lock:
+            self.stk_results[checkout_request_id] = None
+        self.send_callback(body.get('CallBackURL'), payload, on_sent=settled)
+
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing'
+        }
+
+    def stk_query(self, body):
+        checkout_request_id = body.get('CheckoutRequestID')
+        with self.lock:
+            known = checkout_request_id in self.stk_results
+            result_code = self.stk_results.get(checkout_request_id)
+        if not known:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if result_code is None:
+            return 500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+        return 200, {
+            'ResponseCode': '0',
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': str(result_code),
+            'ResultDesc': 'The service request is processed successfully.' if result_code == 0 else 'Request cancelled by user'
+        }
+
+    def b2c(self, body):
+        conversation_id = _code('AG_', 20)
+        originator_conversation_id = f"{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1"
+        failed = random.random() < self.b2c_failure_rate
+
+        result = {
+            'ResultType': 0,
+            'ResultCode': 2001 if failed else 0,
+            'ResultDesc': 'The initiator information is invalid.' if failed else 'The service request is processed successfully.',
+            'OriginatorConversationID': originator_conversation_id,
+            'ConversationID': conversation_id,
+            'TransactionID': _code('S'),
+        }
+        if not failed:
+            result['ResultParameters'] = {'ResultParameter': [
+                {'Key': 'TransactionAmount', 'Value': body.get('Amount')},
+                {'Key': 'TransactionReceipt', 'Value': result['TransactionID']},
+            ]}
+        self.send_callback(body.get('ResultURL'), {'Result': result})
+
+        return 200, {
+            'ConversationID': conversation_id,
+            'OriginatorConversationID': originator_conversation_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Accept the service request successfully.'
+        }
+
+
+ROUTES = {
+    '/mpesa/stkpush/v1/processrequest': ('stk', 'stk_push'),
+    '/mpesa/stkpushquery/v1/query': ('query', 'stk_query'),
+    '/mpesa/b2c/v1/paymentrequest': ('b2c', 'b2c'),
+}
+
+
+def make_handler(simulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def maybe_fail(self):
+            simulator.delay()
+            if random.random() < simulator.error_rate:
+                simulator.count('errors')
+                self.respond(503, {'errorCode': '503.001.01', 'errorMessage': 'Service Unavailable'})
+                return True
+            return False
+
+        def do_GET(self):
+            if not self.path.startswith('/oauth/v1/generate'):
+                return self.respond(404, {'errorMessage': 'Not found'})
+            simulator.count('oauth')
+            if self.maybe_fail():
+                return
+            self.respond(*simulator.oauth(self.headers))
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            route = ROUTES.get(self.path)
+            if not route:
+                return self.respond(404, {'errorMessage': 'Not found'})
+
+            stat, method = route
+            simulator.count(stat)
+            if self.maybe_fail():
+                return
+
+            token = self.headers.get('Authorization', '').replace('Bearer ', '', 1)
+            with simulator.lock:
+                valid_token = token in simulator.tokens
+            if not valid_token:
+                return self.respond(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+
+            try:
+                body = json.loads(raw or b'{}')
+            except ValueError:
+                return self.respond(400, {'errorCode': '400.002.05', 'errorMessage': 'Invalid Request Payload'})
+            self.respond(*getattr(simulator, method)(body))
+
+    return Handler
+
+
+def serve(host='127.0.0.1', port=8900, **knobs):
+    """Start the simulator on a background thread; returns (server, simulator)"""
+    simulator = DarajaSimulator(**knobs)
+    server = ThreadingHTTPServer((host, port), make_handler(simulator))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, simulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Daraja (M-Pesa) API simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0, help='Mean response latency in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='Latency jitter (+/- ms)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls answered with 503')
+    parser.add_argument('--decline-rate', type=float, default=0.0, help='Share of STK pushes cancelled by the customer')
+    parser.add_argument('--b2c-failure-rate', type=float, default=0.0, help='Share of B2C results that fail')
+    parser.add_argument('--callback-delay', type=float, default=1.0, help='Seconds before result callbacks are sent')
+    args = parser.parse_args()
+
+    server, simulator = serve(
+        args.host, args.port,
+        latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+        decline_rate=args.decline_rate, b2c_failure_rate=args.b2c_failure_rate,
+        callback_delay=args.callback_delay
+    )
+    print(f"Daraja simulator listening on http://{args.host}:{args.port}")
+    print(f"Set MPESA_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"   {simulator.stats}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()